@@ -1,6 +1,11 @@
 from __future__ import print_function
 import sys
 import os
+import importlib
+
+# module __getattr__ (PEP 562) and ProcessPoolExecutor(initializer=...) require Python 3.7+
+if sys.version_info < (3, 7):
+    raise ImportError('PySAR requires Python 3.7+, current version: {}'.format(sys.version.split()[0]))
 
 
 pysar_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -10,14 +15,28 @@ sys.path.insert(1, os.path.join(pysar_path, 'objects'))
 sys.path.insert(1, os.path.join(pysar_path, 'simulation'))
 sys.path.insert(1, os.path.join(pysar_path, 'utils'))
 
-from pysar.version import *
-__version__ = release_version
+os.environ.setdefault('PYSAR_HOME', pysar_path)
+
+
+## Lazy loading (PEP 562) of sub-modules and version info on first attribute access,
+## to keep "import pysar" cheap for short command line jobs, e.g.
+##     import pysar
+##     pysar.reference_point.main(...)   #import pysar.reference_point here
+# names in pysar.version, which grabs the release info with git
+versionNames = ['release_version', 'release_date', 'logo', 'website', 'description']
+
+def __getattr__(name):
+    if name == '__version__':
+        name = 'release_version'
+    if name in versionNames:
+        return getattr(importlib.import_module(__name__+'.version'), name)
 
-try:
-    os.environ['PYSAR_HOME']
-except KeyError:
-    print('Using default PySAR Path: %s' % (pysar_path))
-    os.environ['PYSAR_HOME'] = pysar_path
+    try:
+        return importlib.import_module(__name__+'.'+name)
+    except ModuleNotFoundError as e:
+        if e.name != __name__+'.'+name:
+            raise
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
 
 
 ## Modules dependency graph
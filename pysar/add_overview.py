@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2018, Zhang Yunjun                          #
+# Author:  Zhang Yunjun                                    #
+############################################################
+
+
+import time
+import argparse
+import h5py
+import numpy as np
+from pysar.objects import get_dataset_compression
+from pysar.multilook import multilook_data
+
+
+# group name of the overview pyramid, with one sub-group per factor, e.g. /overview/4/timeseries
+overviewGroupName = 'overview'
+
+
+###########################################################################################
+EXAMPLE = """Example:
+  add_overview.py  timeseries.h5
+  add_overview.py  ifgramStack.h5  -d unwrapPhase coherence
+  add_overview.py  velocity.h5     --min-size 128
+  add_overview.py  timeseries.h5   --compression lz4
+  add_overview.py  timeseries.h5   --remove
+"""
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Add overview pyramid (2x/4x/8x/... nanmean multilooked copies)\n'
+                                                 'of 2D/3D datasets into the /{} group of the same HDF5 file,\n'
+                                                 'for fast display of large files in view.py, tsview.py and save_kmz.py.\n'
+                                                 'Re-run it after the file is modified.'.format(overviewGroupName),
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=EXAMPLE)
+
+    parser.add_argument('file', type=str, help='HDF5 file, e.g. timeseries.h5, ifgramStack.h5, velocity.h5')
+    parser.add_argument('-d', '--dset', dest='dset', nargs='*',
+                        help='dataset(s) to add overview, default: all 2D/3D float datasets.')
+    parser.add_argument('--min-size', dest='min_size', type=int, default=64,
+                        help='min number of rows/columns of the coarsest level, default: 64.')
+    parser.add_argument('-c', '--compression', dest='compression',
+                        help='compression policy, e.g. lzf, gzip, lz4, zstd, default: no.\n'
+                             'check pysar.objects.get_dataset_compression() for details.')
+    parser.add_argument('--memory-size', dest='memory_size', type=float, default=100e6,
+                        help='max number of data to read per loop, default: 100e6.')
+    parser.add_argument('--remove', dest='remove', action='store_true',
+                        help='remove the existing overview pyramid and exit.')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    return inps
+
+
+###########################################################################################
+def get_overview_factors(length, width, min_size=64):
+    """Get the list of overview factors, in power of 2, with at least min_size rows/columns.
+    Example:    get_overview_factors(3000, 2000)  ->  [2, 4, 8, 16]
+    """
+    factors = []
+    factor = 2
+    while min(length, width) // factor >= min_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def get_overview_dataset_list(fname, dsNames=None):
+    """Get the list of 2D/3D float datasets in size of (LENGTH, WIDTH) in the HDF5 file,
+    including the ones in groups, e.g. HDFEOS/GRIDS/timeseries/observation/displacement.
+    Integer and bool datasets, e.g. connectComponent and mask, are skipped,
+    as their multilooked values are not meaningful.
+    """
+    dsList = []
+    with h5py.File(fname, 'r') as f:
+        atr = dict(f.attrs)
+        if 'LENGTH' not in atr.keys():
+            # HDF-EOS5 file with metadata in the dataset
+            def get_attrs(name, obj):
+                if 'LENGTH' in obj.attrs.keys() and 'LENGTH' not in atr.keys():
+                    atr.update(dict(obj.attrs))
+            f.visititems(get_attrs)
+        shape = (int(atr['LENGTH']), int(atr['WIDTH']))
+
+        def get_dataset(name, obj):
+            if (isinstance(obj, h5py.Dataset)
+                    and not name.startswith(overviewGroupName+'/')
+                    and obj.ndim in [2, 3]
+                    and obj.shape[-2:] == shape
+                    and np.issubdtype(obj.dtype, np.floating)):
+                if not dsNames or name.split('/')[-1] in dsNames:
+                    dsList.append(name)
+        f.visititems(get_dataset)
+    return dsList, shape
+
+
+def remove_overview(fname, print_msg=True):
+    """Remove the overview group from the HDF5 file."""
+    with h5py.File(fname, 'a') as f:
+        if overviewGroupName in f.keys():
+            if print_msg:
+                print('delete existing /{} group in file {}'.format(overviewGroupName, fname))
+            del f[overviewGroupName]
+    return fname
+
+
+def add_overview(fname, dsNames=None, min_size=64, compression=None, memory_size=100e6, print_msg=True):
+    """Write overview pyramid of 2D/3D datasets into the /overview group of the same HDF5 file.
+    Each level is the nanmean multilooked data from the full resolution by a factor of 2/4/8/...,
+    as multilook.multilook_data(), and is stored as /overview/{factor}/{dsPath}.
+    Existing overview pyramid is removed first. The MODIFICATION_TIME of the source dataset is
+    recorded, so that levels are skipped while reading once the source is re-written in place.
+
+    Parameters: fname       : str, path of HDF5 file
+                dsNames     : list of str, dataset names to add overview, all 2D/3D float datasets by default
+                min_size    : int, min number of rows/columns of the coarsest level
+                compression : str, compression policy, check pysar.objects.get_dataset_compression()
+                memory_size : float, max number of data to read per loop
+    Returns:    factors     : list of int, overview factors
+    Example:    add_overview('timeseries.h5')
+                data = readfile.read('timeseries.h5', datasetName='20101120', multilook_num=8)[0]
+    """
+    dsList, (length, width) = get_overview_dataset_list(fname, dsNames)
+    factors = get_overview_factors(length, width, min_size=min_size)
+    remove_overview(fname, print_msg=print_msg)
+    if not dsList or not factors:
+        if print_msg:
+            print('no dataset / image too small (min size: {}) to add overview, skip.'.format(min_size))
+        return []
+    if print_msg:
+        print('add overview with factors of {} for datasets: {}'.format(factors, dsList))
+
+    with h5py.File(fname, 'a') as f:
+        grp = f.create_group(overviewGroupName)
+        grp.attrs['FACTORS'] = ','.join(str(i) for i in factors)
+        grp.attrs['MIN_SIZE'] = str(min_size)
+        grp.attrs['CREATION_TIME'] = str(time.time())
+
+        for dsName in dsList:
+            ds = f[dsName]
+            codec, comp_kwargs = get_dataset_compression(compression,
+                                                         dsName=dsName.split('/')[-1],
+                                                         dtype=np.float32)
+            dsOutList = []
+            for factor in factors:
+                shape = ds.shape[:-2] + (length // factor, width // factor)
+                dso = f.create_dataset('{}/{}/{}'.format(overviewGroupName, factor, dsName),
+                                       shape=shape,
+                                       dtype=np.float32,
+                                       chunks=True,
+                                       **comp_kwargs)
+                dso.attrs['FACTOR'] = str(factor)
+                # fingerprint of the source data, to detect stale overview, check readfile.get_overview_factor()
+                dso.attrs['SOURCE_MODIFICATION_TIME'] = str(ds.attrs.get('MODIFICATION_TIME', None))
+                if codec:
+                    dso.attrs['COMPRESSION'] = codec
+                dsOutList.append(dso)
+                if print_msg:
+                    print('create dataset {} in size of {}'.format(dso.name, shape))
+
+            # read full resolution data in blocks of rows, in multiple of the max factor
+            num_row = int(memory_size / max(1, ds.size // length))
+            num_row = max(factors[-1], num_row // factors[-1] * factors[-1])
+            for y0 in range(0, length, num_row):
+                y1 = min(y0 + num_row, length)
+                data = np.array(ds[..., y0:y1, :], dtype=np.float32)
+                for factor, dso in zip(factors, dsOutList):
+                    data_mli = multilook_data(data, factor, factor)
+                    dso[..., y0//factor:y0//factor+data_mli.shape[-2], :] = data_mli
+    if print_msg:
+        print('finished writing overview to file {}'.format(fname))
+    return factors
+
+
+###########################################################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    if inps.remove:
+        remove_overview(inps.file)
+        return inps.file
+
+    start_time = time.time()
+    add_overview(inps.file,
+                 dsNames=inps.dset,
+                 min_size=inps.min_size,
+                 compression=inps.compression,
+                 memory_size=inps.memory_size)
+    print('time used: {:.1f} secs'.format(time.time() - start_time))
+    return inps.file
+
+
+###########################################################################################
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2019, Zhang Yunjun                          #
+# Author:  Zhang Yunjun                                    #
+############################################################
+
+
+import os
+import time
+import random
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from pysar.objects import sensor, ifgramStack
+from pysar.utils import ptime, network as pnet
+from pysar import ifgram_inversion as ifginv
+from pysar.simulation import simulation as psim
+
+sensorNames = [i.capitalize() for i in sensor.sensorNames]
+methodList = ['sequential', 'hierarchical', 'delaunay', 'mst', 'star', 'all']
+
+# number of bytes per pixel per interferogram in ifgramStack.h5,
+# for unwrapPhase (float32), coherence (float32) and connectComponent (bool)
+ifgramByteNum = 4 + 4 + 1
+
+# global variables shared by all trials in each worker process
+netDict = {}
+simDict = {}
+
+
+###########################################################################################
+EXAMPLE = """example:
+  benchmark_network.py bl_list.txt
+  benchmark_network.py bl_list.txt -m sequential mst star --num-trial 100 --num-sample 1000
+  benchmark_network.py bl_list.txt --conn-num 5 --decor-day 100 --coh-resid 0.1 -L 75
+  benchmark_network.py bl_list.txt --unw-err-ratio 0.05 --num-worker 4 --plot
+"""
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Benchmark interferogram network designs with Monte-Carlo simulation:\n'
+                                                 '  simulate decorrelated stacks of interferograms for each network,\n'
+                                                 '  invert them into time-series and estimate the velocity, and report\n'
+                                                 '  the velocity bias/RMSE against the ifgram number, inversion time and storage.',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=EXAMPLE)
+
+    parser.add_argument('baseline_file', help='baseline list file of all SLCs, e.g.'+pnet.BASELINE_LIST_FILE)
+    parser.add_argument('-m', '--method', dest='methodList', nargs='+', default=methodList[:5],
+                        choices=methodList, help='network selection methods to compare (default: %(default)s).')
+    parser.add_argument('-o', '--output', dest='outfile', default='benchmark_network.txt',
+                        help='output text file of the benchmark result (default: %(default)s).')
+
+    net = parser.add_argument_group('Network', 'options of network selection, same as select_network.py')
+    net.add_argument('--conn-num', dest='connNum', type=int, default=3,
+                     help='number of pairs per new acquisition for sequential method (default: %(default)s).')
+    net.add_argument('--temp-perp-list', dest='tempPerpList', default='16,1600;32,800;48,600;64,200',
+                     help='list of max temp/perp baseline for hierarchical method (default: %(default)s).')
+    net.add_argument('--noweight-delaunay', dest='norm', action='store_false',
+                     help='do not normalize temp/perp baseline for delaunay method.')
+    net.add_argument('--master-date', dest='masterDate',
+                     help='master date for star method, auto for the one near the baseline center.')
+
+    sim = parser.add_argument_group('Simulation')
+    sim.add_argument('--sensor', dest='sensor', default='Sen', type=str.capitalize, choices=sensorNames,
+                     help='SAR sensor name (default: %(default)s).')
+    sim.add_argument('--inc-angle', dest='incAngle', type=float, default=33.4,
+                     help='incidence angle in degree (default: %(default)s).')
+    sim.add_argument('--vel', dest='velocity', type=float, default=0.01,
+                     help='linear velocity in m/year (default: %(default)s).')
+    sim.add_argument('--decor-day', dest='decorDay', type=float, default=200.,
+                     help='decorrelation rate in days, time for coherence to drop to 1/e (default: %(default)s).')
+    sim.add_argument('--coh-resid', dest='cohResid', type=float, default=0.2,
+                     help='long-term coherence, minimum attainable coherence (default: %(default)s).')
+    sim.add_argument('-L', '--looks', dest='looks', type=int, default=20,
+                     help='number of independent looks for decorrelation noise (default: %(default)s).')
+    sim.add_argument('--unw-err-ratio', dest='unwErrRatio', type=float, default=0.,
+                     help='percentage of interferograms with unwrapping errors (default: %(default)s).')
+    sim.add_argument('--num-trial', dest='numTrial', type=int, default=20,
+                     help='number of simulated stacks per network (default: %(default)s).')
+    sim.add_argument('--num-sample', dest='numSample', type=int, default=1000,
+                     help='number of pixels per simulated stack (default: %(default)s).')
+    sim.add_argument('--seed', dest='seed', type=int,
+                     help='seed of the random number generators, for reproducible result.')
+
+    inv = parser.add_argument_group('Inversion')
+    inv.add_argument('-w', '--weight-function', dest='weightFunc', default='no', choices={'var', 'fim', 'coh', 'no'},
+                     help='function to convert the simulated coherence to weight (default: %(default)s).')
+    inv.add_argument('--num-worker', dest='numWorker', type=int, default=4,
+                     help='number of processes to run trials in parallel (default: %(default)s).')
+    inv.add_argument('--plot', dest='plot', action='store_true',
+                     help='plot velocity RMSE against ifgram number and inversion time.')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    inps.numWorker = max(1, min(inps.numWorker, multiprocessing.cpu_count()))
+    inps.tempPerpList = [[float(j) for j in i.split(',')]
+                         for i in inps.tempPerpList.split(';')]
+    return inps
+
+
+###########################################################################################
+def select_network(method, date_list, pbase_list, inps):
+    """Select network with the given method, as select_network.py
+    Parameters: method     : str, network selection method
+                date_list  : list of str in YYYYMMDD format
+                pbase_list : list of float, perpendicular baseline in meters
+    Returns:    date12_list : list of str in YYYYMMDD_YYYYMMDD format
+    """
+    kwargs = dict(date12_format='YYYYMMDD_YYYYMMDD')
+    if method == 'all':
+        date12_list = pnet.select_pairs_all(date_list, **kwargs)
+    elif method == 'delaunay':
+        date12_list = pnet.select_pairs_delaunay(date_list, pbase_list, inps.norm, **kwargs)
+    elif method == 'star':
+        date12_list = pnet.select_pairs_star(date_list, inps.masterDate, pbase_list, **kwargs)
+    elif method == 'sequential':
+        date12_list = pnet.select_pairs_sequential(date_list, inps.connNum, **kwargs)
+    elif method == 'hierarchical':
+        date12_list = pnet.select_pairs_hierarchical(date_list, pbase_list, inps.tempPerpList, **kwargs)
+    elif method == 'mst':
+        date12_list = pnet.select_pairs_mst(date_list, pbase_list, **kwargs)
+    else:
+        raise ValueError('Unrecoganized select method: '+method)
+    return date12_list
+
+
+def prepare_network(date12_list, inps):
+    """Prepare the simulation and inversion inputs shared by all trials of one network
+    Parameters: date12_list : list of str in YYYYMMDD_YYYYMMDD format
+    Returns:    net : dict, with date12_list, noise-free ifgram phase, simulated coherence,
+                      design matrices and square root of weight of the network
+    """
+    date_list = pnet.read_baseline_file(inps.baseline_file)[0]
+    wvl = sensor.wavelength(inps.sensor)
+
+    # noise-free phase and coherence
+    ts_sim = psim.velocity2timeseries(date_list, vel=inps.velocity)
+    ifgram_sim = psim.timeseries2ifgram(ts_sim, date_list, date12_list, wvl=wvl)
+    coh_sim = pnet.simulate_coherence(date12_list,
+                                      baseline_file=inps.baseline_file,
+                                      sensor_name=inps.sensor,
+                                      inc_angle=inps.incAngle,
+                                      decor_time=inps.decorDay,
+                                      coh_resid=inps.cohResid)
+
+    # design matrix of time-series of dates within the network
+    A, B = ifgramStack.get_design_matrix4timeseries(date12_list)[0:2]
+    m_dates = [i.split('_')[0] for i in date12_list]
+    s_dates = [i.split('_')[1] for i in date12_list]
+    net_date_list = sorted(list(set(m_dates + s_dates)))
+    tbase = np.array(ptime.date_list2tbase(net_date_list)[0], np.float32) / 365.25
+    tbase_diff = np.diff(tbase).reshape(-1, 1)
+
+    # weight, the same for all samples
+    weight_sqrt = None
+    if inps.weightFunc != 'no':
+        weight = ifginv.coherence2weight(np.array(coh_sim, np.float32),
+                                         weight_func=inps.weightFunc,
+                                         L=inps.looks,
+                                         print_msg=False)
+        weight_sqrt = np.sqrt(weight).reshape(-1, 1)
+
+    net = {}
+    net['date12_list'] = date12_list
+    net['ifgram_sim'] = ifgram_sim
+    net['coh_sim'] = coh_sim
+    net['A'] = A
+    net['B'] = B
+    net['tbase'] = tbase
+    net['tbase_diff'] = tbase_diff
+    net['weight_sqrt'] = weight_sqrt
+    net['num_date'] = len(net_date_list)
+    net['phase2range'] = -1 * wvl / (4.*np.pi)
+    return net
+
+
+def init_worker(net_dict, sim_dict):
+    """Share the network and simulation settings with all trials in the worker process"""
+    netDict.update(net_dict)
+    simDict.update(sim_dict)
+    return
+
+
+def run_trial(method, seed=None):
+    """Simulate one stack of interferograms for the network of the given method and invert it
+    Parameters: method : str, network selection method, key of netDict
+                seed   : int, seed of the random number generators
+    Returns:    vel    : 1D np.array in size of (num_sample,), estimated velocity in m/year
+                t_inv  : float, time used for the inversion in seconds
+    """
+    net = netDict[method]
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
+
+    # simulate interferograms with decorrelation noise and unwrapping errors
+    num_sample = simDict['num_sample']
+    ifgram = psim.simulate_decorrelation_noises(net['date12_list'], net['coh_sim'],
+                                                L=simDict['looks'],
+                                                size=num_sample)
+    ifgram += net['ifgram_sim']
+    if simDict['unw_err_ratio'] > 0:
+        ifgram = psim.add_unw_err2ifgram(ifgram, percentage=simDict['unw_err_ratio'], print_msg=False)[0]
+
+    # invert time-series with the batched solver
+    # WLS with the same weight for all samples is OLS with weighted design matrix and observations,
+    # which is solved with one lstsq call for all samples
+    t0 = time.time()
+    A, B = net['A'], net['B']
+    if net['weight_sqrt'] is not None:
+        A = A * net['weight_sqrt']
+        B = B * net['weight_sqrt']
+        ifgram *= net['weight_sqrt']
+    ts = ifginv.estimate_timeseries_batch(A, B, net['tbase_diff'], ifgram)[0]
+    ts *= net['phase2range']
+
+    # estimate velocity
+    G = np.ones((net['num_date'], 2), np.float32)
+    G[:, 0] = net['tbase']
+    vel = np.linalg.lstsq(G, ts, rcond=None)[0][0, :]
+    t_inv = time.time() - t0
+    return vel, t_inv
+
+
+def run_trials(inps):
+    """Run all trials of all networks, in parallel with inps.numWorker processes
+    Returns:    vel_dict  : dict of 1D np.array, estimated velocity of all samples for each network
+                time_dict : dict of 1D np.array, inversion time of all trials for each network
+    """
+    sim_dict = {'num_sample'    : inps.numSample,
+                'looks'         : inps.looks,
+                'unw_err_ratio' : inps.unwErrRatio}
+    task_list = [(method, i) for method in inps.methodList for i in range(inps.numTrial)]
+    seed_list = [None] * len(task_list)
+    if inps.seed is not None:
+        seed_list = [(inps.seed + i) % 2**32 for i in range(len(task_list))]
+
+    print('run {} trials of {} pixels for {} networks with {} processes'.format(inps.numTrial,
+                                                                                inps.numSample,
+                                                                                len(inps.methodList),
+                                                                                inps.numWorker))
+    vel_dict = dict((method, []) for method in inps.methodList)
+    time_dict = dict((method, []) for method in inps.methodList)
+    prog_bar = ptime.progressBar(maxValue=len(task_list))
+    if inps.numWorker > 1:
+        with ProcessPoolExecutor(max_workers=inps.numWorker,
+                                 initializer=init_worker,
+                                 initargs=(inps.netDict, sim_dict)) as executor:
+            results = executor.map(run_trial, [i[0] for i in task_list], seed_list)
+            for i, (vel, t_inv) in enumerate(results):
+                vel_dict[task_list[i][0]].append(vel)
+                time_dict[task_list[i][0]].append(t_inv)
+                prog_bar.update(i+1, every=max(1, len(task_list)//20))
+    else:
+        init_worker(inps.netDict, sim_dict)
+        for i, (method, j) in enumerate(task_list):
+            vel, t_inv = run_trial(method, seed_list[i])
+            vel_dict[method].append(vel)
+            time_dict[method].append(t_inv)
+            prog_bar.update(i+1, every=max(1, len(task_list)//20))
+    prog_bar.close()
+
+    for method in inps.methodList:
+        vel_dict[method] = np.hstack(vel_dict[method])
+        time_dict[method] = np.array(time_dict[method])
+    return vel_dict, time_dict
+
+
+def summarize_result(vel_dict, time_dict, inps):
+    """Calculate the velocity bias/RMSE and compute cost of each network
+    Returns:    stat_list : list of dict, one for each network
+    """
+    stat_list = []
+    for method in inps.methodList:
+        net = inps.netDict[method]
+        vel_err = vel_dict[method] - inps.velocity
+        vel_err = vel_err[np.isfinite(vel_err)]
+        stat = {}
+        stat['method'] = method
+        stat['num_date'] = net['num_date']
+        stat['num_ifgram'] = len(net['date12_list'])
+        stat['avg_coh'] = float(np.mean(net['coh_sim']))
+        stat['bias'] = float(np.mean(vel_err))
+        stat['std'] = float(np.std(vel_err))
+        stat['rmse'] = float(np.sqrt(np.mean(np.square(vel_err))))
+        # inversion time per million pixels
+        stat['time'] = float(np.median(time_dict[method])) / inps.numSample * 1e6
+        # storage of ifgramStack.h5 per million pixels
+        stat['storage'] = stat['num_ifgram'] * ifgramByteNum
+        stat_list.append(stat)
+    return stat_list
+
+
+def write_result(stat_list, inps):
+    """Print and write the benchmark result into text file"""
+    header  = '# Monte-Carlo benchmark of interferogram network designs\n'
+    header += '# baseline file: {}\n'.format(os.path.abspath(inps.baseline_file))
+    header += '# sensor: {}, incidence angle: {} deg, looks: {}\n'.format(inps.sensor, inps.incAngle, inps.looks)
+    header += '# velocity: {} m/yr, decorrelation: {} days, residual coherence: {}\n'.format(inps.velocity,
+                                                                                             inps.decorDay,
+                                                                                             inps.cohResid)
+    header += '# unwrap error ratio: {}, weight function: {}\n'.format(inps.unwErrRatio, inps.weightFunc)
+    header += '# trials: {} x {} pixels per network\n'.format(inps.numTrial, inps.numSample)
+    header += '# time: median inversion time per 1e6 pixels in seconds\n'
+    header += '# storage: size of unwrapPhase/coherence/connectComponent per 1e6 pixels in MB\n'
+    header += '#{:<13} {:>6} {:>8} {:>8} {:>12} {:>12} {:>12} {:>10} {:>10}\n'.format('method', 'date',
+                                                                                         'ifgram', 'avgCoh',
+                                                                                         'bias[mm/yr]',
+                                                                                         'std[mm/yr]',
+                                                                                         'rmse[mm/yr]',
+                                                                                         'time[s]',
+                                                                                         'storage')
+    lines = []
+    for stat in stat_list:
+        lines.append(' {:<13} {:>6d} {:>8d} {:>8.3f} {:>12.3f} {:>12.3f} {:>12.3f} {:>10.2f} {:>10.0f}\n'.format(
+            stat['method'], stat['num_date'], stat['num_ifgram'], stat['avg_coh'],
+            stat['bias']*1e3, stat['std']*1e3, stat['rmse']*1e3, stat['time'], stat['storage']))
+
+    print(header + ''.join(lines))
+    with open(inps.outfile, 'w') as f:
+        f.write(header + ''.join(lines))
+    print('save benchmark result to file: {}'.format(inps.outfile))
+    return inps.outfile
+
+
+def plot_result(stat_list, inps):
+    """Plot velocity RMSE against the ifgram number and inversion time"""
+    import matplotlib.pyplot as plt
+    fig, axs = plt.subplots(nrows=1, ncols=2, figsize=[10, 4], sharey=True)
+    for stat in stat_list:
+        for ax, key in zip(axs, ['num_ifgram', 'time']):
+            ax.plot(stat[key], stat['rmse']*1e3, 'o', ms=8)
+            ax.annotate(stat['method'], xy=(stat[key], stat['rmse']*1e3),
+                        xytext=(5, 5), textcoords='offset points')
+    axs[0].set_xlabel('Number of interferograms')
+    axs[1].set_xlabel('Inversion time per 1e6 pixels [sec]')
+    axs[0].set_ylabel('Velocity RMSE [mm/yr]')
+    for ax in axs:
+        ax.tick_params(direction='in')
+
+    out_file = os.path.splitext(inps.outfile)[0]+'.png'
+    plt.savefig(out_file, bbox_inches='tight', dpi=150)
+    print('save figure to file: {}'.format(out_file))
+    plt.close(fig)
+    return out_file
+
+
+###########################################################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    start_time = time.time()
+
+    # prepare networks
+    date_list, pbase_list = pnet.read_baseline_file(inps.baseline_file)[0:2]
+    print('number of acquisitions: {}'.format(len(date_list)))
+    inps.netDict = {}
+    for method in inps.methodList:
+        date12_list = select_network(method, date_list, pbase_list, inps)
+        inps.netDict[method] = prepare_network(date12_list, inps)
+        print('{:<13}: {} interferograms'.format(method, len(date12_list)))
+
+    # run Monte-Carlo trials
+    vel_dict, time_dict = run_trials(inps)
+
+    # output
+    stat_list = summarize_result(vel_dict, time_dict, inps)
+    write_result(stat_list, inps)
+    if inps.plot:
+        plot_result(stat_list, inps)
+
+    m, s = divmod(time.time()-start_time, 60)
+    print('time used: {:02.0f} mins {:02.1f} secs.\n'.format(m, s))
+    return
+
+
+###########################################################################################
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ from scipy import linalg
 from scipy.special import gamma
 from pysar.utils import ptime, readfile, writefile, utils as ut
 from pysar.objects import timeseries, geometry
+from pysar.ifgram_inversion import split2boxes
 
 
 # key configuration parameter name
@@ -81,6 +82,9 @@ def create_parser():
                         help='Use phase velocity instead of phase for inversion constrain.')
     parser.add_argument('-p', '--poly-order', dest='polyOrder', type=int, default=2,
                         help='polynomial order number of temporal deformation model, default = 2')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data (= num_date * num_row * num_col) to read per loop\n' +
+                             'default: 100e6; adjust it according to your computer memory.')
     parser.add_argument('--update', dest='update_mode', action='store_true',
                         help='Enable update mode, and skip inversion if:\n'+
                              '1) output timeseries file already exists, readable '+
@@ -197,7 +201,7 @@ def design_matrix4deformation(inps):
     msg = 'ordinal least squares (OLS) inversion with L2-norm minimization on: phase'
     if inps.phaseVelocity:
         msg += ' velocity'
-    if inps.rangeDist.size != 1:
+    if inps.geom_file:
         msg += ' (pixel-wisely)'
     print(msg)
 
@@ -222,35 +226,51 @@ def design_matrix4deformation(inps):
     return A_def
 
 
-def read_geometry(inps):
-    ts_obj = timeseries(inps.timeseries_file)
+def read_geometry(ts_file, geom_file=None, box=None, print_msg=True):
+    """Read geometry info in 0/2/3D for DEM error estimation
+    Parameters: ts_file   : str, path of time-series file
+                geom_file : str, path of geometry file, None for the mean value from time-series file
+                box       : tuple of 4 int, for (x0, y0, x1, y1) of the area of interest
+    Returns:    sin_inc_angle : 0/1D np.array, sine of incidence angle
+                range_dist    : 0/1D np.array, slant range distance in meter
+                pbase         : 2D np.array in size of (num_date, num_pixel) or (num_date, 1),
+                                perpendicular baseline in meter
+    Example:    sin_inc_angle, range_dist, pbase = read_geometry('timeseries.h5',
+                                                                 'INPUTS/geometryRadar.h5',
+                                                                 box=(0, 100, 500, 200))
+    """
+    ts_obj = timeseries(ts_file)
     ts_obj.open(print_msg=False)
     # 2D / 3D geometry
-    if inps.geom_file:
-        geom_obj = geometry(inps.geom_file)
-        geom_obj.open()
-        print(('read 2D incidenceAngle,slantRangeDistance from {} file:'
-               ' {}').format(geom_obj.name, os.path.basename(geom_obj.file)))
-        inps.incAngle = geom_obj.read(datasetName='incidenceAngle', print_msg=False).flatten()
-        inps.rangeDist = geom_obj.read(datasetName='slantRangeDistance', print_msg=False).flatten()
+    if geom_file:
+        geom_obj = geometry(geom_file)
+        geom_obj.open(print_msg=print_msg)
+        if print_msg:
+            print(('read 2D incidenceAngle,slantRangeDistance from {} file:'
+                   ' {}').format(geom_obj.name, os.path.basename(geom_obj.file)))
+        inc_angle = geom_obj.read(datasetName='incidenceAngle', box=box, print_msg=False).flatten()
+        range_dist = geom_obj.read(datasetName='slantRangeDistance', box=box, print_msg=False).flatten()
         if 'bperp' in geom_obj.datasetNames:
-            print('read 3D bperp from {} file: {} ...'.format(geom_obj.name, os.path.basename(geom_obj.file)))
+            if print_msg:
+                print('read 3D bperp from {} file: {} ...'.format(geom_obj.name, os.path.basename(geom_obj.file)))
             dset_list = ['bperp-{}'.format(d) for d in ts_obj.dateList]
-            inps.pbase = geom_obj.read(datasetName=dset_list, print_msg=False).reshape((ts_obj.numDate, -1))
-            inps.pbase -= np.tile(inps.pbase[ts_obj.refIndex, :].reshape(1, -1), (ts_obj.numDate, 1))
+            pbase = geom_obj.read(datasetName=dset_list, box=box, print_msg=False).reshape((ts_obj.numDate, -1))
+            pbase -= np.tile(pbase[ts_obj.refIndex, :].reshape(1, -1), (ts_obj.numDate, 1))
         else:
-            print('read mean bperp from {} file'.format(ts_obj.name))
-            inps.pbase = ts_obj.pbase.reshape((-1, 1))
+            if print_msg:
+                print('read mean bperp from {} file'.format(ts_obj.name))
+            pbase = ts_obj.pbase.reshape((-1, 1))
 
     # 0D geometry
     else:
-        print('read mean incidenceAngle,slantRangeDistance,bperp value from {} file'.format(ts_obj.name))
-        inps.incAngle = ut.incidence_angle(ts_obj.metadata, dimension=0)
-        inps.rangeDist = ut.range_distance(ts_obj.metadata, dimension=0)
-        inps.pbase = ts_obj.pbase.reshape((-1, 1))
+        if print_msg:
+            print('read mean incidenceAngle,slantRangeDistance,bperp value from {} file'.format(ts_obj.name))
+        inc_angle = ut.incidence_angle(ts_obj.metadata, dimension=0)
+        range_dist = ut.range_distance(ts_obj.metadata, dimension=0)
+        pbase = ts_obj.pbase.reshape((-1, 1))
 
-    inps.sinIncAngle = np.sin(inps.incAngle * np.pi / 180.)
-    return inps
+    sin_inc_angle = np.sin(inc_angle * np.pi / 180.)
+    return sin_inc_angle, range_dist, pbase
 
 
 def estimate_dem_error(ts0, A0, tbase, drop_date=None, phaseVelocity=False, num_step=0):
@@ -312,111 +332,75 @@ def estimate_dem_error(ts0, A0, tbase, drop_date=None, phaseVelocity=False, num_
     return delta_z, ts_cor, ts_res, step_def
 
 
-def correct_dem_error(inps, A_def):
-    """Correct DEM error of input timeseries file"""
-    # Read Date Info
-    ts_obj = timeseries(inps.timeseries_file)
-    ts_obj.open()
-    num_date = ts_obj.numDate
-    num_pixel = ts_obj.numPixel
-    tbase = np.array(ts_obj.tbase, np.float32) / 365.25
+def estimate_dem_error_batch(ts0, A_geom0, A_def, tbase, drop_date=None, phaseVelocity=False, num_step=0):
+    """Estimate DEM error of many pixels at once, with pixel-wise geometry.
+    The design matrix of each pixel is [a_geom, A_def], with a_geom varying from pixel to pixel
+    and A_def shared by all pixels. Eliminating the deformation model parameters from the normal
+    equations gives the least squares solution in closed-form for all pixels at once:
+        delta_z = (a_perp^T ts) / (a_perp^T a_perp), with a_perp = (I - A_def A_def^+) a_geom
+        X_def   = A_def^+ (ts - a_geom delta_z)
+    Pixels with a_geom in the span of A_def, i.e. a_perp ~ 0, are not estimable and set to zero.
+    Parameters: ts0     : 2D np.array in size of (numDate, numPixel), original displacement time-series
+                A_geom0 : 2D np.array in size of (numDate, numPixel) or (numDate, 1),
+                          design matrix of DEM error for each pixel or for all pixels
+                A_def   : 2D np.array in size of (numDate, model_num), design matrix of deformation model
+                tbase / drop_date / phaseVelocity / num_step : same as estimate_dem_error()
+    Returns:    same as estimate_dem_error()
+    Example:    A_geom = pbase / (range_dist * sin_inc_angle)
+                delta_z, ts_cor, ts_res, step_def = estimate_dem_error_batch(ts, A_geom, A_def, tbase, drop_date)
+    """
+    if len(ts0.shape) == 1:
+        ts0 = ts0.reshape(-1, 1)
+    if drop_date is None:
+        drop_date = np.ones(ts0.shape[0], np.bool_)
+    A_geom0 = np.array(A_geom0, np.float64).reshape(ts0.shape[0], -1)
+    A_def = np.array(A_def, np.float64)
 
-    num_step = len(inps.stepFuncDate)
-    drop_date, inps.excludeDate = read_exclude_date(inps.excludeDate, ts_obj.dateList)
-    if inps.polyOrder > np.sum(drop_date):
-        raise ValueError(("input poly order {} > number of acquisition {}!"
-                          " Reduce it!").format(inps.polyOrder, np.sum(drop_date)))
+    # Prepare Design matrix and observations ts for inversion
+    A_geom = A_geom0[drop_date, :]
+    A = A_def[drop_date, :]
+    ts = ts0[drop_date, :]
+    if phaseVelocity:
+        tbase_diff = np.diff(tbase[drop_date, :], axis=0)
+        A_geom = np.diff(A_geom, axis=0) / tbase_diff
+        A = np.diff(A, axis=0) / tbase_diff
+        ts = np.diff(ts, axis=0) / tbase_diff
+
+    # DEM error: projection of the geometry design matrix onto the orthogonal complement of A_def
+    A_pinv = linalg.pinv(A)
+    A_perp = A_geom - np.dot(A, np.dot(A_pinv, A_geom))
+    num = np.sum(A_perp * ts, axis=0)
+    den = np.sum(np.square(A_perp), axis=0)
+    flag = den > 1e-10 * np.sum(np.square(A_geom), axis=0)
+    delta_z = np.where(flag, num / np.where(flag, den, 1.), 0.)
+
+    # deformation model: X = [constC, vel, acc, deltaAcc, ..., step1, step2, ...]
+    X = np.dot(A_pinv, ts - A_geom * delta_z)
 
-    # Read time-series Data
-    ts_data = ts_obj.read(print_msg=True).reshape((num_date, -1))
+    # Prepare Outputs
+    ts_cor = ts0 - A_geom0 * delta_z
+    ts_res = ts_cor - np.dot(A_def, X)
 
-    ##-------------------------------- Loop for L2-norm inversion  --------------------------------##
-    print('inverting DEM error ...')
-    delta_z = np.zeros(num_pixel, dtype=np.float32)
-    ts_cor = np.zeros((num_date, num_pixel), dtype=np.float32)
-    ts_res = np.zeros((num_date, num_pixel), dtype=np.float32)
+    step_def = None
     if num_step > 0:
-        step_model = np.zeros((num_step, num_pixel), dtype=np.float32)
-
-    print('skip pixels with zero/NaN value in all acquisitions')
-    ts_mean = np.nanmean(ts_data, axis=0)
-    mask = np.multiply(~np.isnan(ts_mean), ts_mean != 0.)
-    del ts_mean
-
-    if inps.rangeDist.size == 1:
-        A_geom = inps.pbase / (inps.rangeDist * inps.sinIncAngle)
-        A = np.hstack((A_geom, A_def))
-
-        ts_data = ts_data[:, mask]
-        (delta_z_i,
-         ts_cor_i,
-         ts_res_i,
-         step_model_i) = estimate_dem_error(ts_data, A,
-                                            tbase=tbase,
-                                            drop_date=drop_date,
-                                            phaseVelocity=inps.phaseVelocity,
-                                            num_step=num_step)
-        delta_z[mask] = delta_z_i
-        ts_cor[:, mask] = ts_cor_i
-        ts_res[:, mask] = ts_res_i
-        if num_step > 0:
-            step_model[:, mask] = step_model_i
-    else:
-        # mask
-        print('skip pixels with zero/nan value in geometry: incidence angle or range distance')
-        mask *= np.multiply(inps.sinIncAngle != 0., inps.rangeDist != 0.)
+        step_def = X[-1*num_step:, :].reshape(num_step, -1)
+    return delta_z, ts_cor, ts_res, step_def
 
-        num_pixel2inv = np.sum(mask)
-        idx_pixel2inv = np.where(mask)[0]
-        print(('number of pixels to invert: {} out of {}'
-               ' ({:.1f}%)').format(num_pixel2inv,
-                                    num_pixel,
-                                    num_pixel2inv/num_pixel*100))
-
-        # update data matrix to save memory and IO
-        ts_data = ts_data[:, mask]
-        inps.rangeDist = inps.rangeDist[mask]
-        inps.sinIncAngle = inps.sinIncAngle[mask]
-        if inps.pbase.shape[1] != 1:
-            inps.pbase = inps.pbase[:, mask]
-
-        # loop pixel by pixel
-        prog_bar = ptime.progressBar(maxValue=num_pixel2inv)
-        for i in range(num_pixel2inv):
-            prog_bar.update(i+1, every=1000, suffix='{}/{}'.format(i+1, num_pixel2inv))
-            idx = idx_pixel2inv[i]
-
-            # design matrix
-            if inps.pbase.shape[1] == 1:
-                pbase = inps.pbase
-            else:
-                pbase = inps.pbase[:, i].reshape(-1, 1)
-            A_geom = pbase / (inps.rangeDist[i] * inps.sinIncAngle[i])
-            A = np.hstack((A_geom, A_def))
-
-            (delta_z_i,
-             ts_cor_i,
-             ts_res_i,
-             step_model_i) = estimate_dem_error(ts_data[:, i], A,
-                                                tbase=tbase,
-                                                drop_date=drop_date,
-                                                phaseVelocity=inps.phaseVelocity,
-                                                num_step=num_step)
-            delta_z[idx:idx+1] = delta_z_i
-            ts_cor[:, idx:idx+1] = ts_cor_i
-            ts_res[:, idx:idx+1] = ts_res_i
-            if num_step > 0:
-                step_model[:, idx:idx+1] = step_model_i
-        prog_bar.close()
-    del ts_data
-
-    ##---------------------------------------- Output  -----------------------------------------##
-    # prepare for output
-    ts_cor = ts_cor.reshape((num_date, ts_obj.length, ts_obj.width))
-    ts_res = ts_res.reshape((num_date, ts_obj.length, ts_obj.width))
-    delta_z = delta_z.reshape((ts_obj.length, ts_obj.width))
-    if num_step > 0:
-        step_model = step_model.reshape((num_step, ts_obj.length, ts_obj.width))
+
+def layout_output_files(inps, ts_obj, num_step=0):
+    """Create output HDF5 files with the same metadata and empty datasets, to be filled block by block
+    Parameters: inps     : Namespace, with outfile and configKeys
+                ts_obj   : timeseries object
+                num_step : int, number of step functions
+    Returns:    out_files: list of str, for demErr, timeseries corrected for DEM error,
+                           timeseries residual and timeseries step model (if num_step > 0)
+    """
+    out_dir = os.path.dirname(inps.outfile)
+    out_files = ['demErr.h5',
+                 inps.outfile,
+                 os.path.join(out_dir, 'timeseriesResidual.h5')]
+    length, width = ts_obj.length, ts_obj.width
+    num_date = ts_obj.numDate
     atr = dict(ts_obj.metadata)
 
     # config parameter
@@ -425,24 +409,116 @@ def correct_dem_error(inps, A_def):
         atr[key_prefix+key] = str(vars(inps)[key])
 
     # 1. Estimated DEM error
-    outfile = 'demErr.h5'
     atr['FILE_TYPE'] = 'dem'
     atr['UNIT'] = 'm'
-    writefile.write(delta_z, out_file=outfile, metadata=atr)
+    dsNameDict = {'dem': [np.float32, (length, width)]}
+    writefile.layout_hdf5(out_files[0], dsNameDict, metadata=atr)
 
     # 2. Time-series corrected for DEM error
-    atr['FILE_TYPE'] = 'timeseries'
-    writefile.write(ts_cor, out_file=inps.outfile, metadata=atr, ref_file=ts_obj.file)
-
     # 3. Time-series of inversion residual
-    ts_ref_file = os.path.join(os.path.dirname(inps.outfile), 'timeseriesResidual.h5')
-    writefile.write(ts_res, out_file=ts_ref_file, metadata=atr, ref_file=ts_obj.file)
+    atr['FILE_TYPE'] = 'timeseries'
+    dsNameDict = {'date'      : [np.string_, (num_date,), np.array(ts_obj.dateList, np.string_)],
+                  'bperp'     : [np.float32, (num_date,), ts_obj.pbase],
+                  'timeseries': [np.float32, (num_date, length, width)]}
+    for out_file in out_files[1:3]:
+        writefile.layout_hdf5(out_file, dsNameDict, metadata=atr)
 
     # 4. Time-series of estimated Step Model
     if num_step > 0:
+        out_files.append(os.path.join(out_dir, 'timeseriesStepModel.h5'))
         atr.pop('REF_DATE')
-        step_obj = timeseries(os.path.join(os.path.dirname(inps.outfile), 'timeseriesStepModel.h5'))
-        step_obj.write2hdf5(data=step_model, metadata=atr, dates=inps.stepFuncDate)
+        dsNameDict = {'date'      : [np.string_, (num_step,), np.array(inps.stepFuncDate, np.string_)],
+                      'timeseries': [np.float32, (num_step, length, width)]}
+        writefile.layout_hdf5(out_files[3], dsNameDict, metadata=atr)
+    return out_files
+
+
+def correct_dem_error(inps, A_def):
+    """Correct DEM error of input timeseries file, block by block in rows
+    to keep memory usage under inps.chunk_size, with results written into the output files per block.
+    """
+    # Read Date Info
+    ts_obj = timeseries(inps.timeseries_file)
+    ts_obj.open()
+    num_date = ts_obj.numDate
+    tbase = np.array(ts_obj.tbase, np.float32).reshape(-1, 1) / 365.25
+
+    num_step = len(inps.stepFuncDate)
+    drop_date, inps.excludeDate = read_exclude_date(inps.excludeDate, ts_obj.dateList)
+    if inps.polyOrder > np.sum(drop_date):
+        raise ValueError(("input poly order {} > number of acquisition {}!"
+                          " Reduce it!").format(inps.polyOrder, np.sum(drop_date)))
+
+    # prepare output files
+    out_files = layout_output_files(inps, ts_obj, num_step=num_step)
+
+    ##-------------------------------- Loop for L2-norm inversion  --------------------------------##
+    box_list = split2boxes(dataset_shape=(num_date, ts_obj.length, ts_obj.width),
+                           chunk_size=inps.chunk_size)
+    num_box = len(box_list)
+    num_pixel2inv = 0
+    start_time = time.time()
+    for i, box in enumerate(box_list):
+        if num_box > 1:
+            print('\n------- Processing Patch {} out of {} --------------'.format(i+1, num_box))
+        box_size = (box[3] - box[1]) * (box[2] - box[0])
+
+        # Read time-series and geometry data
+        ts_data = ts_obj.read(box=box, print_msg=True).reshape((num_date, -1))
+        (sin_inc_angle,
+         range_dist,
+         pbase) = read_geometry(inps.timeseries_file, inps.geom_file, box=box, print_msg=(i == 0))
+
+        # mask
+        print('skip pixels with zero/NaN value in all acquisitions')
+        ts_mean = np.nanmean(ts_data, axis=0)
+        mask = np.multiply(~np.isnan(ts_mean), ts_mean != 0.)
+        del ts_mean
+        if range_dist.size != 1:
+            print('skip pixels with zero/nan value in geometry: incidence angle or range distance')
+            mask *= np.multiply(sin_inc_angle != 0., range_dist != 0.)
+            sin_inc_angle = sin_inc_angle[mask]
+            range_dist = range_dist[mask]
+            if pbase.shape[1] != 1:
+                pbase = pbase[:, mask]
+        print(('number of pixels to invert: {} out of {}'
+               ' ({:.1f}%)').format(np.sum(mask), box_size, np.sum(mask)/box_size*100))
+
+        # design matrix of DEM error, for each pixel or all pixels
+        A_geom = pbase / (range_dist * sin_inc_angle)
+
+        print('inverting DEM error ...')
+        delta_z = np.zeros(box_size, dtype=np.float32)
+        ts_cor = np.zeros((num_date, box_size), dtype=np.float32)
+        ts_res = np.zeros((num_date, box_size), dtype=np.float32)
+        step_model = np.zeros((num_step, box_size), dtype=np.float32)
+        (delta_z[mask],
+         ts_cor[:, mask],
+         ts_res[:, mask],
+         step_model_i) = estimate_dem_error_batch(ts_data[:, mask], A_geom, A_def,
+                                                  tbase=tbase,
+                                                  drop_date=drop_date,
+                                                  phaseVelocity=inps.phaseVelocity,
+                                                  num_step=num_step)
+        if num_step > 0:
+            step_model[:, mask] = step_model_i
+        num_pixel2inv += np.sum(mask)
+        del ts_data, step_model_i, A_geom
+
+        # write the block into output files
+        block = [box[1], box[3], box[0], box[2]]
+        writefile.write_hdf5_block(out_files[0], delta_z, 'dem', block=block)
+        writefile.write_hdf5_block(out_files[1], ts_cor, 'timeseries', block=[0, num_date]+block)
+        writefile.write_hdf5_block(out_files[2], ts_res, 'timeseries', block=[0, num_date]+block)
+        if num_step > 0:
+            writefile.write_hdf5_block(out_files[3], step_model, 'timeseries', block=[0, num_step]+block)
+        del delta_z, ts_cor, ts_res, step_model
+
+    time_used = max(time.time() - start_time, 1e-6)
+    print('inverted {} pixels in {:.1f} secs ({:.0f} pixels/sec)'.format(num_pixel2inv,
+                                                                        time_used,
+                                                                        num_pixel2inv / time_used))
+    print('finished writing to files: {}'.format(out_files))
 
     ## 5. Time-series of estimated Deformation Model = poly model + step model
     #ts_def_obj = timeseries(os.path.join(os.path.dirname(inps.outfile), 'timeseriesDefModel.h5'))
@@ -461,8 +537,6 @@ def main(iargs=None):
         return inps.outfile
 
     start_time = time.time()
-    inps = read_geometry(inps)
-
     A_def = design_matrix4deformation(inps)
 
     inps = correct_dem_error(inps, A_def)
@@ -13,8 +13,7 @@ import h5py
 import numpy as np
 from pysar.utils import (readfile,
                          writefile,
-                         utils as ut,
-                         plot as pp)
+                         utils as ut)
 
 
 ################################################################################################
@@ -177,6 +176,7 @@ def create_threshold_mask(inps):
 
     # interactively select polygonal region of interest (ROI)
     if inps.roipoly:
+        from pysar.utils import plot as pp
         poly_mask = pp.get_poly_mask(data)
         if poly_mask is not None:
             mask *= poly_mask
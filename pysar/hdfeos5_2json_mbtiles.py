@@ -4,14 +4,15 @@ import json
 import h5py
 import numpy as np
 from datetime import date
-import math
 import time
 import os
 import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import geocoder
 from pysar.add_attribute_insarmaps import InsarDatabaseController
 from pysar.objects import HDFEOS
-from pysar.mask import mask_matrix
+from pysar.ifgram_inversion import split2boxes
 import argparse
 import pickle
 
@@ -59,9 +60,16 @@ def serialize_dictionary(dictionary, fileName):
     return
 
 
+# number of points per json chunk
+CHUNK_SIZE = 20000
+
 # ---------------------------------------------------------------------------------------
 # convert h5 file to json and upload it. folder_name == unavco_name
-def convert_data(attributes, decimal_dates, timeseries_datasets, dates, json_path, folder_name):
+# the displacement is read from the HDFEOS object block by block in rows, with up to
+# block_size data (= num_date * num_row * num_col) per block, and json chunks are written
+# by num_worker processes in parallel
+def convert_data(attributes, decimal_dates, he_obj, dates, json_path, folder_name,
+                 should_mask=True, block_size=50e6, num_worker=1):
 
     project_name = attributes["PROJECT_NAME"]
     region = region_name_from_project_name(project_name)
@@ -72,63 +80,84 @@ def convert_data(attributes, decimal_dates, timeseries_datasets, dates, json_pat
     y_first = float(attributes["Y_FIRST"])
     num_columns = int(attributes["WIDTH"])
     num_rows = int(attributes["LENGTH"])
+    num_date = len(dates)
     print("columns: %d" % num_columns)
     print("rows: %d" % num_rows)
-    # create a siu_man array to store json point objects
-    siu_man = []
-    displacement_values = []
-    displacements = '{'
+
     # np array of decimal dates, x parameter in linear regression equation
+    # y = mx + c -> we want m = slope of the linear regression line
+    # m of all points is given by one matrix product with the pseudo inverse of A
     x = decimal_dates
     A = np.vstack([x, np.ones(len(x))]).T
-    y = []
+    slope_vector = np.linalg.pinv(A)[0, :]
+
+    # points waiting to be written into json chunk: longitude, latitude, displacement, slope
+    buffers = [[np.zeros(0)], [np.zeros(0)], [np.zeros((0, num_date))], [np.zeros(0)]]
+    num_buffered = 0
     chunk_num = 1
     point_num = 0
-    CHUNK_SIZE = 20000
-
-    # iterate through h5 file timeseries
-    for (row, col), value in np.ndenumerate(timeseries_datasets[dates[0]]):
-        longitude = x_first + (col * x_step)
-        latitude = y_first + (row * y_step) 
-        displacement = float(value) 
-        # if value is not equal to naN, create a new json point object and append to siu_man array
-        if not math.isnan(displacement):
-            # get displacement values for all the dates into array for json and string for pgsql
-            for date in dates:
-                displacement = timeseries_datasets[date][row][col]
-                displacements += (str(displacement) + ",")
-                displacement_values.append(float(displacement))
-            displacements = displacements[:len(displacements) - 1] + '}'
-
-            # np array of displacement values, y parameter in linear regression equation
-            y = displacement_values
-
-            # y = mx + c -> we want m = slope of the linear regression line 
-            m, c = np.linalg.lstsq(A, y)[0]
-
-            data = {
-            "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [longitude, latitude]},    
-            "properties": {"d": displacement_values, "m": m, "p": point_num}
-            }   
-
-            siu_man.append(data)
-
-            # clear displacement array for json and the other string for dictionary, for next point
-            displacement_values = []
-            displacements = '{'
-            point_num += 1
-            # break;    # for testing purposes convert only 1 point
-
-            # if chunk_size limit is reached, write chunk into a json file
-            # then increment chunk number and clear siu_man array
-            if len(siu_man) == CHUNK_SIZE:
-                make_json_file(chunk_num, siu_man, dates, json_path, folder_name)
-                chunk_num += 1
-                siu_man = []
+    start_time = time.time()
+
+    executor = None
+    futures = []
+    if num_worker > 1:
+        print("write json chunks with {} workers in parallel".format(num_worker))
+        executor = ProcessPoolExecutor(max_workers=num_worker)
+
+    def write_chunk(num_point):
+        """write the first num_point buffered points into the next json chunk"""
+        nonlocal buffers, num_buffered, chunk_num, point_num
+        data = [np.concatenate(i) for i in buffers]
+        points = [i[:num_point] for i in data]
+        buffers = [[i[num_point:]] for i in data]
+        num_buffered -= num_point
+
+        args = (chunk_num, *points, point_num, dates, json_path)
+        if executor is None:
+            make_json_file(*args)
+        else:
+            # limit the number of chunks in memory
+            if len(futures) >= 2 * num_worker:
+                futures.pop(0).result()
+            futures.append(executor.submit(make_json_file, *args))
+        chunk_num += 1
+        point_num += num_point
+
+    # iterate through h5 file timeseries block by block
+    box_list = split2boxes(dataset_shape=(num_date, num_rows, num_columns), chunk_size=block_size)
+    for box in box_list:
+        box_wid = box[2] - box[0]
+        box_len = box[3] - box[1]
+        displacement = he_obj.read(datasetName='displacement', box=box, print_msg=False)
+        displacement = displacement.reshape(num_date, -1)
+        if should_mask:
+            mask = he_obj.read(datasetName='mask', box=box, print_msg=False).reshape(-1)
+            displacement[:, mask == 0] = np.nan
+
+        # if value of the first date is not equal to naN, create a new json point object
+        idx = np.where(~np.isnan(displacement[0, :]))[0]
+        rows, cols = np.unravel_index(idx, (box_len, box_wid))
+        buffers[0].append(x_first + ((cols + box[0]) * x_step))
+        buffers[1].append(y_first + ((rows + box[1]) * y_step))
+        buffers[2].append(np.array(displacement[:, idx].T, np.float64))
+        buffers[3].append(np.dot(buffers[2][-1], slope_vector))
+        num_buffered += idx.size
+        del displacement
+
+        # if chunk_size limit is reached, write chunk into a json file
+        while num_buffered >= CHUNK_SIZE:
+            write_chunk(CHUNK_SIZE)
 
     # write the last chunk that might be smaller than chunk_size
-    make_json_file(chunk_num, siu_man, dates, json_path, folder_name)
+    write_chunk(num_buffered)
+    if executor is not None:
+        for future in futures:
+            future.result()
+        executor.shutdown()
+
+    time_used = max(time.time() - start_time, 1e-6)
+    print("converted {} points into {} json chunks in {:.1f} secs ({:.0f} points/sec)".format(
+        point_num, chunk_num - 1, time_used, point_num / time_used))
 
     # dictionary to contain metadata needed by db to be written to a file
     # and then be read by json_mbtiles2insarmaps.py
@@ -189,9 +218,19 @@ def convert_data(attributes, decimal_dates, timeseries_datasets, dates, json_pat
 
 
 # ---------------------------------------------------------------------------------------
-# create a json file out of siu man array
+# create a json file out of points given in arrays of longitude, latitude, displacement and slope
 # then put json file into directory named after the h5 file
-def make_json_file(chunk_num, points, dates, json_path, folder_name):
+# the compact (non-indented) encoding uses the C accelerated json encoder
+def make_json_file(chunk_num, longitude, latitude, displacement, slope, point_num, dates, json_path):
+
+    points = [{
+    "type": "Feature",
+    "geometry": {"type": "Point", "coordinates": [lon, lat]},
+    "properties": {"d": d, "m": m, "p": point_num + i}
+    } for i, (lon, lat, d, m) in enumerate(zip(longitude.tolist(),
+                                                latitude.tolist(),
+                                                displacement.tolist(),
+                                                slope.tolist()))]
 
     data = {
     "type": "FeatureCollection",
@@ -200,10 +239,8 @@ def make_json_file(chunk_num, points, dates, json_path, folder_name):
     }
 
     chunk = "chunk_" + str(chunk_num) + ".json"
-    json_file = open(json_path + "/" + chunk, "w")
-    string_json = json.dumps(data, indent=4, separators=(',',':'))
-    json_file.write("%s" % string_json)
-    json_file.close()
+    with open(json_path + "/" + chunk, "w") as json_file:
+        json_file.write(json.dumps(data, separators=(',', ':')))
 
     print("converted chunk " + str(chunk_num))
     return chunk
@@ -215,6 +252,10 @@ def build_parser():
     required = parser.add_argument_group("required arguments")
     required.add_argument("file", help="unavco file to ingest")
     required.add_argument("outputDir", help="directory to place json files and mbtiles file")
+    parser.add_argument("--num-worker", dest="num_worker", type=int, default=4,
+                        help="number of processes to write json chunks in parallel, default: 4")
+    parser.add_argument("--chunk-size", dest="chunk_size", type=float, default=50e6,
+                        help="max number of data (= num_date * num_row * num_col) to read per loop, default: 50e6")
 
     return parser
 
@@ -232,60 +273,16 @@ def main():
     path_name = path_name_and_extension[0]
     # ---------------------------------------------------------------------------------------
     # start clock to track how long conversion process takes
-    start_time = time.clock()
+    start_time = time.time()
 
-    # use h5py to open specified group(s) in the h5 file 
-    # then read datasets from h5 file into memory for faster reading of data
+    # use HDFEOS object to read the displacement and mask block by block during the conversion
     he_obj = HDFEOS(file_name)
     he_obj.open(print_msg=False)
-    displacement_3d_matrix = he_obj.read(datasetName='displacement')
-    mask = he_obj.read(datasetName='mask')
-    if should_mask:
-        print("Masking displacement")
-        displacement_3d_matrix = mask_matrix(displacement_3d_matrix, mask)
-    del mask
-
     dates = he_obj.dateList
     attributes = dict(he_obj.metadata)
 
-    #file = h5py.File(file_name,  "r")
-    #timeseries_group = file["HDFEOS"]["GRIDS"]["timeseries"]
-    #displacement_3d_matrix = timeseries_group["observation"]["displacement"]
-
-    # get attributes (stored at root) of UNAVCO timeseries file
-    #attributes = dict(file.attrs)
-
-    # in timeseries displacement_3d_matrix, there are datasets
-    # need to get datasets with dates - strings that can be converted to integers
-    #dates = displacement_3d_matrix.attrs["DATE_TIMESERIES"].split(" ")
-
     # array that stores dates from dates that have been converted to decimal
-    decimal_dates = []
-
-    # read datasets in the group into a dictionary of 2d arrays and intialize decimal dates
-    timeseries_datasets = {}
-    num_date = len(dates)
-    for i in range(num_date):
-        timeseries_datasets[dates[i]] = np.squeeze(displacement_3d_matrix[i, :, :])
-        d = get_date(dates[i])
-        decimal = get_decimal_date(d)
-        decimal_dates.append(decimal)
-    del displacement_3d_matrix
-
-    #for displacement_2d_matrix in displacement_3d_matrix:
-    #    dataset = displacement_2d_matrix[:]
-    #    if should_mask:
-    #        print("Masking " + dates[i])
-    #        mask = timeseries_group["quality"]["mask"][:]
-    #        dataset = mask_matrix(dataset, mask)
-    #    timeseries_datasets[dates[i]] = dataset
-    #    d = get_date(dates[i])
-    #    decimal = get_decimal_date(d)
-    #    decimal_dates.append(decimal)
-    #    i += 1
-
-    # close h5 file
-    #file.close()
+    decimal_dates = [get_decimal_date(get_date(i)) for i in dates]
 
     path_list = path_name.split("/")
     folder_name = path_name.split("/")[len(path_list)-1]
@@ -296,7 +293,9 @@ def main():
         print(output_folder + " already exists")
 
     # read and convert the datasets, then write them into json files and insert into database
-    convert_data(attributes, decimal_dates, timeseries_datasets, dates, output_folder, folder_name)
+    num_worker = max(1, min(parseArgs.num_worker, multiprocessing.cpu_count()))
+    convert_data(attributes, decimal_dates, he_obj, dates, output_folder, folder_name,
+                 should_mask=should_mask, block_size=parseArgs.chunk_size, num_worker=num_worker)
 
     # run tippecanoe command to get mbtiles file
     os.chdir(os.path.abspath(output_folder))
@@ -304,7 +303,7 @@ def main():
 
     # ---------------------------------------------------------------------------------------
     # check how long it took to read h5 file data and create json files
-    end_time =  time.clock()
+    end_time =  time.time()
     print(("time elapsed: " + str(end_time - start_time)))
     return
 
@@ -14,11 +14,14 @@ import re
 import sys
 import time
 import argparse
+import multiprocessing
+import concurrent.futures
 import h5py
 import math
 import numpy as np
 from scipy import linalg   # more effieint than numpy.linalg
 from pysar.objects import ifgramStack, timeseries
+from pysar.objects.pysarobj import hdf5_reader
 from pysar.utils import readfile, writefile, ptime, utils as ut
 
 
@@ -41,10 +44,14 @@ EXAMPLE = """example:
   ifgram_inversion.py  INPUTS/ifgramStack.h5 -w fim
   ifgram_inversion.py  INPUTS/ifgramStack.h5 -w coh
 
+  # parallel processing on a local multi-core computer, using a process pool
+  ifgram_inversion.py  INPUTS/ifgramStack.h5 -w var --parallel local
+  ifgram_inversion.py  INPUTS/ifgramStack.h5 -w var --parallel local --num-worker 16
+
   # parallel processing for HPC
   # support LSF job scheduler, PBS should also work out of the box after changing module import
   ifgram_inversion.py  INPUTS/ifgramStack.h5 -w var --parallel
-  ifgram_inversion.py  INPUTS/ifgramStack.h5 -w var --parallel --parallel-workers-num 25
+  ifgram_inversion.py  INPUTS/ifgramStack.h5 -w var --parallel lsf --parallel-workers-num 25
 """
 
 TEMPLATE = """
@@ -69,8 +76,8 @@ pysar.networkInversion.minNormVelocity = auto #[yes / no], auto for yes, min-nor
 pysar.networkInversion.residualNorm    = auto #[L2 ], auto for L2, norm minimization solution
 pysar.networkInversion.minTempCoh      = auto #[0.0-1.0], auto for 0.7, min temporal coherence for mask
 pysar.networkInversion.minNumPixel     = auto #[int > 0], auto for 100, min number of pixels in mask above
-pysar.networkInversion.parallel        = auto #[yes / no], auto for no, parallel processing using dask
-pysar.networkInversion.numWorker       = auto #[int > 0], auto for 40, number of works for dask cluster to use
+pysar.networkInversion.parallel        = auto #[local / lsf / no], auto for no, parallel processing using local process pool or dask LSF cluster
+pysar.networkInversion.numWorker       = auto #[int > 0], auto for 40, number of workers for parallel processing
 """
 
 REFERENCE = """references:
@@ -137,7 +144,9 @@ def create_parser():
                         'timeseries.h5 temporalCoherence.h5')
     parser.add_argument('--update', dest='update_mode', action='store_true',
                         help='Enable update mode, and skip inversion if output timeseries file already exists,\n' +
-                        'readable and newer than input interferograms file')
+                        'readable and newer than input interferograms file.\n' +
+                        'If the existing output files are incomplete, e.g. from a killed run, with the same\n' +
+                        'configuration, resume the inversion by skipping the finished patches.')
     parser.add_argument('--water-mask', '-m', dest='waterMaskFile',
                         help='Skip inversion on the masked out region, i.e. water.')
     parser.add_argument('--split-file', dest='split_file', action='store_true',
@@ -148,11 +157,15 @@ def create_parser():
                              '\t--mask-dset = no\n'+
                              'This is equivalent to SBAS algorithm (Berardino et al., 2002)')
 
-    par = parser.add_argument_group('parallel', 'parallel processing configuration for Dask')
-    par.add_argument('--parallel', dest='parallel', action='store_true',
-                     help='Enable parallel processing for the pixelwise weighted inversion.')
-    par.add_argument('--parallel-workers-num','--par-workers-num','--parallel-num', dest='numWorker', type=int,
-                     default=40, help='Specify the number of workers the Dask cluster should use. Default: 40')
+    par = parser.add_argument_group('parallel', 'parallel processing configuration')
+    par.add_argument('--parallel', dest='parallel', nargs='?', const='lsf', choices=['local', 'lsf'],
+                     help='Enable parallel processing for the pixelwise weighted inversion:\n'+
+                          'local - process pool on the local computer, no job scheduler needed\n'+
+                          'lsf   - Dask cluster with LSF job scheduler for HPC (default if no value given)')
+    par.add_argument('--num-worker','--parallel-workers-num','--par-workers-num','--parallel-num',
+                     dest='numWorker', type=int, default=40,
+                     help='Specify the number of workers to use. Default: 40\n'+
+                          'For local, it is limited to the number of CPUs of the computer.')
 
     return parser
 
@@ -169,10 +182,17 @@ def cmd_line_parse(iargs=None):
         inps = read_template2inps(inps.templateFile, inps)
 
     inps.timeseriesFile, inps.tempCohFile = inps.outfile
+    inps.resume = False
 
     if inps.waterMaskFile and not os.path.isfile(inps.waterMaskFile):
         inps.waterMaskFile = None
 
+    # --parallel option: yes/True from template for dask LSF cluster for backward compatibility
+    if inps.parallel is True:
+        inps.parallel = 'lsf'
+    elif not inps.parallel:
+        inps.parallel = None
+
     # --fast option
     if inps.fast:
         print("Enable fast network inversion.")
@@ -254,12 +274,29 @@ def run_or_skip(inps):
         else:
             print('3) all key configuration parameters are the same: {}.'.format(configKeys))
 
+    # check completeness of output files, for box-granular update
+    if flag == 'skip':
+        box_done = read_box_done(inps.timeseriesFile)
+        out_files = [inps.outfile[0], inps.outfile[1], 'timeseriesDecorStd.h5', 'numInvIfgram.h5']
+        if box_done is None:
+            print('4) output files are complete.')
+        elif not all(os.path.isfile(i) for i in out_files):
+            flag = 'run'
+            print('4) output files are NOT complete, and NOT ALL output files found: {}.'.format(out_files))
+        else:
+            flag = 'resume'
+            print('4) output files are NOT complete, with {} finished patches.'.format(box_done.shape[0]))
+
     # result
     print('run or skip: {}.'.format(flag))
     return flag
 
 
 ################################################################################################
+# in-memory cache of the coherence to phase variance look-up table, in {(L, epsilon, coh_num): (coh, var)}
+PHASE_VARIANCE_LUT_DS = {}
+
+
 def phase_pdf_ds(L, coherence=None, phi_num=1000, epsilon=1e-3):
     """Marginal PDF of interferometric phase for distributed scatterers (DS)
     Eq. 66 (Tough et al., 1995) and Eq. 4.2.23 (Hanssen, 2001)
@@ -361,8 +398,61 @@ def phase_variance_ps(L, coherence=None, epsilon=1e-3):
     return var, coherence
 
 
-def coherence2phase_variance_ds(coherence, L=32, epsilon=1e-3, print_msg=False):
-    """Convert coherence to phase variance based on DS phase PDF (Tough et al., 1995)"""
+def get_phase_variance_lut_ds(L=32, epsilon=1e-3, coh_num=1000, cache_dir=None):
+    """Get the look-up table (LUT) of coherence to phase variance for DS, with memory and disk cache.
+    The LUT is calculated once per (L, epsilon, coh_num) and cached in memory; it is also saved
+    to / loaded from the disk so that each worker process does not need to re-calculate it.
+    Parameters: L         : int, number of independent looks
+                epsilon   : float, distance of the coherence range to 0 and 1
+                coh_num   : int, number of coherence samples in the LUT
+                cache_dir : str, directory of the disk cache, default: $PYSAR_CACHE_DIR or ~/.pysar/cache
+                            set to False to disable the disk cache
+    Returns:    coh_lut   : 1D np.ndarray in size of (coh_num,) in float64, coherence
+                var_lut   : 1D np.ndarray in size of (coh_num,) in float64, phase variance
+    Example:    coh_lut, var_lut = get_phase_variance_lut_ds(L=20)
+    """
+    key = (int(L), float(epsilon), int(coh_num))
+    if key in PHASE_VARIANCE_LUT_DS:
+        return PHASE_VARIANCE_LUT_DS[key]
+
+    coh_lut = np.linspace(0.0 + epsilon, 1.0 - epsilon, int(coh_num))
+
+    # read from disk cache
+    if cache_dir is None:
+        cache_dir = os.getenv('PYSAR_CACHE_DIR', os.path.expanduser('~/.pysar/cache'))
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, 'phaseVarianceDS_L{}_eps{:g}_num{}.npy'.format(*key))
+    var_lut = None
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            var_lut = np.load(cache_file)
+            if var_lut.shape != coh_lut.shape:
+                var_lut = None
+        except (IOError, ValueError):
+            var_lut = None
+
+    # calculate and write to disk cache
+    if var_lut is None:
+        var_lut = phase_variance_ds(int(L), coh_lut)[0]
+        if cache_file:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                # write to a temporary file first to avoid partial read by other processes
+                tmp_file = '{}.{}.tmp.npy'.format(os.path.splitext(cache_file)[0], os.getpid())
+                np.save(tmp_file, var_lut)
+                os.replace(tmp_file, cache_file)
+            except OSError:
+                pass
+
+    PHASE_VARIANCE_LUT_DS[key] = (coh_lut, var_lut)
+    return coh_lut, var_lut
+
+
+def coherence2phase_variance_ds(coherence, L=32, epsilon=1e-3, coh_num=1000, print_msg=False):
+    """Convert coherence to phase variance based on DS phase PDF (Tough et al., 1995)
+    using linear interpolation of the cached look-up table.
+    """
     lineStr = '    number of looks L={}'.format(L)
     if L > 80:
         L = 80
@@ -370,21 +460,11 @@ def coherence2phase_variance_ds(coherence, L=32, epsilon=1e-3, print_msg=False):
     if print_msg:
         print(lineStr)
 
-    coh_num = 1000
-    coh_min = 0.0 + epsilon
-    coh_max = 1.0 - epsilon
-    coh_lut = np.linspace(coh_min, coh_max, coh_num)
-    coh_min = np.min(coh_lut)
-    coh_max = np.max(coh_lut)
-    coh_step = (coh_max - coh_min) / (coh_num - 1)
-
-    coherence = np.array(coherence)
-    coherence[coherence < coh_min] = coh_min
-    coherence[coherence > coh_max] = coh_max
-    coherence_idx = np.array((coherence - coh_min) / coh_step, np.int16)
-
-    var_lut = phase_variance_ds(int(L), coh_lut)[0]
-    variance = var_lut[coherence_idx]
+    coh_lut, var_lut = get_phase_variance_lut_ds(L, epsilon=epsilon, coh_num=coh_num)
+
+    # np.interp clips values outside of [coh_min, coh_max] to the end values
+    coherence = np.asarray(coherence, dtype=np.float64)
+    variance = np.interp(coherence.ravel(), coh_lut, var_lut).reshape(coherence.shape)
     return variance
 
 
@@ -511,7 +591,264 @@ def estimate_timeseries(A, B, tbase_diff, ifgram, weight_sqrt=None, min_norm_vel
     return ts, temp_coh, num_inv_ifg
 
 
+def estimate_timeseries_batch(A, B, tbase_diff, ifgram, weight_sqrt=None, min_norm_velocity=True,
+                              rcond=1e-5, min_redundancy=1., min_group_size=100, max_step_size=2e7):
+    """Estimate time-series for many pixels at once, the vectorized version of estimate_timeseries().
+
+    Pixels are grouped by their valid-interferogram mask (non-zero phase), i.e. their network:
+    1. OLS: pixels sharing the same network share the same design matrix, and are solved with
+            one lstsq call with multiple right-hand sides for each group (with >= min_group_size pixels).
+    2. WLS, and OLS for the remaining small groups: stacked normal equations (G^T W G) X = G^T W y
+            are solved for all pixels at once, with zero weight for the interferograms out of the
+            pixel's network, which is equivalent to the lstsq solution on the pixel's own network.
+    The same skipping rules as estimate_timeseries() are applied to pixels with partial network.
+
+    Parameters: A/B/tbase_diff/min_norm_velocity/rcond/min_redundancy - same as estimate_timeseries()
+                ifgram - 2D np.array in size of (num_ifgram, num_pixel), phase of all interferograms
+                weight_sqrt - 2D np.array in size of (num_ifgram, num_pixel) or None,
+                    square root of weight of all interferograms
+                min_group_size - int, min number of pixels of one network to be solved by lstsq, for OLS only
+                max_step_size - int, max number of elements of the stacked design matrix in memory,
+                    i.e. num_pixel * num_ifgram * (num_date-1), per step of the stacked normal equations
+    Returns:    ts - 2D np.array in size of (num_date, num_pixel), phase time-series
+                temp_coh - 1D np.array in size of (num_pixel), temporal coherence
+                num_inv_ifg - 1D np.array in size of (num_pixel), number of ifgrams
+                    used during the inversion
+    Example:    ts, temp_coh, num_inv_ifg = estimate_timeseries_batch(A, B, tbase_diff,
+                                                                      ifgram=pha_data,
+                                                                      weight_sqrt=weight)
+    """
+    ifgram = ifgram.reshape(A.shape[0], -1)
+    if weight_sqrt is not None:
+        weight_sqrt = weight_sqrt.reshape(A.shape[0], -1)
+    num_date = A.shape[1] + 1
+    num_pixel = ifgram.shape[1]
+
+    # Initial output value
+    ts = np.zeros((num_date, num_pixel), np.float32)
+    temp_coh = np.zeros(num_pixel, np.float32)
+    num_inv_ifg = np.zeros(num_pixel, np.int16)
+    if num_pixel == 0:
+        return ts, temp_coh, num_inv_ifg
+
+    # design matrix for minimum-norm deformation velocity or phase
+    G = np.array(B if min_norm_velocity else A, np.float64)
+
+    # network of each pixel, i.e. the valid-interferogram mask
+    net_mask = np.multiply(ifgram != 0., ~np.isnan(ifgram))
+    num_ifg = np.sum(net_mask, axis=0)
+
+    # Skip pixels with partial network and redundancy < threshold
+    flag = num_ifg > 0
+    part_net = num_ifg < A.shape[0]
+    redundancy = np.min(np.dot((A != 0.).T.astype(np.float32), net_mask.astype(np.float32)), axis=0)
+    flag[part_net * (redundancy < min_redundancy)] = False
+    del redundancy
+
+    X = np.zeros((G.shape[1], num_pixel), np.float64)
+    # 1 - OLS with one lstsq call for each large group of pixels sharing the same network
+    idx_pixel2inv = np.where(flag)[0]
+    if weight_sqrt is None and idx_pixel2inv.size > 0:
+        net_code = np.packbits(net_mask[:, idx_pixel2inv], axis=0)
+        net_idx, net_count = np.unique(net_code, axis=1, return_inverse=True, return_counts=True)[1:]
+        net_idx = net_idx.reshape(-1)
+        del net_code
+
+        solved = np.zeros(idx_pixel2inv.size, np.bool_)
+        for i in np.where(net_count >= min_group_size)[0]:
+            idx = np.where(net_idx == i)[0]
+            ifg_flag = net_mask[:, idx_pixel2inv[idx[0]]]
+            try:
+                X[:, idx_pixel2inv[idx]] = linalg.lstsq(G[ifg_flag, :],
+                                                        ifgram[np.ix_(ifg_flag, idx_pixel2inv[idx])],
+                                                        cond=rcond)[0]
+            except linalg.LinAlgError:
+                flag[idx_pixel2inv[idx]] = False
+            solved[idx] = True
+        idx_pixel2inv = idx_pixel2inv[~solved]
+
+    # 2 - stacked normal equations for all the other pixels
+    step = max(1, int(max_step_size / G.size))
+    for i0 in range(0, idx_pixel2inv.size, step):
+        idx = idx_pixel2inv[i0:i0+step]
+        if weight_sqrt is not None:
+            w = np.multiply(weight_sqrt[:, idx], net_mask[:, idx])
+        else:
+            w = net_mask[:, idx]
+        y = ifgram[:, idx] * net_mask[:, idx]
+        X[:, idx], rank = estimate_normal_equation_batch(G, y, w, rcond=rcond)
+
+        # check matrix invertability, for WLS only because OLS contains it already
+        if weight_sqrt is not None:
+            flag[idx[(rank < G.shape[1]) * part_net[idx]]] = False
+        del w, y, rank
+
+    # time-series
+    X[:, ~flag] = 0.
+    if min_norm_velocity:
+        ts[1:, :] = np.cumsum(X * tbase_diff, axis=0)
+    else:
+        ts[1:, :] = X
+
+    # calculate temporal coherence
+    num_inv_ifg[flag] = num_ifg[flag]
+    ifgram_diff = ifgram - np.dot(G, X)
+    ifgram_diff = np.multiply(np.exp(1j*ifgram_diff), net_mask)
+    temp_coh[flag] = np.abs(np.sum(ifgram_diff[:, flag], axis=0)) / num_ifg[flag]
+    return ts, temp_coh, num_inv_ifg
+
+
+def estimate_normal_equation_batch(G, y, weight_sqrt, rcond=1e-5):
+    """Solve the weighted least squares problem of many pixels with the same design matrix at once,
+    using the stacked normal equations: (G^T W G) X = G^T W y, with W = diag(weight_sqrt^2) for each pixel.
+
+    Pixels with well-conditioned G^T W G are solved via LU decomposition, the others via its
+    pseudo-inverse, which gives the same minimum-norm solution as
+        linalg.lstsq(G * weight_sqrt, y * weight_sqrt, cond=rcond)
+
+    Parameters: G - 2D np.array in size of (num_ifgram, num_par), design matrix
+                y - 2D np.array in size of (num_ifgram, num_pixel), observations
+                weight_sqrt - 2D np.array in size of (num_ifgram, num_pixel), square root of weight,
+                    with 0 for the interferograms to be excluded
+                rcond - cut-off ratio of small singular values of W^0.5 G
+    Returns:    X - 2D np.array in size of (num_par, num_pixel), solution
+                rank - 1D np.array of int in size of (num_pixel), rank of W^0.5 G
+    """
+    num_par = G.shape[1]
+    num_pixel = y.shape[1]
+    X = np.zeros((num_par, num_pixel), np.float64)
+    rank = np.ones(num_pixel, np.int16) * num_par
+
+    w = np.array(weight_sqrt, np.float64).T
+    Gw = G[np.newaxis, :, :] * w[:, :, np.newaxis]
+    GwT = np.transpose(Gw, (0, 2, 1))
+    N = np.matmul(GwT, Gw)
+    Gy = np.matmul(GwT, (y.T * w)[:, :, np.newaxis])
+    del Gw, GwT
+
+    # 1 - full rank system
+    flag = check_normal_matrix_rank(N, rcond=rcond)
+    if np.any(flag):
+        X[:, flag] = np.linalg.solve(N[flag], Gy[flag])[:, :, 0].T
+
+    # 2 - rank deficient / ill-conditioned system: pseudo-inverse for the minimum-norm solution
+    #     eigenvalues of G^T W G are the square of the singular values of W^0.5 G
+    if not np.all(flag):
+        e, V = np.linalg.eigh(N[~flag])
+        e_flag = e > rcond**2 * np.max(e, axis=1, keepdims=True)
+        e_inv = np.zeros(e.shape, np.float64)
+        e_inv[e_flag] = 1. / e[e_flag]
+        N_inv = np.matmul(V * e_inv[:, np.newaxis, :], np.transpose(V, (0, 2, 1)))
+        X[:, ~flag] = np.matmul(N_inv, Gy[~flag])[:, :, 0].T
+        rank[~flag] = np.sum(e_flag, axis=1)
+    return X, rank
+
+
 ###########################################################################################
+def check_normal_matrix_rank(N, rcond=1e-5):
+    """Check whether the stacked normal matrices are full rank and well-conditioned, i.e.
+    the ratio of their min/max eigenvalues is larger than rcond**2, in one batched call for all pixels.
+    Parameters: N     - 3D np.array in size of (num_pixel, num_par, num_par), G^T W G of each pixel
+                rcond - cut-off ratio of small singular values of W^0.5 G,
+                        whose square is the one of eigenvalues of G^T W G
+    Returns:    flag  - 1D np.array of bool in size of (num_pixel), True for full rank
+    """
+    diagN = np.diagonal(N, axis1=1, axis2=2)
+    flag = np.min(diagN, axis=1) > rcond * np.max(diagN, axis=1)
+    flag &= np.all(np.isfinite(diagN), axis=1)
+    if np.any(flag):
+        e = np.linalg.eigvalsh(N[flag])
+        flag[flag] = e[:, 0] > rcond**2 * e[:, -1]
+    return flag
+
+
+def estimate_timeseries_std_batch(A, ifgram, weight_sqrt=None, variance=None, rcond=1e-5,
+                                  min_group_size=100, max_step_size=2e7):
+    """Estimate the decorrelation noise standard deviation of time-series for many pixels at once,
+    by propagating the phase variance of interferograms through the least squares inversion:
+        Cov_ts = M Cov_ifg M^T, with M = (A^T W A)^-1 A^T W and Cov_ifg = diag(variance)
+    which reduces to Cov_ts = (A^T W A)^-1 if W is the inverse of the phase variance.
+
+    1. uniform weight: pixels sharing the same network share the same M, which is calculated
+                       once for each group (with >= min_group_size pixels), and the variance of
+                       time-series of all pixels in the group is given by one matrix product.
+    2. the others: stacked normal equations for all pixels at once, as estimate_normal_equation_batch().
+    Pixels with rank deficient network have no valid covariance, thus are set to zero.
+
+    Parameters: A           - 2D np.array in size of (num_ifgram, num_date-1), design matrix for
+                              time-series relative to the reference date, i.e. with refDate
+                ifgram      - 2D np.array in size of (num_ifgram, num_pixel), phase of all interferograms,
+                              with zero/nan value for the interferograms out of the pixel's network
+                weight_sqrt - 2D np.array in size of (num_ifgram, num_pixel) or None,
+                              square root of weight of all interferograms
+                variance    - 2D np.array in size of (num_ifgram, num_pixel) or None,
+                              phase variance of all interferograms,
+                              None if the weight is the inverse of phase variance already.
+    Returns:    ts_std      - 2D np.array in size of (num_date-1, num_pixel), std of time-series
+    Example:    ts_std = estimate_timeseries_std_batch(Astd, pha_data, weight_sqrt=weight)
+                ts_std = estimate_timeseries_std_batch(Astd, pha_data, variance=pha_var)
+    """
+    if weight_sqrt is None and variance is None:
+        raise ValueError('weight_sqrt or variance is required to estimate time-series std.')
+    G = np.array(A, np.float64)
+    num_par = G.shape[1]
+    ifgram = ifgram.reshape(G.shape[0], -1)
+    num_pixel = ifgram.shape[1]
+    ts_var = np.zeros((num_par, num_pixel), np.float64)
+    if num_pixel == 0:
+        return ts_var.astype(np.float32)
+
+    net_mask = np.multiply(ifgram != 0., ~np.isnan(ifgram))
+    idx_pixel2inv = np.where(np.any(net_mask, axis=0))[0]
+
+    # 1 - uniform weight: one M = (A^T A)^-1 A^T for each large group of pixels sharing the same network
+    if weight_sqrt is None and idx_pixel2inv.size > 0:
+        net_code = np.packbits(net_mask[:, idx_pixel2inv], axis=0)
+        net_idx, net_count = np.unique(net_code, axis=1, return_inverse=True, return_counts=True)[1:]
+        net_idx = net_idx.reshape(-1)
+        del net_code
+
+        solved = np.zeros(idx_pixel2inv.size, np.bool_)
+        for i in np.where(net_count >= min_group_size)[0]:
+            idx = np.where(net_idx == i)[0]
+            ifg_flag = net_mask[:, idx_pixel2inv[idx[0]]]
+            Gi = G[ifg_flag, :]
+            if np.linalg.matrix_rank(Gi, tol=rcond*np.linalg.norm(Gi, 2)) == num_par:
+                M = linalg.solve(np.dot(Gi.T, Gi), Gi.T, assume_a='pos')
+                ts_var[:, idx_pixel2inv[idx]] = np.dot(np.square(M),
+                                                       variance[np.ix_(ifg_flag, idx_pixel2inv[idx])])
+            solved[idx] = True
+        idx_pixel2inv = idx_pixel2inv[~solved]
+
+    # 2 - stacked normal equations for all the other pixels
+    step = max(1, int(max_step_size / G.size))
+    for i0 in range(0, idx_pixel2inv.size, step):
+        idx = idx_pixel2inv[i0:i0+step]
+        if weight_sqrt is not None:
+            w = np.multiply(weight_sqrt[:, idx], net_mask[:, idx])
+        else:
+            w = net_mask[:, idx]
+        w = np.array(w, np.float64).T
+        Gw = G[np.newaxis, :, :] * w[:, :, np.newaxis]
+        GwT = np.transpose(Gw, (0, 2, 1))
+        N = np.matmul(GwT, Gw)
+        flag = check_normal_matrix_rank(N, rcond=rcond)
+        if not np.any(flag):
+            continue
+
+        if variance is None:
+            # Cov_ts = (A^T W A)^-1
+            ts_var[:, idx[flag]] = np.diagonal(np.linalg.inv(N[flag]), axis1=1, axis2=2).T
+        else:
+            # Cov_ts = M Cov_ifg M^T, with M = (A^T W A)^-1 A^T W
+            M = np.linalg.solve(N[flag], GwT[flag] * w[flag][:, np.newaxis, :])
+            ts_var[:, idx[flag]] = np.sum(np.square(M) * variance[:, idx[flag]].T[:, np.newaxis, :],
+                                          axis=2).T
+        del w, Gw, GwT, N, flag
+
+    return np.sqrt(ts_var).astype(np.float32)
+
+
 def write2hdf5_file(ifgram_file, metadata, ts, temp_coh, ts_std=None, num_inv_ifg=None,
                     suffix='', inps=None):
     stack_obj = ifgramStack(ifgram_file)
@@ -560,6 +897,128 @@ def write2hdf5_file(ifgram_file, metadata, ts, temp_coh, ts_std=None, num_inv_if
     return
 
 
+def layout_output_files(stack_obj, metadata, inps):
+    """Create output HDF5 files with the full data layout but without data,
+    so that the inversion result can be written patch by patch via write2hdf5_block().
+    Parameters: stack_obj : ifgramStack object, opened
+                metadata  : dict, metadata of output files
+                inps      : namespace, with outfile
+    Returns:    out_files : list of 4 str, for timeseries, temporal coherence,
+                    decorrelation noise std time-series and number of inverted ifgrams
+    """
+    date_list = stack_obj.get_date_list(dropIfgram=True)
+    num_date = len(date_list)
+    length, width = stack_obj.length, stack_obj.width
+    out_files = [inps.outfile[0], inps.outfile[1], 'timeseriesDecorStd.h5', 'numInvIfgram.h5']
+    metadata = dict(metadata)
+
+    print('-'*50)
+    print('calculating perpendicular baseline timeseries')
+    pbase = stack_obj.get_perp_baseline_timeseries(dropIfgram=True)
+
+    # File 1/3 - timeseries.h5 / timeseriesDecorStd.h5
+    metadata['REF_DATE'] = date_list[0]
+    metadata['FILE_TYPE'] = 'timeseries'
+    metadata['UNIT'] = 'm'
+    dsNameDict = {'date'       : [np.string_, (num_date,), date_list],
+                  'bperp'      : [np.float32, (num_date,), pbase],
+                  'timeseries' : [np.float32, (num_date, length, width)]}
+    for fname in [out_files[0], out_files[2]]:
+        print('-'*50)
+        writefile.layout_hdf5(fname, dsNameDict, metadata)
+
+    # empty progress record, so that an interrupted run is NOT taken as complete
+    with h5py.File(out_files[0], 'r+') as f:
+        f.create_dataset('boxDone', shape=(0, 5), maxshape=(None, 5), dtype=np.int32)
+
+    # File 2 - temporalCoherence.h5
+    metadata['FILE_TYPE'] = 'temporalCoherence'
+    metadata['UNIT'] = '1'
+    dsNameDict = {'temporalCoherence' : [np.float32, (length, width)]}
+    print('-'*50)
+    writefile.layout_hdf5(out_files[1], dsNameDict, metadata)
+
+    # File 4 - numInvIfgram.h5
+    metadata['FILE_TYPE'] = 'mask'
+    metadata['UNIT'] = '1'
+    dsNameDict = {'mask' : [np.int16, (length, width)]}
+    print('-'*50)
+    writefile.layout_hdf5(out_files[3], dsNameDict, metadata)
+    return out_files
+
+
+def write2hdf5_block(out_files, box, ts, temp_coh, ts_std, num_inv_ifg, phase2range):
+    """Write the inversion result of one patch into the output files created by layout_output_files()
+    Parameters: out_files   : list of 4 str, output file names
+                box         : tuple of 4 int, for (x0, y0, x1, y1) of the patch
+                ts          : 3D np.array in size of (num_date, num_row, num_col), in radian
+                temp_coh    : 2D np.array in size of (num_row, num_col)
+                ts_std      : 3D np.array in size of (num_date, num_row, num_col), in radian
+                num_inv_ifg : 2D np.array in size of (num_row, num_col)
+                phase2range : float, scale factor from phase to range
+    """
+    block = [box[1], box[3], box[0], box[2]]
+    num_date = ts.shape[0]
+    print('writing patch {} to files: {}'.format(box, out_files))
+    writefile.write_hdf5_block(out_files[0], ts * phase2range, 'timeseries',
+                               block=[0, num_date]+block, print_msg=False)
+    writefile.write_hdf5_block(out_files[1], temp_coh, 'temporalCoherence',
+                               block=block, print_msg=False)
+    if np.any(ts_std):
+        writefile.write_hdf5_block(out_files[2], ts_std * abs(phase2range), 'timeseries',
+                                   block=[0, num_date]+block, print_msg=False)
+    writefile.write_hdf5_block(out_files[3], num_inv_ifg, 'mask',
+                               block=block, print_msg=False)
+
+    # mark the box as finished, after all the output files are written
+    update_box_done(out_files[0], box, ts_std_flag=np.any(ts_std))
+    return
+
+
+def read_box_done(ts_file):
+    """Read the list of finished boxes from the incomplete timeseries file of network inversion
+    Parameters: ts_file  : str, timeseries file created by layout_output_files()
+    Returns:    box_done : 2D np.array of int in size of (num_box, 5), for x0, y0, x1, y1 and
+                    flag of non-zero ts_std of each finished box
+                    or None if the file is complete, i.e. /boxDone is removed at the end of inversion
+    """
+    box_done = None
+    with h5py.File(ts_file, 'r') as f:
+        if 'boxDone' in f.keys():
+            box_done = f['boxDone'][:]
+    return box_done
+
+
+def update_box_done(ts_file, box, ts_std_flag=False):
+    """Append the finished box to the /boxDone dataset in the timeseries file,
+    which records the progress of network inversion for the resume/update mode.
+    """
+    with h5py.File(ts_file, 'r+') as f:
+        ds = f['boxDone']
+        ds.resize(ds.shape[0]+1, axis=0)
+        ds[-1, :] = list(box) + [int(ts_std_flag)]
+    return
+
+
+def check_box_done(box_list, box_done, shape):
+    """Split the input list of boxes into the finished and the rest ones, based on the area covered by
+    the finished boxes, thus, it works even if the patch splitting is different from the previous run.
+    Parameters: box_list : list of tuple of 4 int, for (x0, y0, x1, y1) of boxes to be processed
+                box_done : 2D np.array in size of (num_box, 5), from read_box_done()
+                shape    : tuple of 2 int, for (length, width) of the data
+    Returns:    box_list : list of boxes to be processed
+                num_box_done : int, number of finished boxes skipped
+    """
+    if box_done is None or box_done.shape[0] == 0:
+        return box_list, 0
+
+    coverage = np.zeros(shape, np.bool_)
+    for x0, y0, x1, y1 in box_done[:, 0:4]:
+        coverage[y0:y1, x0:x1] = True
+    box_list_todo = [b for b in box_list if not np.all(coverage[b[1]:b[3], b[0]:b[2]])]
+    return box_list_todo, len(box_list) - len(box_list_todo)
+
+
 def split_ifgram_file(ifgram_file, chunk_size=100e6):
     stack_obj = ifgramStack(ifgram_file)
     stack_obj.open(print_msg=False)
@@ -641,14 +1100,14 @@ def subsplit_boxes4_workers(box, num_split, dimension='y'):
         y_diff = y1 - y0
         # `start` and `end` are the new bounds of the subdivided box
         for i in range(num_split):
-            start = (i * y_diff) // num_split
-            end = ((i + 1) * y_diff) // num_split
+            start = y0 + (i * y_diff) // num_split
+            end = y0 + ((i + 1) * y_diff) // num_split
             subboxes.append([x0, start, x1, end])
     elif dimension == 'x':
         x_diff = x1 - x0
         for i in range(num_split):
-            start = (i * x_diff) // num_split
-            end = ((i + 1) * x_diff) // num_split
+            start = x0 + (i * x_diff) // num_split
+            end = x0 + ((i + 1) * x_diff) // num_split
             subboxes.append([start, y0, end, y1])
     else:
         raise Exception("Unknown value for dimension parameter:", dimension)
@@ -702,7 +1161,7 @@ def read_unwrap_phase(stack_obj, box, ref_phase, unwDatasetName='unwrapPhase', d
         # read ref_phase from file itself (for split_file=True)
         if print_msg:
             print('read reference phase from file')
-        with h5py.File(stack_obj.file, 'r') as f:
+        with hdf5_reader(stack_obj) as f:
             ref_phase = f['refPhase'][:]
     else:
         raise Exception('No reference phase input/found on file!'+
@@ -809,93 +1268,98 @@ def ifgram_inversion_patch(ifgram_file, box=None, ref_phase=None, unwDatasetName
                                        weight_func='var', min_norm_velocity=True, mask_dataset_name='coherence')
     """
 
-    stack_obj = ifgramStack(ifgram_file)
-    stack_obj.open(print_msg=False)
-
-    ## debug
-    #y, x = 258, 454
-    #box = (x, y, x+1, y+1)
-
-    # Size Info - Patch
-    if box:
-        #print('processing \t %d-%d / %d lines ...' % (box[1], box[3], stack_obj.length))
-        num_row = box[3] - box[1]
-        num_col = box[2] - box[0]
-    else:
-        num_row = stack_obj.length
-        num_col = stack_obj.width
-    num_pixel = num_row * num_col
-
-    # get tbase_diff
-    date_list = stack_obj.get_date_list(dropIfgram=True)
-    num_date = len(date_list)
-    tbase = np.array(ptime.date_list2tbase(date_list)[0], np.float32) / 365.25
-    tbase_diff = np.diff(tbase).reshape(-1, 1)
-
-    # Design matrix
-    date12_list = stack_obj.get_date12_list(dropIfgram=True)
-    A, B = stack_obj.get_design_matrix4timeseries(date12_list=date12_list)[0:2]
+    # reader mode: one file handle for all the reads of this patch
+    with ifgramStack(ifgram_file) as stack_obj:
+        ## debug
+        #y, x = 258, 454
+        #box = (x, y, x+1, y+1)
+
+        # Size Info - Patch
+        if box:
+            #print('processing \t %d-%d / %d lines ...' % (box[1], box[3], stack_obj.length))
+            num_row = box[3] - box[1]
+            num_col = box[2] - box[0]
+        else:
+            num_row = stack_obj.length
+            num_col = stack_obj.width
+        num_pixel = num_row * num_col
+
+        # get tbase_diff
+        date_list = stack_obj.get_date_list(dropIfgram=True)
+        num_date = len(date_list)
+        tbase = np.array(ptime.date_list2tbase(date_list)[0], np.float32) / 365.25
+        tbase_diff = np.diff(tbase).reshape(-1, 1)
+
+        # Design matrix
+        date12_list = stack_obj.get_date12_list(dropIfgram=True)
+        A, B = stack_obj.get_design_matrix4timeseries(date12_list=date12_list)[0:2]
+
+        # prep for decor std time-series
+        try:
+            ref_date = str(np.loadtxt('reference_date.txt', dtype=bytes).astype(str))
+        except:
+            ref_date = date_list[0]
+        Astd = stack_obj.get_design_matrix4timeseries(date12_list=date12_list, refDate=ref_date)[0]
+        ref_idx = date_list.index(ref_date)
+        time_idx = [i for i in range(num_date)]
+        time_idx.remove(ref_idx)
 
-    # prep for decor std time-series
-    try:
-        ref_date = str(np.loadtxt('reference_date.txt', dtype=bytes).astype(str))
-    except:
-        ref_date = date_list[0]
-    Astd = stack_obj.get_design_matrix4timeseries(date12_list=date12_list, refDate=ref_date)[0]
-    #ref_idx = date_list.index(ref_date)
-    #time_idx = [i for i in range(num_date)]
-    #time_idx.remove(ref_idx)
-
-    # Initialization of output matrix
-    ts     = np.zeros((num_date, num_pixel), np.float32)
-    ts_std = np.zeros((num_date, num_pixel), np.float32)
-    temp_coh    = np.zeros(num_pixel, np.float32)
-    num_inv_ifg = np.zeros(num_pixel, np.int16)
+        # Initialization of output matrix
+        ts     = np.zeros((num_date, num_pixel), np.float32)
+        ts_std = np.zeros((num_date, num_pixel), np.float32)
+        temp_coh    = np.zeros(num_pixel, np.float32)
+        num_inv_ifg = np.zeros(num_pixel, np.int16)
+
+        # Read/Mask unwrapPhase
+        pha_data = read_unwrap_phase(stack_obj,
+                                     box,
+                                     ref_phase,
+                                     unwDatasetName=unwDatasetName,
+                                     dropIfgram=True)
+
+        pha_data = mask_unwrap_phase(pha_data,
+                                     stack_obj,
+                                     box,
+                                     dropIfgram=True,
+                                     mask_ds_name=mask_dataset_name,
+                                     mask_threshold=mask_threshold)
+
+        # Mask for pixels to invert
+        mask = np.ones(num_pixel, np.bool_)
+        # 1 - Water Mask
+        if water_mask_file:
+            print(('skip pixels on water with mask from'
+                   ' file: {}').format(os.path.basename(water_mask_file)))
+            atr_msk = readfile.read_attribute(water_mask_file)
+            if (int(atr_msk['LENGTH']), int(atr_msk['WIDTH'])) != (stack_obj.length, stack_obj.width):
+                raise ValueError('Input water mask file has different size from ifgramStack file.')
+            del atr_msk
+            dsName = [i for i in readfile.get_dataset_list(water_mask_file)
+                      if i in ['waterMask', 'mask']][0]
+            waterMask = readfile.read(water_mask_file,
+                                      datasetName=dsName,
+                                      box=box)[0].flatten()
+            mask *= np.array(waterMask, np.bool_)
+            del waterMask
+
+        # 2 - Mask for Zero Phase in ALL ifgrams
+        print('skip pixels with zero/nan value in all interferograms')
+        phase_stack = np.nanmean(pha_data, axis=0)
+        mask *= np.multiply(~np.isnan(phase_stack), phase_stack != 0.)
+        del phase_stack
+
+        # Invert pixels on mask 1+2
+        num_pixel2inv = int(np.sum(mask))
+        print(('number of pixels to invert: {} out of {}'
+               ' ({:.1f}%)').format(num_pixel2inv, num_pixel,
+                                    num_pixel2inv/num_pixel*100))
+
+        # Read coherence for the weight of pixels to invert
+        L = int(stack_obj.metadata['ALOOKS']) * int(stack_obj.metadata['RLOOKS'])
+        coh_data = None
+        if num_pixel2inv > 0 and weight_func not in ['no', 'sbas']:
+            coh_data = read_coherence(stack_obj, box=box, dropIfgram=True)[:, mask]
 
-    # Read/Mask unwrapPhase
-    pha_data = read_unwrap_phase(stack_obj,
-                                 box,
-                                 ref_phase,
-                                 unwDatasetName=unwDatasetName,
-                                 dropIfgram=True)
-
-    pha_data = mask_unwrap_phase(pha_data,
-                                 stack_obj,
-                                 box,
-                                 dropIfgram=True,
-                                 mask_ds_name=mask_dataset_name,
-                                 mask_threshold=mask_threshold)
-
-    # Mask for pixels to invert
-    mask = np.ones(num_pixel, np.bool_)
-    # 1 - Water Mask
-    if water_mask_file:
-        print(('skip pixels on water with mask from'
-               ' file: {}').format(os.path.basename(water_mask_file)))
-        atr_msk = readfile.read_attribute(water_mask_file)
-        if (int(atr_msk['LENGTH']), int(atr_msk['WIDTH'])) != (stack_obj.length, stack_obj.width):
-            raise ValueError('Input water mask file has different size from ifgramStack file.')
-        del atr_msk
-        dsName = [i for i in readfile.get_dataset_list(water_mask_file)
-                  if i in ['waterMask', 'mask']][0]
-        waterMask = readfile.read(water_mask_file,
-                                  datasetName=dsName,
-                                  box=box)[0].flatten()
-        mask *= np.array(waterMask, np.bool_)
-        del waterMask
-
-    # 2 - Mask for Zero Phase in ALL ifgrams
-    print('skip pixels with zero/nan value in all interferograms')
-    phase_stack = np.nanmean(pha_data, axis=0)
-    mask *= np.multiply(~np.isnan(phase_stack), phase_stack != 0.)
-    del phase_stack
-
-    # Invert pixels on mask 1+2
-    num_pixel2inv = int(np.sum(mask))
-    idx_pixel2inv = np.where(mask)[0]
-    print(('number of pixels to invert: {} out of {}'
-           ' ({:.1f}%)').format(num_pixel2inv, num_pixel,
-                                num_pixel2inv/num_pixel*100))
     if num_pixel2inv < 1:
         ts = ts.reshape(num_date, num_row, num_col)
         ts_std = ts_std.reshape(num_date, num_row, num_col)
@@ -904,65 +1368,56 @@ def ifgram_inversion_patch(ifgram_file, box=None, ref_phase=None, unwDatasetName
         return ts, temp_coh, ts_std, num_inv_ifg
 
     # Inversion - SBAS
+    pha_var = None
     if weight_func in ['no', 'sbas']:
-        # Mask for Non-Zero Phase in ALL ifgrams (share one B in sbas inversion)
-        mask_all_net = np.all(pha_data, axis=0)
-        mask_all_net *= mask
-        mask_part_net = mask ^ mask_all_net
-
-        if np.sum(mask_all_net) > 0:
-            print(('inverting pixels with valid phase in all  ifgrams'
-                   ' ({:.0f} pixels) ...').format(np.sum(mask_all_net)))
-            tsi, tcohi, num_ifgi = estimate_timeseries(A, B, tbase_diff,
-                                                       ifgram=pha_data[:, mask_all_net],
-                                                       weight_sqrt=None,
-                                                       min_norm_velocity=min_norm_velocity,
-                                                       min_redundancy=min_redundancy)
-            ts[:, mask_all_net] = tsi
-            temp_coh[mask_all_net] = tcohi
-            num_inv_ifg[mask_all_net] = num_ifgi
-
-        if np.sum(mask_part_net) > 0:
-            print(('inverting pixels with valid phase in some ifgrams'
-                   ' ({:.0f} pixels) ...').format(np.sum(mask_part_net)))
-            num_pixel2inv = int(np.sum(mask_part_net))
-            idx_pixel2inv = np.where(mask_part_net)[0]
-            prog_bar = ptime.progressBar(maxValue=num_pixel2inv)
-            for i in range(num_pixel2inv):
-                idx = idx_pixel2inv[i]
-                tsi, tcohi, num_ifgi = estimate_timeseries(A, B, tbase_diff,
-                                                           ifgram=pha_data[:, idx],
-                                                           weight_sqrt=None,
-                                                           min_norm_velocity=min_norm_velocity,
-                                                           min_redundancy=min_redundancy)
-                ts[:, idx] = tsi.flatten()
-                temp_coh[idx] = tcohi
-                num_inv_ifg[idx] = num_ifgi
-                prog_bar.update(i+1, every=1000, suffix='{}/{} pixels'.format(i+1, num_pixel2inv))
-            prog_bar.close()
+        weight = None
 
     # Inversion - WLS
     else:
-        L = int(stack_obj.metadata['ALOOKS']) * int(stack_obj.metadata['RLOOKS'])
-        weight = read_coherence(stack_obj, box=box, dropIfgram=True)
-        weight = coherence2weight(weight, weight_func=weight_func, L=L, epsilon=5e-2)
+        # Decorrelation phase variance for the std of time-series, from the same coherence data
+        # not needed if weight is the inverse of phase variance already
+        if 'var' not in weight_func:
+            print('convert coherence to decorrelation phase variance for time-series std')
+            pha_var = np.array(coh_data, np.float32)
+            pha_var[np.isnan(pha_var)] = 5e-2
+            pha_var[pha_var < 5e-2] = 5e-2
+            pha_var = coherence2phase_variance_ds(pha_var, L)
+
+        weight = coherence2weight(coh_data, weight_func=weight_func, L=L, epsilon=5e-2)
         weight = np.sqrt(weight)
+    del coh_data
 
-        # Weighted Inversion pixel by pixel
-        print('inverting network of interferograms into time-series ...')
-        prog_bar = ptime.progressBar(maxValue=num_pixel2inv)
-        for i in range(num_pixel2inv):
-            idx = idx_pixel2inv[i]
-            tsi, tcohi, num_ifgi = estimate_timeseries(A, B, tbase_diff,
-                                                       ifgram=pha_data[:, idx],
-                                                       weight_sqrt=weight[:, idx],
-                                                       min_norm_velocity=min_norm_velocity,
-                                                       min_redundancy=min_redundancy)
-            ts[:, idx] = tsi.flatten()
-            temp_coh[idx] = tcohi
-            num_inv_ifg[idx] = num_ifgi
-            prog_bar.update(i+1, every=1000, suffix='{}/{} pixels'.format(i+1, num_pixel2inv))
-        prog_bar.close()
+    # Inversion of all pixels on mask, grouped by their valid-interferogram network
+    print('inverting network of interferograms into time-series ...')
+    start_time = time.time()
+    tsi, tcohi, num_ifgi = estimate_timeseries_batch(A, B, tbase_diff,
+                                                     ifgram=pha_data[:, mask],
+                                                     weight_sqrt=weight,
+                                                     min_norm_velocity=min_norm_velocity,
+                                                     min_redundancy=min_redundancy)
+    ts[:, mask] = tsi
+    temp_coh[mask] = tcohi
+    num_inv_ifg[mask] = num_ifgi
+    del tsi, tcohi
+
+    # Decorrelation noise std of time-series, relative to the reference date
+    # skipped for SBAS / fast inversion without weight
+    if weight is not None:
+        print('estimating decorrelation noise std of time-series ...')
+        ts_stdi = np.zeros((num_date, num_pixel2inv), np.float32)
+        ts_stdi[time_idx, :] = estimate_timeseries_std_batch(Astd,
+                                                             ifgram=pha_data[:, mask],
+                                                             weight_sqrt=weight,
+                                                             variance=pha_var)
+        ts_stdi[:, num_ifgi == 0] = 0.
+        ts_std[:, mask] = ts_stdi
+        del ts_stdi
+    del num_ifgi, weight, pha_var
+
+    time_used = max(time.time() - start_time, 1e-6)
+    print('inverted {} pixels in {:.1f} secs ({:.0f} pixels/sec)'.format(num_pixel2inv,
+                                                                        time_used,
+                                                                        num_pixel2inv / time_used))
 
     ts = ts.reshape(num_date, num_row, num_col)
     ts_std = ts_std.reshape(num_date, num_row, num_col)
@@ -1069,16 +1524,28 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
                                                   skip_reference=inps.skip_ref,
                                                   dropIfgram=True)
 
-        # Initialization of output matrix
+        # Initialization of output files, to be filled patch by patch
         stack_obj = ifgramStack(ifgram_file)
         stack_obj.open(print_msg=False)
-        ts     = np.zeros((num_date, length, width), np.float32)
-        ts_std = np.zeros((num_date, length, width), np.float32)
-        temp_coh    = np.zeros((length, width), np.float32)
-        num_inv_ifg = np.zeros((length, width), np.int16)
+        phase2range = -1*float(stack_obj.metadata['WAVELENGTH'])/(4.*np.pi)
+        out_files = [inps.outfile[0], inps.outfile[1], 'timeseriesDecorStd.h5', 'numInvIfgram.h5']
+        if inps.resume:
+            # resume from the existing output files, by skipping the finished boxes
+            box_done = read_box_done(out_files[0])
+            print('resume network inversion with existing files: {}'.format(out_files))
+        else:
+            metadata = dict(stack_obj.metadata)
+            for key in configKeys:
+                metadata[key_prefix+key] = str(vars(inps)[key])
+            out_files = layout_output_files(stack_obj, metadata, inps)
+            box_done = None
 
         # Loop
         if not inps.parallel:
+            box_list, num_box_done = check_box_done(box_list, box_done, shape=(length, width))
+            num_box = len(box_list)
+            if num_box_done > 0:
+                print('skip {} finished patches, {} patches left'.format(num_box_done, num_box))
             for i in range(num_box):
                 box = box_list[i]
                 if num_box > 1:
@@ -1097,12 +1564,54 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
                                                     min_redundancy=inps.minRedundancy,
                                                     water_mask_file=inps.waterMaskFile)
 
-                ts[:, box[1]:box[3], box[0]:box[2]] = tsi
-                ts_std[:, box[1]:box[3], box[0]:box[2]] = ts_stdi
-                temp_coh[box[1]:box[3], box[0]:box[2]] = temp_cohi
-                num_inv_ifg[box[1]:box[3], box[0]:box[2]] = ifg_numi
+                write2hdf5_block(out_files, box, tsi, temp_cohi, ts_stdi, ifg_numi, phase2range)
+                del tsi, temp_cohi, ts_stdi, ifg_numi
+
+        # Parallel loop - local process pool
+        elif inps.parallel == 'local':
+            num_worker = min(inps.numWorker, multiprocessing.cpu_count())
+            print('parallel processing using a local process pool with {} workers'.format(num_worker))
 
-        # Parallel loop
+            # split each patch along the row direction, to read contiguous HDF5 data for each worker
+            all_boxes = []
+            for box in box_list:
+                all_boxes += subsplit_boxes4_workers(box, num_split=num_worker, dimension='y')
+            all_boxes = [i for i in all_boxes if i[3] > i[1]]
+            all_boxes, num_box_done = check_box_done(all_boxes, box_done, shape=(length, width))
+            num_subbox = len(all_boxes)
+            if num_box_done > 0:
+                print('skip {} finished boxes, {} boxes left'.format(num_box_done, num_subbox))
+
+            start_time_subboxes = time.time()
+            # spawn new processes instead of fork, which is not safe while other threads,
+            # e.g. concurrent steps in pysarApp.py, are doing HDF5 I/O in the main process
+            with concurrent.futures.ProcessPoolExecutor(max_workers=num_worker,
+                                                        mp_context=multiprocessing.get_context('spawn'),
+                                                        initializer=init_local_worker) as executor:
+                futures = []
+                for subbox in all_boxes:
+                    data = (ifgram_file,
+                            subbox,
+                            ref_phase,
+                            inps.unwDatasetName,
+                            inps.weightFunc,
+                            inps.minNormVelocity,
+                            inps.maskDataset,
+                            inps.maskThreshold,
+                            inps.minRedundancy,
+                            inps.waterMaskFile)
+                    futures.append(executor.submit(parallel_ifgram_inversion_patch, data))
+
+                # write the result of each sub-box into the output files as soon as it is done
+                for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                    tsi, temp_cohi, ts_stdi, ifg_numi, subbox = future.result()
+                    write2hdf5_block(out_files, subbox, tsi, temp_cohi, ts_stdi, ifg_numi, phase2range)
+                    print('box {}/{} complete in {:.1f} secs: {}'.format(i+1, num_subbox,
+                                                                        time.time() - start_time_subboxes,
+                                                                        subbox))
+                    del tsi, temp_cohi, ts_stdi, ifg_numi
+
+        # Parallel loop - dask cluster
         else:
             try:
                 from dask.distributed import Client, as_completed
@@ -1134,6 +1643,9 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
                 # `box_list` is split into smaller boxes and then each box is processed in parallel
                 # With larger jobs, increasing the `num_split` factor may improve runtime
                 all_boxes += subsplit_boxes4_workers(box, num_split=1 * NUM_WORKERS, dimension='x')
+            all_boxes, num_box_done = check_box_done(all_boxes, box_done, shape=(length, width))
+            if num_box_done > 0:
+                print('skip {} finished boxes, {} boxes left'.format(num_box_done, len(all_boxes)))
 
             futures = []
             start_time_subboxes = time.time()
@@ -1168,36 +1680,56 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
                 print("FUTURE #" + str(i_future), "complete in", time.time() - start_time_subboxes,
                       "seconds. Box:", subbox, "Time:", time.time())
                 tsi, temp_cohi, ts_stdi, ifg_numi, subbox = result
-
-                ts[:, subbox[1]:subbox[3], subbox[0]:subbox[2]] = tsi
-                ts_std[:, subbox[1]:subbox[3], subbox[0]:subbox[2]] = ts_stdi
-                temp_coh[subbox[1]:subbox[3], subbox[0]:subbox[2]] = temp_cohi
-                num_inv_ifg[subbox[1]:subbox[3], subbox[0]:subbox[2]] = ifg_numi
+                write2hdf5_block(out_files, subbox, tsi, temp_cohi, ts_stdi, ifg_numi, phase2range)
+                del tsi, temp_cohi, ts_stdi, ifg_numi
 
             # Shut down Dask workers gracefully
             cluster.close()
             client.close()
 
         # reference pixel
-        ref_y = int(stack_obj.metadata['REF_Y'])
-        ref_x = int(stack_obj.metadata['REF_X'])
-        num_inv_ifg[ref_y, ref_x] = num_ifgram
-        temp_coh[ref_y, ref_x] = 1.
-
-        # metadata
-        metadata = dict(stack_obj.metadata)
-        for key in configKeys:
-            metadata[key_prefix+key] = str(vars(inps)[key])
-        write2hdf5_file(ifgram_file, metadata, ts, temp_coh, ts_std, num_inv_ifg, suffix='', inps=inps)
+        if 'REF_Y' in stack_obj.metadata.keys():
+            ref_y = int(stack_obj.metadata['REF_Y'])
+            ref_x = int(stack_obj.metadata['REF_X'])
+            block = [ref_y, ref_y+1, ref_x, ref_x+1]
+            writefile.write_hdf5_block(out_files[1], np.ones((1, 1), np.float32), 'temporalCoherence',
+                                       block=block, print_msg=False)
+            writefile.write_hdf5_block(out_files[3], np.ones((1, 1), np.int16) * num_ifgram, 'mask',
+                                       block=block, print_msg=False)
+
+        # all boxes are finished: remove the progress record
+        box_done = read_box_done(out_files[0])
+        with h5py.File(out_files[0], 'r+') as f:
+            del f['boxDone']
+
+        # timeseriesDecorStd.h5 is written only if decorrelation noise std is available
+        if not np.any(box_done[:, 4]):
+            print('no decorrelation noise std estimated, remove file: {}'.format(out_files[2]))
+            os.remove(out_files[2])
+        print('finished writing to files: {}'.format([i for i in out_files if os.path.isfile(i)]))
 
     m, s = divmod(time.time()-start_time, 60)
     print('time used: {:02.0f} mins {:02.1f} secs.\n'.format(m, s))
     return
 
 
+def init_local_worker():
+    """Initializer of the local process pool workers.
+    Limit the number of threads of BLAS/OpenMP within each worker process, to avoid over-subscription
+    of the CPUs by num_worker * num_thread, if threadpoolctl is available.
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=1)
+    except ImportError:
+        pass
+    return
+
+
 def parallel_ifgram_inversion_patch(data):
     """
-    This is the starting point for Dask futures. Futures start executing code here.
+    This is the starting point for Dask futures and local process pool workers.
+    Futures start executing code here.
     :param data:
     :return: The box
     """
@@ -1231,8 +1763,11 @@ def main(iargs=None):
     inps = cmd_line_parse(iargs)
 
     # --update option
-    if inps.update_mode and run_or_skip(inps) == 'skip':
-        return inps.outfile
+    if inps.update_mode:
+        flag = run_or_skip(inps)
+        if flag == 'skip':
+            return inps.outfile
+        inps.resume = flag == 'resume'
 
     # Network Inversion
     if inps.residualNorm == 'L2':
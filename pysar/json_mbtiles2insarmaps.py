@@ -4,8 +4,13 @@ import sys
 import argparse
 from pysar.add_attribute_insarmaps import InsarDatabaseController, InsarDatasetController
 import os
+import io
+import json
+import time
 import pickle
+import threading
 import numpy
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 dbUsername = "INSERT"
 dbPassword = "INSERT"
@@ -106,6 +111,210 @@ def upload_json(folder_path):
     attributesController.cluster_table_using(area_id, area_id + "_p_idx")
     attributesController.close()
 
+# ---------------------------------------------------------------------------------------
+# native ingest: stream point features of json chunks into the database with COPY.
+# All chunks are loaded concurrently into a staging table via a pool of connections. The old
+# dataset is then removed, the new metadata is inserted and the staging table is renamed to the
+# dataset table all in one transaction, so that a failure at any step leaves the old dataset in place.
+# The pool can be any object with getconn() / putconn(conn) methods returning DB-API connections
+# whose cursor supports copy_expert(sql, file), e.g. psycopg2.pool.ThreadedConnectionPool
+# for PostgreSQL/PostGIS, or an in-process stand-in for testing.
+POINT_TABLE_COLUMNS = '(ogc_fid serial PRIMARY KEY, wkb_geometry geometry(Point, 4326), p integer, d double precision[], m double precision)'
+
+def get_json_files(folder_path):
+    json_files = [i for i in os.listdir(folder_path) if i.endswith(".json")]
+    # chunk_1.json, chunk_2.json, ..., chunk_10.json, ...
+    json_files = sorted(json_files, key=lambda x: int(''.join(c for c in x if c.isdigit()) or 0))
+    return [os.path.join(folder_path, i) for i in json_files]
+
+def json2copy_buffer(json_file):
+    """convert point features in json file to a buffer in text format of COPY
+    with columns in order of: wkb_geometry, p, d, m
+    """
+    with open(json_file, "r") as f:
+        features = json.load(f)["features"]
+
+    lines = []
+    for feature in features:
+        lon, lat = feature["geometry"]["coordinates"]
+        prop = feature["properties"]
+        lines.append("SRID=4326;POINT({!r} {!r})\t{}\t{{{}}}\t{!r}\n".format(
+            lon, lat, prop["p"], ",".join(map(repr, prop["d"])), prop["m"]))
+    return io.StringIO("".join(lines)), len(lines)
+
+def copy_json_file(pool, table, json_file, stop_event=None):
+    """load one json file into table with COPY, using one connection from pool.
+    The file is skipped if stop_event is set, i.e. another file failed, and
+    stop_event is set if this file fails.
+    """
+    if stop_event is not None and stop_event.is_set():
+        return 0
+    try:
+        buf, num_point = json2copy_buffer(json_file)
+        con = pool.getconn()
+        try:
+            if stop_event is not None and stop_event.is_set():
+                return 0
+            cursor = con.cursor()
+            cursor.copy_expert('COPY "' + table + '" (wkb_geometry, p, d, m) FROM STDIN', buf)
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+        finally:
+            pool.putconn(con)
+    except Exception:
+        if stop_event is not None:
+            stop_event.set()
+        raise
+    return num_point
+
+def drop_table(pool, table):
+    con = pool.getconn()
+    try:
+        con.rollback()
+        con.cursor().execute('DROP TABLE IF EXISTS "' + table + '"')
+        con.commit()
+    finally:
+        pool.putconn(con)
+
+def load_json_into_staging_table(pool, table, json_files, num_worker=4):
+    """create staging table and load json files into it concurrently.
+    Loading stops at the first failed file: the remaining files are skipped
+    by the workers and the staging table is dropped.
+    """
+    con = pool.getconn()
+    try:
+        cursor = con.cursor()
+        cursor.execute('DROP TABLE IF EXISTS "' + table + '"')
+        cursor.execute('CREATE TABLE "' + table + '" ' + POINT_TABLE_COLUMNS)
+        con.commit()
+    finally:
+        pool.putconn(con)
+
+    start_time = time.time()
+    num_point = 0
+    stop_event = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=num_worker) as executor:
+            futures = {executor.submit(copy_json_file, pool, table, i, stop_event): i for i in json_files}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    print("Error loading " + os.path.basename(futures[future]) + ", skip the remaining files")
+                    stop_event.set()
+                    for i in futures:
+                        i.cancel()
+                    raise future.exception()
+                if stop_event.is_set():
+                    continue
+                num_point += future.result()
+                print("Inserted " + os.path.basename(futures[future]) + " to staging table " + table)
+    except Exception:
+        drop_table(pool, table)
+        raise
+
+    time_used = max(time.time() - start_time, 1e-6)
+    print("loaded {} points from {} files in {:.1f} secs ({:.0f} points/sec)".format(
+        num_point, len(json_files), time_used, num_point / time_used))
+    return num_point
+
+def get_area_id(cursor, area_name):
+    cursor.execute("SELECT id FROM area WHERE area.unavco_name = %s", (area_name,))
+    area_id = cursor.fetchone()
+    if area_id:
+        return area_id[0]
+    return None
+
+def replace_dataset(pool, area_name, insarmapsMetadata, staging_table):
+    """replace dataset with the staging table and its metadata in one transaction:
+    remove the old dataset, insert the metadata into area / extra_attributes /
+    plot_attributes tables, rename the staging table to the id of the new area entry
+    and index it on p. Nothing is changed if any of these fails.
+    Returns: table - str, name of the dataset table, i.e. id of area
+    """
+    con = pool.getconn()
+    try:
+        cursor = con.cursor()
+        try:
+            # same tables as InsarDatabaseController, without the commit after each statement
+            cursor.execute("CREATE TABLE IF NOT EXISTS area ( unavco_name varchar, project_name varchar, longitude double precision, latitude double precision, country varchar, region varchar, numchunks integer, attributekeys varchar[100], attributevalues varchar[100], stringdates varchar[200], decimaldates double precision[200] );")
+            cursor.execute("CREATE TABLE IF NOT EXISTS extra_attributes (area_id integer, attributekey varchar, attributevalue varchar);")
+            cursor.execute("CREATE TABLE IF NOT EXISTS plot_attributes (area_id integer, attributekey varchar, attributevalue json);")
+
+            # 1. remove the old dataset, if it is there
+            old_id = get_area_id(cursor, area_name)
+            if old_id is not None:
+                print("Clearing old dataset " + str(old_id))
+                cursor.execute("DELETE FROM area WHERE id = %s", (old_id,))
+                cursor.execute("DELETE FROM extra_attributes WHERE area_id = %s", (old_id,))
+                cursor.execute("DELETE FROM plot_attributes WHERE area_id = %s", (old_id,))
+                cursor.execute('DROP TABLE IF EXISTS "' + str(old_id) + '"')
+
+            # 2. insert metadata. this creates entry into area table.
+            # we need this entry to get the db to generate an id for area which
+            # we use to name the corresponding table for the dataset
+            m = insarmapsMetadata
+            cursor.execute("INSERT INTO area VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                           (area_name, m["project_name"], m["mid_long"], m["mid_lat"], m["country"],
+                            m["region"], m["chunk_num"], m["attribute_keys"], m["attribute_values"],
+                            m["string_dates_sql"], m["decimal_dates_sql"]))
+            area_id = get_area_id(cursor, area_name)
+            for k, v in m["attributes"].items():
+                # convert numpy.int64 objects to native python types otherwise psycopg2 can't upload to db
+                if isinstance(v, numpy.int64):
+                    v = v.item()
+                if k in m["needed_attributes"]:
+                    cursor.execute("INSERT INTO extra_attributes VALUES (%s, %s, %s);", (area_id, k, v))
+                elif k == "plotAttributes":
+                    cursor.execute("INSERT INTO plot_attributes VALUES (%s, %s, %s);", (area_id, k, v))
+
+            # 3. swap in the staging table
+            table = str(area_id)
+            print("Swapping staging table into " + table + " and creating index")
+            cursor.execute('ALTER TABLE "' + staging_table + '" RENAME TO "' + table + '"')
+            cursor.execute('CREATE INDEX "' + table + '_p_idx" ON "' + table + '" (p)')
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+        # clustering only re-orders rows on disk, the dataset is complete without it
+        try:
+            cursor.execute('CLUSTER "' + table + '" USING "' + table + '_p_idx"')
+            con.commit()
+        except Exception as e:
+            con.rollback()
+            print(str(e))
+    finally:
+        pool.putconn(con)
+    return table
+
+def upload_json_copy(folder_path, pool=None, num_worker=4):
+    """upload json chunks into the database with COPY via staging table"""
+    global dbUsername, dbPassword, dbHost
+    with open(folder_path + "/metadata.pickle", "rb") as file:
+        insarmapsMetadata = pickle.load(file)
+    area_name = insarmapsMetadata["area"]
+    json_files = get_json_files(folder_path)
+    staging_table = "staging_" + area_name
+
+    if pool is None:
+        import psycopg2.pool
+        pool = psycopg2.pool.ThreadedConnectionPool(1, num_worker + 1, dbname='pgis', user=dbUsername,
+                                                    password=dbPassword, host=dbHost)
+
+    # 1. load all chunks into staging table, the existing dataset is untouched if it fails
+    print("Loading {} json chunks into staging table with {} workers".format(len(json_files), num_worker))
+    load_json_into_staging_table(pool, staging_table, json_files, num_worker=num_worker)
+
+    # 2. replace the existing dataset, the staging table is dropped if it fails
+    try:
+        table = replace_dataset(pool, area_name, insarmapsMetadata, staging_table)
+    except Exception:
+        drop_table(pool, staging_table)
+        raise
+    return table
+
 def build_parser():
     dbHost = "insarmaps.rsmas.miami.edu"
     parser = argparse.ArgumentParser(description='Convert a Unavco format     H5 file for ingestion into insarmaps.')
@@ -116,6 +325,10 @@ def build_parser():
     parser.add_argument("-P", "--server_password", help="password for the insarmaps server (the machine where the tileserver and http server reside)", required=False)
     parser.add_argument("--mbtiles_file", help="mbtiles file to upload", required=False)
     parser.add_argument("mbtiles_file_positional", help="mbtiles file to upload, as a positional argument", nargs="?")
+    parser.add_argument("--ogr2ogr", dest="use_ogr2ogr", action="store_true",
+                        help="upload json chunks with ogr2ogr one by one, instead of COPY via staging table")
+    parser.add_argument("--num-worker", dest="num_worker", type=int, default=4,
+                        help="number of concurrent connections to load json chunks with COPY, default: 4")
     required = parser.add_argument_group("required arguments")
     required.add_argument("-u", "--user", help="username for the insarmaps database", required=True)
     required.add_argument("-p", "--password", help="password for the insarmaps database", required=True)
@@ -131,12 +344,13 @@ def main():
     dbPassword = parseArgs.password
     dbHost = parseArgs.host
 
-    if parseArgs.json_folder:
+    json_folder = parseArgs.json_folder or parseArgs.json_folder_positional
+    if json_folder:
         print("Uploading json chunks...")
-        upload_json(parseArgs.json_folder)
-    elif parseArgs.json_folder_positional:
-        print("Uploading json chunks....")
-        upload_json(parseArgs.json_folder_positional)
+        if parseArgs.use_ogr2ogr:
+            upload_json(json_folder)
+        else:
+            upload_json_copy(json_folder, num_worker=parseArgs.num_worker)
 
     if parseArgs.mbtiles_file or parseArgs.mbtiles_file_positional:
         dbContoller = InsarDatasetController(dbUsername, dbPassword, dbHost, 'pgis', parseArgs.server_user, parseArgs.server_password)
@@ -56,8 +56,11 @@ TEMPLATE = """template:
 ## auto - automatic path pattern for Univ of Miami file structure
 ## load_data.py -H to check more details and example inputs.
 pysar.load.processor      = auto  #[isce,roipac,gamma,], auto for isce
-pysar.load.updateMode     = auto  #[yes / no], auto for yes, skip re-loading if HDF5 files are complete
-pysar.load.compression    = auto  #[gzip / lzf / no], auto for no [recommended].
+pysar.load.updateMode     = auto  #[yes / no], auto for yes, skip re-loading if HDF5 files are complete, append new pairs only
+pysar.load.compression    = auto  #[gzip / lzf / lz4 / zstd / no], auto for no, or per-dataset policy, e.g. lz4,coherence:zstd
+pysar.load.cohMantissaBits= auto  #[1-23 / no], auto for no, keep N mantissa bits of coherence (lossy), e.g. 10 for ~1e-3
+pysar.load.numWorker      = auto  #[int > 0], auto for 1, number of threads to read interferograms concurrently
+pysar.load.chunkLayout    = auto  #[auto / image / pixel / 100,64,64], auto for h5py heuristic, chunk shape of 3D datasets
 ##---------for ISCE only:
 pysar.load.metaFile       = auto  #[path2metadata_file]
 pysar.load.baselineDir    = auto  #[path2baseline_dir]
@@ -115,8 +118,29 @@ def create_parser():
                         help='InSAR processor/software of the file', default='isce')
     parser.add_argument('--enforce', '-f', dest='updateMode', action='store_false',
                         help='Disable the update mode, or skip checking dataset already loaded.')
-    parser.add_argument('--compression', choices={'gzip', 'lzf', None}, default=None,
-                        help='compress loaded geometry while writing HDF5 file, default: None.')
+    parser.add_argument('--compression', default=None,
+                        help='compress loaded interferograms while writing HDF5 file, default: None.\n'
+                             'gzip/lzf - h5py built-in codecs\n'
+                             'lz4/zstd - fast codecs through hdf5plugin, with byte-shuffle for numbers and\n'
+                             '           bit-shuffle for bool (connectComponent), lzf if not installed\n'
+                             'per-dataset policy as [dsName:]codec list, e.g. lz4,coherence:zstd\n'
+                             'The codec of each dataset is recorded in its COMPRESSION attribute.')
+    parser.add_argument('--coh-mantissa-bits', dest='cohMantissaBits', type=int, default=None,
+                        help='number of float32 mantissa bits to keep for coherence, default: None for all.\n'
+                             'Lossy, e.g. 10 bits for ~1e-3 relative precision, but compress much better.')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of threads to read interferograms concurrently, default: 1.\n'
+                             'Pairs are read/decoded in parallel while a single writer streams them\n'
+                             'into HDF5 file, with at most 2 * num_worker pairs in memory.')
+    parser.add_argument('--chunk-layout', dest='chunkLayout', default='auto',
+                        help='chunk layout of 3D datasets in ifgramStack file, default: auto.\n'
+                             'auto  - h5py heuristic\n'
+                             'image - image-major, (1, nrow, width), for fast reading of whole images\n'
+                             'pixel - pixel-major, (num_ifgram, 64, 64), for fast reading of time columns\n'
+                             '        of small boxes, e.g. network inversion, tsview.py\n'
+                             '100,64,64 - explicit chunk shape, 0 for the full axis\n'
+                             'Chunks with more than one pair are written in groups of pairs, with up to 1 GB in memory.\n'
+                             'Use rechunk_hdf5.py to convert existing files.')
 
     parser.add_argument('-o', '--output', type=str, nargs=3, dest='outfile',
                         default=['./INPUTS/ifgramStack.h5',
@@ -141,6 +165,9 @@ def cmd_line_parse(iargs=None):
         print('{} -H to show the example template file'.format(os.path.basename(__file__)))
         sys.exit(1)
 
+    if inps.cohMantissaBits is not None and not 1 <= inps.cohMantissaBits <= 23:
+        parser.error('--coh-mantissa-bits should be in [1, 23], input: {}'.format(inps.cohMantissaBits))
+
     inps.outfile = [os.path.abspath(i) for i in inps.outfile]
     inps.outdir = os.path.dirname(inps.outfile[0])
 
@@ -169,13 +196,20 @@ def read_inps2dict(inps):
     key_list = [i.split(prefix)[1] for i in template.keys() if i.startswith(prefix)]
     for key in key_list:
         value = template[prefix+key]
-        if key in ['processor', 'updateMode', 'compression']:
+        if key in ['processor', 'updateMode', 'compression', 'numWorker', 'chunkLayout', 'cohMantissaBits']:
             inpsDict[key] = template[prefix+key]
         elif value:
             inpsDict[prefix+key] = template[prefix+key]
 
     if inpsDict['compression'] == False:
         inpsDict['compression'] = None
+    if inpsDict['cohMantissaBits'] in [False, None]:
+        inpsDict['cohMantissaBits'] = None
+    else:
+        inpsDict['cohMantissaBits'] = int(inpsDict['cohMantissaBits'])
+        if not 1 <= inpsDict['cohMantissaBits'] <= 23:
+            raise ValueError('pysar.load.cohMantissaBits should be in [1, 23], input: {}'.format(inpsDict['cohMantissaBits']))
+    inpsDict['numWorker'] = max(int(inpsDict['numWorker']), 1)
 
     # PROJECT_NAME --> PLATFORM
     if not inpsDict['PROJECT_NAME']:
@@ -445,6 +479,28 @@ def update_object(outFile, inObj, box, updateMode=True):
     return write_flag
 
 
+def append_object(outFile, inObj, box, updateMode=True):
+    """Append to h5 file instead of re-writing it if: 1) update mode is on,
+                                                     2) h5 exists and readable,
+                                                     3) it has the same size and datasets as ifgramStackDict,
+                                                     4) all its date12 are in ifgramStackDict"""
+    if (not updateMode
+            or inObj.name != 'ifgramStack'
+            or ut.run_or_skip(outFile, check_readable=True, print_msg=False) == 'run'):
+        return False
+
+    out_size = ifgramStack(outFile).get_size()[1:]
+    if out_size != inObj.get_size(box=box)[1:]:
+        return False
+
+    new_pairs = inObj.get_new_pairs(outFile)
+    if not new_pairs:
+        return False
+    print('Found {} new date12 not in file {}, append them.'.format(len(new_pairs),
+                                                                   os.path.basename(outFile)))
+    return True
+
+
 def prepare_metadata(inpsDict):
     processor = inpsDict['processor']
     script_name = 'prep_{}.py'.format(processor)
@@ -483,12 +539,18 @@ def prepare_metadata(inpsDict):
 def print_write_setting(inpsDict):
     updateMode = inpsDict['updateMode']
     comp = inpsDict['compression']
+    num_worker = inpsDict['numWorker']
+    chunk_layout = inpsDict['chunkLayout']
     print('-'*50)
     print('updateMode : {}'.format(updateMode))
     print('compression: {}'.format(comp))
+    print('numWorker  : {}'.format(num_worker))
+    print('chunkLayout: {}'.format(chunk_layout))
+    if inpsDict['cohMantissaBits'] is not None:
+        print('cohMantissaBits: {}'.format(inpsDict['cohMantissaBits']))
     box = inpsDict['box']
     boxGeo = inpsDict['box4geo_lut']
-    return updateMode, comp, box, boxGeo
+    return updateMode, comp, num_worker, chunk_layout, box, boxGeo
 
 
 def get_extra_metadata(inpsDict):
@@ -519,7 +581,7 @@ def main(iargs=None):
     geomRadarObj, geomGeoObj = read_inps_dict2geometry_dict_object(inpsDict)
 
     # prepare wirte
-    updateMode, comp, box, boxGeo = print_write_setting(inpsDict)
+    updateMode, comp, num_worker, chunk_layout, box, boxGeo = print_write_setting(inpsDict)
     if any([stackObj, geomRadarObj, geomGeoObj]) and not os.path.isdir(inps.outdir):
         os.makedirs(inps.outdir)
         print('create directory: {}'.format(inps.outdir))
@@ -527,11 +589,19 @@ def main(iargs=None):
     # write
     if stackObj and update_object(inps.outfile[0], stackObj, box, updateMode=updateMode):
         print('-'*50)
-        stackObj.write2hdf5(outputFile=inps.outfile[0],
-                            access_mode='w',
-                            box=box,
-                            compression=comp,
-                            extra_metadata=extraDict)
+        if append_object(inps.outfile[0], stackObj, box, updateMode=updateMode):
+            stackObj.append2hdf5(outputFile=inps.outfile[0],
+                                 box=box,
+                                 num_worker=num_worker)
+        else:
+            stackObj.write2hdf5(outputFile=inps.outfile[0],
+                                access_mode='w',
+                                box=box,
+                                compression=comp,
+                                extra_metadata=extraDict,
+                                num_worker=num_worker,
+                                chunk_layout=chunk_layout,
+                                coh_mantissa_bits=inpsDict['cohMantissaBits'])
 
     if geomRadarObj and update_object(inps.outfile[1], geomRadarObj, box, updateMode=updateMode):
         print('-'*50)
@@ -10,13 +10,11 @@ import os
 import argparse
 import h5py
 import numpy as np
-from matplotlib import pyplot as plt, dates as mdates
 from pysar.objects import ifgramStack
 from pysar.utils import (ptime,
                          readfile,
                          utils as ut,
-                         network as pnet,
-                         plot as pp)
+                         network as pnet)
 
 
 ###############################  Usage  ################################
@@ -255,6 +253,8 @@ def manual_select_pairs_to_remove(stackFile):
     print('2) repeat until you select all pairs you would like to remove')
     print('3) close the figure to continue the program ...')
     print('-------------------------------------------------------------\n')
+    from matplotlib import pyplot as plt, dates as mdates
+    from pysar.utils import plot as pp
     obj = ifgramStack(stackFile)
     obj.open()
     date12ListAll = obj.date12List
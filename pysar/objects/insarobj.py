@@ -13,17 +13,18 @@
 import os
 import time
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import h5py
 import numpy as np
 
-try:
-    from skimage.transform import resize
-except ImportError:
-    raise ImportError('Could not import skimage!')
-
 from pysar.objects import (dataTypeDict,
                            geometryDatasetNames,
-                           ifgramDatasetNames)
+                           ifgramDatasetNames,
+                           get_chunk_shape,
+                           get_chunk_row_size,
+                           get_dataset_compression,
+                           truncate_float_mantissa)
 from pysar.utils import readfile, ptime, utils as ut
 
 
@@ -34,6 +35,25 @@ CPX_ZERO = np.complex64(0.0)
 
 dataType = np.float32
 
+# max size in bytes of pairs buffered in memory for writing time-contiguous chunks
+MAX_BUFFER_BYTE = 1e9
+
+
+def get_chunk_cache_kwargs(shape, chunk_list, dtype_list):
+    """h5py.File() keyword arguments of chunk cache to hold one full row of chunks
+    of the largest 3D dataset; empty for the default 1 MB cache if it is enough.
+    """
+    num_byte, num_chunk = 0, 0
+    for chunks, dtype in zip(chunk_list, dtype_list):
+        row_byte = get_chunk_row_size(shape, chunks, dtype)
+        if row_byte > num_byte:
+            num_byte = row_byte
+            num_chunk = row_byte // (np.prod(chunks, dtype=np.int64) * np.dtype(dtype).itemsize)
+    if num_byte <= 1024**2:
+        return {}
+    # number of hash slots ~100 times the number of chunks in the cache, as recommended by HDF5
+    return dict(rdcc_nbytes=int(num_byte * 1.1), rdcc_nslots=int(num_chunk * 100 + 1))
+
 
 ########################################################################################
 class ifgramStackDict:
@@ -87,7 +107,88 @@ class ifgramStackDict:
             dsDataType = dataTypeDict[metadata['DATA_TYPE'].lower()]
         return dsDataType
 
-    def write2hdf5(self, outputFile='ifgramStack.h5', access_mode='w', box=None, compression=None, extra_metadata=None):
+    def read_pairs(self, dsName, box=None, num_worker=1, max_queue=None):
+        '''Read one dataset of all pairs, in the order of self.pairs.
+        Parameters: dsName     : str, dataset name, e.g. unwrapPhase, coherence
+                    box        : tuple, subset range in (x0, y0, x1, y1)
+                    num_worker : int, number of threads to read/decode pairs concurrently
+                    max_queue  : int, max number of pairs read but not consumed yet,
+                                 default: 2 * num_worker, to cap memory usage.
+        Returns:    generator of (i, data, bperp) with data in 2D np.ndarray
+        Example:    for i, data, bperp in stackObj.read_pairs('unwrapPhase', num_worker=4):
+                        ds[i, :, :] = data
+        '''
+        def read_pair(i):
+            ifgramObj = self.pairsDict[self.pairs[i]]
+            data = ifgramObj.read(dsName, box=box)[0]
+            return i, data, ifgramObj.get_perp_baseline()
+
+        num_pair = len(self.pairs)
+        if num_worker <= 1:
+            for i in range(num_pair):
+                yield read_pair(i)
+            return
+
+        max_queue = max(max_queue or 2 * num_worker, num_worker)
+        with ThreadPoolExecutor(max_workers=num_worker) as executor:
+            futures = deque()
+            next_idx = 0
+            while next_idx < num_pair or futures:
+                # keep at most max_queue pairs in flight
+                while next_idx < num_pair and len(futures) < max_queue:
+                    futures.append(executor.submit(read_pair, next_idx))
+                    next_idx += 1
+                yield futures.popleft().result()
+
+    def write_pairs(self, ds, dsName, box=None, num_worker=1, start_idx=0, mantissa_bits=None):
+        '''Read one dataset of all pairs and write into the opened 3D h5py.Dataset from start_idx.
+        For time-contiguous chunks, e.g. the pixel layout, pairs are buffered in groups of up to
+        MAX_BUFFER_BYTE and written one row of chunks at a time, instead of one slice at a time,
+        which would read-modify-write every chunk for every pair. The chunk cache of the file
+        should hold one full row of chunks, check pysar.objects.get_chunk_row_size().
+        Parameters: ds         : h5py.Dataset, 3D dataset to write
+                    dsName     : str, dataset name to read, e.g. unwrapPhase, coherence
+                    box        : tuple, subset range in (x0, y0, x1, y1)
+                    num_worker : int, number of threads to read pairs concurrently
+                    start_idx  : int, index of the 1st pair in the 1st axis of ds
+                    mantissa_bits : int, number of float32 mantissa bits to keep, None for all
+        '''
+        num_pair, length, width = len(self.pairs), ds.shape[1], ds.shape[2]
+        num_buffer = 1
+        if ds.chunks and ds.chunks[0] > 1:
+            slice_byte = length * width * ds.dtype.itemsize
+            num_buffer = int(max(1, min(ds.chunks[0], MAX_BUFFER_BYTE // slice_byte)))
+
+        def write_buffer(buf):
+            i0 = start_idx + buf[0][0]
+            i1 = start_idx + buf[-1][0] + 1
+            if len(buf) == 1:
+                ds[i0, :, :] = buf[0][1]
+                return
+            num_row = ds.chunks[1]
+            for y0 in range(0, length, num_row):
+                y1 = min(y0 + num_row, length)
+                ds[i0:i1, y0:y1, :] = np.stack([data[y0:y1, :] for i, data in buf])
+
+        buf = []
+        prog_bar = ptime.progressBar(maxValue=num_pair)
+        for i, data, bperp in self.read_pairs(dsName, box=box, num_worker=num_worker):
+            if mantissa_bits is not None:
+                data = truncate_float_mantissa(data, mantissa_bits)
+            buf.append((i, data))
+            self.bperp[i] = bperp
+            if len(buf) >= num_buffer:
+                write_buffer(buf)
+                buf = []
+            prog_bar.update(i+1, suffix='{}_{}'.format(self.pairs[i][0],
+                                                       self.pairs[i][1]))
+        if buf:
+            write_buffer(buf)
+        prog_bar.close()
+        ds.attrs['MODIFICATION_TIME'] = str(time.time())
+
+    def write2hdf5(self, outputFile='ifgramStack.h5', access_mode='w', box=None, compression=None,
+                   extra_metadata=None, num_worker=1, chunk_layout='auto', coh_mantissa_bits=None):
         '''Save/write an ifgramStackDict object into an HDF5 file with the structure below:
 
         /                  Root level
@@ -106,51 +207,63 @@ class ifgramStackDict:
         Parameters: outputFile : str, Name of the HDF5 file for the InSAR stack
                     access_mode : str, access mode of output File, e.g. w, r+
                     box : tuple, subset range in (x0, y0, x1, y1)
+                    compression : str, compression policy, e.g. lzf, gzip, lz4, zstd, or
+                                  per-dataset policy, e.g. lz4,coherence:zstd,
+                                  check pysar.objects.get_dataset_compression()
                     extra_metadata : dict, extra metadata to be added into output file
+                    num_worker : int, number of threads to read pairs concurrently,
+                                 while the main thread writes them into HDF5 file in order.
+                    chunk_layout : str or tuple of int, chunk layout of 3D datasets,
+                                   e.g. auto, image, pixel, check pysar.objects.get_chunk_shape()
+                    coh_mantissa_bits : int, number of float32 mantissa bits to keep for coherence,
+                                        lossy but improves compression, None to keep all.
         Returns:    outputFile
         '''
 
         self.outputFile = outputFile
-        f = h5py.File(self.outputFile, access_mode)
-        print('create HDF5 file {} with {} mode'.format(self.outputFile, access_mode))
-
         self.pairs = sorted([pair for pair in self.pairsDict.keys()])
         self.dsNames = list(self.pairsDict[self.pairs[0]].datasetDict.keys())
         self.dsNames = [i for i in ifgramDatasetNames if i in self.dsNames]
         maxDigit = max([len(i) for i in self.dsNames])
         self.get_size(box)
 
+        # chunk cache to hold one full row of chunks, for write_pairs()
+        dsShape = (self.numIfgram, self.length, self.width)
+        dsDataTypes = [np.bool_ if i in ['connectComponent'] else dataType for i in self.dsNames]
+        chunk_list = [get_chunk_shape(dsShape, layout=chunk_layout, dtype=i) for i in dsDataTypes]
+        cache_kwargs = get_chunk_cache_kwargs(dsShape, chunk_list, dsDataTypes)
+
+        f = h5py.File(self.outputFile, access_mode, **cache_kwargs)
+        print('create HDF5 file {} with {} mode'.format(self.outputFile, access_mode))
+
         self.bperp = np.zeros(self.numIfgram)
         ###############################
         # 3D datasets containing unwrapPhase, coherence, connectComponent, wrapPhase, etc.
-        for dsName in self.dsNames:
-            dsShape = (self.numIfgram, self.length, self.width)
-            dsDataType = dataType
-            if dsName in ['connectComponent']:
-                dsDataType = np.bool_
+        for dsName, dsDataType, chunks in zip(self.dsNames, dsDataTypes, chunk_list):
+            codec, comp_kwargs = get_dataset_compression(compression, dsName, dsDataType)
             print(('create dataset /{d:<{w}} of {t:<25} in size of {s}'
-                   ' with compression = {c}').format(d=dsName,
-                                                     w=maxDigit,
-                                                     t=str(dsDataType),
-                                                     s=dsShape,
-                                                     c=str(compression)))
+                   ' with compression = {c} and chunks = {k}').format(d=dsName,
+                                                                      w=maxDigit,
+                                                                      t=str(dsDataType),
+                                                                      s=dsShape,
+                                                                      c=str(codec),
+                                                                      k=chunks))
             ds = f.create_dataset(dsName,
                                   shape=dsShape,
                                   maxshape=(None, dsShape[1], dsShape[2]),
                                   dtype=dsDataType,
-                                  chunks=True,
-                                  compression=compression)
-
-            prog_bar = ptime.progressBar(maxValue=self.numIfgram)
-            for i in range(self.numIfgram):
-                ifgramObj = self.pairsDict[self.pairs[i]]
-                data = ifgramObj.read(dsName, box=box)[0]
-                ds[i, :, :] = data
-                self.bperp[i] = ifgramObj.get_perp_baseline()
-                prog_bar.update(i+1, suffix='{}_{}'.format(self.pairs[i][0],
-                                                           self.pairs[i][1]))
-            prog_bar.close()
-            ds.attrs['MODIFICATION_TIME'] = str(time.time())
+                                  chunks=chunks,
+                                  **comp_kwargs)
+            if codec:
+                ds.attrs['COMPRESSION'] = codec
+
+            mantissa_bits = None
+            if dsName == 'coherence' and coh_mantissa_bits is not None:
+                mantissa_bits = int(coh_mantissa_bits)
+                ds.attrs['MANTISSA_BITS'] = str(mantissa_bits)
+                print('keep {} mantissa bits of /{} (lossy)'.format(mantissa_bits, dsName))
+
+            self.write_pairs(ds, dsName, box=box, num_worker=num_worker, mantissa_bits=mantissa_bits)
 
         ###############################
         # 2D dataset containing master and slave dates of all pairs
@@ -203,6 +316,123 @@ class ifgramStackDict:
         print('Finished writing to {}'.format(self.outputFile))
         return self.outputFile
 
+    def get_new_pairs(self, outputFile):
+        '''Get pairs of this object that do not exist in the ifgramStack HDF5 file yet.
+        Returns: list of (mDate, sDate) tuples, sorted, or None if the file can not be
+                 extended, i.e. 1) it contains pairs not in this object,
+                                2) it has different 3D datasets, or
+                                3) its 3D datasets are not resizable.
+        '''
+        with h5py.File(outputFile, 'r') as f:
+            if 'date' not in f.keys():
+                return None
+            outPairs = [tuple(i.decode('utf8') for i in date12) for date12 in f['date'][:]]
+            outDsNames = [i for i in ifgramDatasetNames
+                          if i in f.keys() and f[i].ndim == 3]
+            if any(f[i].maxshape[0] is not None for i in outDsNames):
+                return None
+
+        inPairs = sorted(self.pairsDict.keys())
+        inDsNames = list(self.pairsDict[inPairs[0]].datasetDict.keys())
+        inDsNames = [i for i in ifgramDatasetNames if i in inDsNames]
+        if not set(outPairs).issubset(set(inPairs)) or outDsNames != inDsNames:
+            return None
+        return sorted(set(inPairs) - set(outPairs))
+
+    @staticmethod
+    def reorder_pairs(ds, order):
+        '''Re-order the 1st axis of the opened 3D h5py.Dataset in place, i.e. ds[:] = ds[order],
+        reading and writing rows of chunks with all pairs of up to MAX_BUFFER_BYTE at a time.
+        Parameters: ds    : h5py.Dataset, 3D dataset to re-order
+                    order : 1D np.ndarray of int, new order of the slices in the 1st axis
+        '''
+        num_pair, length, width = ds.shape
+        num_row = ds.chunks[1] if ds.chunks else 1
+        row_byte = num_pair * num_row * width * ds.dtype.itemsize
+        num_row *= int(max(1, MAX_BUFFER_BYTE // row_byte))
+        for y0 in range(0, length, num_row):
+            y1 = min(y0 + num_row, length)
+            ds[:, y0:y1, :] = ds[:, y0:y1, :][order]
+        ds.attrs['MODIFICATION_TIME'] = str(time.time())
+
+    def append2hdf5(self, outputFile='ifgramStack.h5', box=None, num_worker=1):
+        '''Append new pairs into an existing ifgramStack HDF5 file written by write2hdf5().
+        Only the slices of new pairs are read and written: 3D datasets are resized along
+        the 1st axis, and /date, /bperp and /dropIfgram are extended, with the existing
+        /dropIfgram values kept. If any new pair sorts before an existing one, all pairs are
+        then re-ordered in place, so that /date is sorted as in write2hdf5().
+
+        Parameters: outputFile : str, Name of the existing HDF5 file for the InSAR stack
+                    box : tuple, subset range in (x0, y0, x1, y1)
+                    num_worker : int, number of threads to read pairs concurrently
+        Returns:    outputFile
+        Example:    if stackObj.get_new_pairs('ifgramStack.h5'):
+                        stackObj.append2hdf5('ifgramStack.h5', box=box)
+        '''
+        self.outputFile = outputFile
+        self.pairs = self.get_new_pairs(outputFile)
+        if self.pairs is None:
+            raise ValueError('can not append to file: {}, re-write it instead.'.format(outputFile))
+        numNew = len(self.pairs)
+
+        # chunk cache to hold one full row of chunks, for write_pairs()
+        with h5py.File(self.outputFile, 'r') as f:
+            dsNames = [i for i in ifgramDatasetNames if i in f.keys() and f[i].ndim == 3]
+            dsShape = (f['date'].shape[0] + numNew,) + f[dsNames[0]].shape[1:]
+            cache_kwargs = get_chunk_cache_kwargs(dsShape,
+                                                  [f[i].chunks for i in dsNames],
+                                                  [f[i].dtype for i in dsNames])
+
+        f = h5py.File(self.outputFile, 'r+', **cache_kwargs)
+        numOld = f['date'].shape[0]
+        print('append {} new pairs to HDF5 file {} with {} pairs'.format(numNew, self.outputFile, numOld))
+        if numNew == 0:
+            f.close()
+            return self.outputFile
+
+        self.dsNames = [i for i in ifgramDatasetNames if i in f.keys() and f[i].ndim == 3]
+        maxDigit = max([len(i) for i in self.dsNames])
+        self.bperp = np.zeros(numNew)
+        ###############################
+        # 3D datasets: resize and write new slices only
+        for dsName in self.dsNames:
+            ds = f[dsName]
+            ds.resize(numOld + numNew, axis=0)
+            print('append dataset /{d:<{w}} to size of {s}'.format(d=dsName, w=maxDigit, s=ds.shape))
+
+            # same lossy truncation as the existing data
+            mantissa_bits = ds.attrs.get('MANTISSA_BITS', None)
+
+            if mantissa_bits is not None:
+                mantissa_bits = int(mantissa_bits)
+            self.write_pairs(ds, dsName, box=box, num_worker=num_worker,
+                             start_idx=numOld, mantissa_bits=mantissa_bits)
+
+        ###############################
+        # 1D/2D datasets: small, re-create with extended data
+        dsDict = {}
+        dsDict['date'] = np.vstack((f['date'][:], np.array(self.pairs, dtype=np.string_)))
+        dsDict['bperp'] = np.hstack((f['bperp'][:], self.bperp)).astype(dataType)
+        dsDict['dropIfgram'] = np.hstack((f['dropIfgram'][:], np.ones(numNew, dtype=np.bool_)))
+
+        # sort all pairs by (mDate, sDate), as write2hdf5() does
+        order = np.lexsort((dsDict['date'][:, 1], dsDict['date'][:, 0]))
+        if np.any(order != np.arange(numOld + numNew)):
+            for dsName in self.dsNames:
+                print('sort dataset /{d:<{w}} by date12'.format(d=dsName, w=maxDigit))
+                self.reorder_pairs(f[dsName], order)
+            for dsName in dsDict.keys():
+                dsDict[dsName] = dsDict[dsName][order]
+
+        for dsName, data in dsDict.items():
+            print('extend dataset /{d:<{w}} to size of {s}'.format(d=dsName, w=maxDigit, s=data.shape))
+            del f[dsName]
+            f.create_dataset(dsName, data=data)
+
+        f.close()
+        print('Finished appending to {}'.format(self.outputFile))
+        return self.outputFile
+
 
 ########################################################################################
 class ifgramDict:
@@ -551,6 +781,11 @@ def read_isce_bperp_file(fname, out_shape, box=None):
     Example:    fname = '$PROJECT_DIR/merged/baselines/20160418/bperp'
                 data = self.read_sice_bperp_file(fname, (3600,2200), box=(200,400,1000,1000))
     '''
+    try:
+        from skimage.transform import resize
+    except ImportError:
+        raise ImportError('Could not import skimage!')
+
     # read original data
     data_c = readfile.read(fname)[0]
 
@@ -11,9 +11,15 @@
 import os
 import sys
 import time
+from contextlib import contextmanager
 from datetime import datetime as dt
 import h5py
 import numpy as np
+try:
+    # register extra HDF5 compression filters, e.g. LZ4, Zstd, Blosc, Bitshuffle
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
 
 BOOL_ZERO = np.bool_(0)
 INT_ZERO = np.int16(0)
@@ -119,6 +125,146 @@ datasetUnitDict = {'unwrapPhase'        :'radian',
                    }
 
 
+@contextmanager
+def hdf5_reader(obj):
+    """HDF5 file handle for reading, the persistent one if obj is in reader mode, i.e.:
+        with timeseries('timeseries.h5') as obj:
+            ...
+    or a new one closed at exit otherwise.
+    """
+    if getattr(obj, 'f', None):
+        yield obj.f
+    else:
+        with h5py.File(obj.file, 'r') as f:
+            yield f
+
+
+chunkLayoutNames = ['auto', 'image', 'pixel']
+
+
+def get_chunk_shape(shape, layout='auto', dtype=dataType, max_chunk_byte=8e6):
+    """Chunk shape of 2D/3D HDF5 dataset for the given layout.
+    Parameters: shape  : tuple of int, dataset shape in (n, l, w) or (l, w)
+                layout : str or tuple/list of int, chunk layout policy:
+                    auto  - h5py heuristic, i.e. chunks=True
+                    image - image-major,  (1, nrow, w), for fast reading of images, e.g. view.py
+                    pixel - pixel-major / time-contiguous, (n, 64, 64), for fast reading of the
+                            full time column of small boxes, e.g. ifgram_inversion.py, dem_error.py
+                            and tsview.py; 64 is halved (down to 16) if the chunk is too large
+                    (100, 64, 64) or '100,64,64' - explicit chunk shape, 0 for the full axis
+                dtype  : data type, to limit the chunk size in bytes
+                max_chunk_byte : float, max size of one chunk in bytes for image/pixel layout
+    Returns:    chunks : tuple of int, or True for auto
+    Example:    chunks = get_chunk_shape((600, 2000, 1500), layout='pixel')   # (600, 32, 32)
+                chunks = get_chunk_shape((600, 2000, 1500), layout='image')   # (1, 1333, 1500)
+    """
+    shape = tuple(int(i) for i in shape)
+    if isinstance(layout, str) and layout not in chunkLayoutNames:
+        layout = [int(i) for i in layout.replace('x', ',').split(',')]
+    if len(shape) < 2 or layout == 'auto':
+        return True
+
+    itemsize = np.dtype(dtype).itemsize
+    if layout == 'image':
+        num_row = int(max(1, max_chunk_byte // (shape[-1] * itemsize)))
+        chunks = [1] * (len(shape) - 2) + [min(num_row, shape[-2]), shape[-1]]
+
+    elif layout == 'pixel':
+        num_epoch = np.prod(shape[:-2], dtype=np.int64)
+        win = 64
+        while win > 16 and num_epoch * win * win * itemsize > max_chunk_byte:
+            win //= 2
+        chunks = list(shape[:-2]) + [min(win, shape[-2]), min(win, shape[-1])]
+
+    else:
+        if len(layout) != len(shape):
+            raise ValueError('chunk shape {} does not match data shape {}'.format(layout, shape))
+        chunks = [i if 0 < i <= j else j for i, j in zip(layout, shape)]
+    return tuple(max(1, i) for i in chunks)
+
+
+def get_chunk_row_size(shape, chunks, dtype=dataType):
+    """Size in bytes of one full row of chunks of 2D/3D HDF5 dataset, i.e. all chunks covering
+    the first chunks[-2] rows, to size the chunk cache (rdcc_nbytes) for row-block writing.
+    Parameters: shape  : tuple of int, dataset shape in (n, l, w) or (l, w)
+                chunks : tuple of int, chunk shape, or True/None for auto / contiguous
+    Returns:    num_byte : int, 0 for auto / contiguous
+    Example:    num_byte = get_chunk_row_size((600, 2000, 1500), (600, 32, 32))   # 115M
+    """
+    if not isinstance(chunks, (tuple, list)) or len(chunks) != len(shape):
+        return 0
+    num_chunk = np.prod([int(np.ceil(i / j)) for i, j in zip(shape[:-2], chunks[:-2])], dtype=np.int64)
+    num_chunk *= int(np.ceil(shape[-1] / chunks[-1]))
+    return int(num_chunk * np.prod(chunks, dtype=np.int64) * np.dtype(dtype).itemsize)
+
+
+compressionNames = [None, 'lzf', 'gzip', 'lz4', 'zstd']
+
+
+def get_dataset_compression(compression=None, dsName=None, dtype=dataType):
+    """Compression codec and h5py.create_dataset() keyword arguments for the given dataset.
+    Parameters: compression : str, compression policy, as one of:
+                    None/lzf/gzip - h5py built-in codecs
+                    lz4/zstd      - fast codecs through hdf5plugin (Blosc), with byte-shuffle for
+                                    numbers and bit-shuffle (bitpacking) for bool, e.g. connectComponent;
+                                    fall back to lzf with shuffle if hdf5plugin is not installed.
+                    comma separated list of [dsName:]codec for per-dataset policy, with the codec
+                    without dsName as the default, e.g. 'lz4,coherence:zstd,connectComponent:gzip'
+                dsName : str, dataset name
+                dtype  : data type
+    Returns:    codec  : str, codec used for the dataset, to be recorded in metadata
+                kwargs : dict, keyword arguments for h5py.create_dataset()
+    Example:    codec, kwargs = get_dataset_compression('lz4', 'coherence')
+                ds = f.create_dataset('coherence', shape, dtype, chunks=True, **kwargs)
+                ds.attrs['COMPRESSION'] = str(codec)
+    """
+    # per-dataset policy
+    codec = compression
+    if compression and (',' in compression or ':' in compression):
+        policy = {}
+        for item in compression.split(','):
+            key, value = item.split(':') if ':' in item else (None, item)
+            policy[key] = value
+        codec = policy.get(dsName, policy.get(None, None))
+    if str(codec).lower() in ['none', 'no', 'false']:
+        codec = None
+
+    kwargs = {}
+    if codec is None:
+        return codec, kwargs
+    codec = codec.lower()
+    if codec not in compressionNames:
+        raise ValueError('un-supported compression: {}, use one of {}'.format(codec, compressionNames))
+
+    is_bool = np.dtype(dtype) == np.bool_
+    if codec in ['lz4', 'zstd'] and hdf5plugin is None:
+        print('WARNING: hdf5plugin is not installed, use lzf with shuffle instead of {}.'.format(codec))
+        codec = 'lzf'
+        kwargs['shuffle'] = not is_bool
+
+    if codec in ['lzf', 'gzip']:
+        kwargs['compression'] = codec
+    else:
+        shuffle = hdf5plugin.Blosc.BITSHUFFLE if is_bool else hdf5plugin.Blosc.SHUFFLE
+        kwargs.update(hdf5plugin.Blosc(cname=codec, clevel=5, shuffle=shuffle))
+    return codec, kwargs
+
+
+def truncate_float_mantissa(data, num_bit=10):
+    """Keep the leading num_bit bits of the float32 mantissa (lossy), to improve compression.
+    The relative error is less than 2^-num_bit, e.g. ~1e-3 for 10 bits, enough for coherence.
+    Parameters: data    : np.ndarray in float32
+                num_bit : int, number of mantissa bits to keep, in [1, 23]
+                          with 0 bit, NaN (all-ones exponent with non-zero mantissa) would turn into inf
+    Returns:    data    : np.ndarray in float32
+    """
+    num_bit = int(num_bit)
+    if not 1 <= num_bit <= 23:
+        raise ValueError('number of mantissa bits to keep should be in [1, 23], input: {}'.format(num_bit))
+    mask = np.uint32((0xFFFFFFFF << (23 - num_bit)) & 0xFFFFFFFF)
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    return (data.view(np.uint32) & mask).view(np.float32)
+
 
 ################################ timeseries class begin ################################
 FILE_STRUCTURE_TIMESERIES = """
@@ -139,10 +285,26 @@ class timeseries:
         self.file = file
         self.name = 'timeseries'
         self.file_structure = FILE_STRUCTURE_TIMESERIES
+        self.f = None
+
+    def __enter__(self):
+        """Reader mode: keep one HDF5 file handle open with metadata, date list and datetimes cached,
+        so that repeated read() calls cost only the I/O itself.
+        Example:    with timeseries('timeseries.h5') as obj:
+                        for box in box_list:
+                            data = obj.read(box=box, print_msg=False)
+        """
+        self.f = h5py.File(self.file, 'r')
+        self.open(print_msg=False)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(print_msg=False)
 
     def close(self, print_msg=True):
         try:
             self.f.close()
+            self.f = None
             if print_msg:
                 print('close timeseries file: {}'.format(os.path.basename(self.file)))
         except:
@@ -156,7 +318,7 @@ class timeseries:
         self.get_date_list()
         self.numPixel = self.length * self.width
 
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             try:
                 self.pbase = f['bperp'][:]
                 self.pbase -= self.pbase[self.refIndex]
@@ -170,7 +332,7 @@ class timeseries:
         self.sliceList = ['{}-{}'.format(self.name, i) for i in self.dateList]
 
     def get_metadata(self):
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             self.metadata = dict(f.attrs)
             dates = f['date'][:]
         for key, value in self.metadata.items():
@@ -189,12 +351,12 @@ class timeseries:
         return self.metadata
 
     def get_size(self):
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             self.numDate, self.length, self.width = f[self.name].shape
         return self.numDate, self.length, self.width
 
     def get_date_list(self):
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             self.dateList = [i.decode('utf8') for i in f['date'][:]]
         return self.dateList
 
@@ -213,7 +375,9 @@ class timeseries:
         """
         if print_msg:
             print('reading {} data from file: {} ...'.format(self.name, self.file))
-        self.open(print_msg=False)
+        # metadata is cached in reader mode
+        if not self.f:
+            self.open(print_msg=False)
 
         # convert input datasetName into list of dates
         if not datasetName or datasetName == 'timeseries':
@@ -222,7 +386,7 @@ class timeseries:
             datasetName = [datasetName]
         datasetName = [i.replace('timeseries', '').replace('-', '') for i in datasetName]
 
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             ds = f[self.name]
             if isinstance(ds, h5py.Group):  # support for old pysar files
                 ds = ds[self.name]
@@ -243,7 +407,8 @@ class timeseries:
             data = np.squeeze(data)
         return data
 
-    def write2hdf5(self, data, outFile=None, dates=None, bperp=None, metadata=None, refFile=None, compression=None):
+    def write2hdf5(self, data, outFile=None, dates=None, bperp=None, metadata=None, refFile=None, compression=None,
+                   chunk_layout='auto'):
         """
         Parameters: data  : 3D array of float32
                     dates : 1D array/list of string in YYYYMMDD format
@@ -251,7 +416,8 @@ class timeseries:
                     metadata : dict
                     outFile : string
                     refFile : string
-                    compression : string or None
+                    compression : string or None, compression policy, check get_dataset_compression()
+                    chunk_layout : str or tuple of int, chunk layout of /timeseries, check get_chunk_shape()
         Returns: outFile : string
         Examples:
             from pysar.objects import timeseries
@@ -285,11 +451,16 @@ class timeseries:
         # 3D dataset - timeseries
         print('create timeseries HDF5 file: {} with w mode'.format(outFile))
         f = h5py.File(outFile, 'w')
+        chunks = get_chunk_shape(data.shape, layout=chunk_layout, dtype=data.dtype)
+        codec, comp_kwargs = get_dataset_compression(compression, 'timeseries', data.dtype)
         print(('create dataset /timeseries of {t:<10} in size of {s} '
-               'with compression={c}').format(t=str(data.dtype),
-                                              s=data.shape,
-                                              c=compression))
-        f.create_dataset('timeseries', data=data, chunks=True, compression=compression)
+               'with compression={c} and chunks={k}').format(t=str(data.dtype),
+                                                             s=data.shape,
+                                                             c=codec,
+                                                             k=chunks))
+        ds = f.create_dataset('timeseries', data=data, chunks=chunks, **comp_kwargs)
+        if codec:
+            ds.attrs['COMPRESSION'] = codec
 
         # 1D dataset - date / bperp
         print('create dataset /dates      of {:<10} in size of {}'.format(str(dates.dtype), dates.shape))
@@ -564,10 +735,26 @@ class ifgramStack:
         self.file = file
         self.name = 'ifgramStack'
         self.file_structure = FILE_STRUCTURE_IFGRAM_STACK
+        self.f = None
+
+    def __enter__(self):
+        """Reader mode: keep one HDF5 file handle open with metadata, date12 list and datetimes cached,
+        so that repeated read() calls cost only the I/O itself.
+        Example:    with ifgramStack('./INPUTS/ifgramStack.h5') as obj:
+                        for box in box_list:
+                            data = obj.read(datasetName='unwrapPhase', box=box, print_msg=False)
+        """
+        self.f = h5py.File(self.file, 'r')
+        self.open(print_msg=False)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(print_msg=False)
 
     def close(self, print_msg=True):
         try:
             self.f.close()
+            self.f = None
             if print_msg:
                 print('close {} file: {}'.format(self.name, os.path.basename(self.file)))
         except:
@@ -590,7 +777,7 @@ class ifgramStack:
         self.date12List = ['{}_{}'.format(i, j) for i, j in zip(self.mDates, self.sDates)]
         self.tbaseIfgram = np.array([i.days for i in self.sTimes - self.mTimes], dtype=np.float32)
 
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             self.dropIfgram = f['dropIfgram'][:]
             self.pbaseIfgram = f['bperp'][:]
 
@@ -625,7 +812,7 @@ class ifgramStack:
             self.refLon = None
 
     def get_metadata(self):
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             self.metadata = dict(f.attrs)
             dates = f['date'][:].flatten()
         for key, value in self.metadata.items():
@@ -639,7 +826,7 @@ class ifgramStack:
         return self.metadata
 
     def get_size(self, dropIfgram=False, datasetName='unwrapPhase'):
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             self.numIfgram, self.length, self.width = f[datasetName].shape
             if dropIfgram:
                 self.numIfgram = np.sum(f['dropIfgram'][:])
@@ -647,7 +834,7 @@ class ifgramStack:
 
     def read_datetimes(self):
         """Read master/slave dates into array of datetime.datetime objects"""
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             dates = f['date'][:]
         self.mDates = np.array([i.decode('utf8') for i in dates[:, 0]])
         self.sDates = np.array([i.decode('utf8') for i in dates[:, 1]])
@@ -679,8 +866,13 @@ class ifgramStack:
             obj.read(datasetName=['unwrapPhase-20161020_20161026',
                                   'unwrapPhase-20161020_20161101'])
         """
-        self.get_size(dropIfgram=False)
-        date12List = self.get_date12_list(dropIfgram=False)
+        # size and date12 list are cached in reader mode
+        if self.f:
+            date12List = self.date12List
+            numIfgram = len(date12List)
+        else:
+            numIfgram = self.get_size(dropIfgram=False)[0]
+            date12List = self.get_date12_list(dropIfgram=False)
 
         # convert input datasetName into list
         if datasetName is None:
@@ -688,18 +880,18 @@ class ifgramStack:
         elif isinstance(datasetName, str):
             datasetName = [datasetName]
 
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             familyName = datasetName[0].split('-')[0]
             ds = f[familyName]
             if print_msg:
                 print('reading {} data from file: {} ...'.format(familyName, self.file))
 
             # get dateFlag - mark in time/1st dimension
-            dateFlag = np.zeros((self.numIfgram), dtype=np.bool_)
+            dateFlag = np.zeros((numIfgram), dtype=np.bool_)
             datasetName = [i.replace(familyName, '').replace('-', '') for i in datasetName]
             if any(not i for i in datasetName):
                 if dropIfgram:
-                    dateFlag = f['dropIfgram'][:]
+                    dateFlag = self.dropIfgram if self.f else f['dropIfgram'][:]
                 else:
                     dateFlag[:] = True
             else:
@@ -724,7 +916,7 @@ class ifgramStack:
         else:
             maskFile = None
 
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             dset = f[datasetName]
             numIfgram = dset.shape[0]
             dmean = np.zeros((numIfgram), dtype=np.float32)
@@ -740,7 +932,7 @@ class ifgramStack:
 
     # Functions considering dropIfgram value
     def get_date12_list(self, dropIfgram=True):
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             dates = f['date'][:]
             if dropIfgram:
                 dates = dates[f['dropIfgram'][:], :]
@@ -750,7 +942,7 @@ class ifgramStack:
         return date12List
 
     def get_drop_date12_list(self):
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             dates = f['date'][:]
             dates = dates[~f['dropIfgram'][:], :]
         mDates = np.array([i.decode('utf8') for i in dates[:, 0]])
@@ -759,7 +951,7 @@ class ifgramStack:
         return date12List
 
     def get_date_list(self, dropIfgram=False):
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             dates = f['date'][:]
             if dropIfgram:
                 dates = dates[f['dropIfgram'][:], :]
@@ -794,7 +986,7 @@ class ifgramStack:
            Ignoring dropped ifgrams
         """
         self.open(print_msg=False)
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             if datasetName is None:
                 datasetName = [i for i in ['connectComponent', 'unwrapPhase']
                                if i in f.keys()][0]
@@ -825,7 +1017,7 @@ class ifgramStack:
             phase2range = -1 * float(self.metadata['WAVELENGTH']) / (4.0 * np.pi)
             tbaseIfgram = self.tbaseIfgram / 365.25
 
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             dset = f[datasetName]
             num_ifgram, length, width = dset.shape
             dmean = np.zeros((length, width), dtype=np.float32)
@@ -971,7 +1163,7 @@ class ifgramStack:
         tbase_diff = np.diff(tbase).flatten()
 
         # read pbase of interferograms
-        with h5py.File(self.file, 'r') as f:
+        with hdf5_reader(self) as f:
             pbaseIfgram = f['bperp'][:]
             if dropIfgram:
                 pbaseIfgram = pbaseIfgram[f['dropIfgram'][:]]
@@ -1018,7 +1210,7 @@ class singleDataset:
 
     def read(self, box=None):
         self.f = h5py.File(self.file, 'r')
-        k = list(self.f.keys())[0]
+        k = [i for i in self.f.keys() if isinstance(self.f[i], h5py.Dataset)][0]
         data = self.f[k][:]
         if box is not None:
             data = data[box[1]:box[3], box[0]:box[2]]
@@ -11,14 +11,20 @@
 import os
 import re
 import time
+import json
+import hashlib
 import datetime
 import shutil
+import filecmp
 import argparse
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import h5py
 import numpy as np
 
 import pysar
-import pysar.workflow  #dynamic import for modules used by pysarApp workflow
+import pysar.workflow  #lazy import for modules used by pysarApp workflow
 from pysar.objects import sensor, RAMP_LIST
 from pysar.utils import readfile, writefile, utils as ut
 from pysar.defaults.auto_path import autoPath
@@ -44,6 +50,73 @@ STEP_LIST = [
     'hdfeos5',
 ]
 
+# dependency graph of steps, with:
+#   func   : method of TimeSeriesAnalysis to run the step
+#   depend : steps to be finished before this step
+#   config : template options (key or key group) affecting the result of this step,
+#            input/output files are in TimeSeriesAnalysis.get_step_io()
+#   plot   : matplotlib is used, which is not thread-safe, thus run one at a time
+# steps with all dependencies finished run concurrently, e.g. stack_interferograms with
+# invert_network, and google_earth with hdfeos5.
+STEP_GRAPH = {
+    'load_data'            : {'func'   : 'run_load_data',
+                              'depend' : [],
+                              'config' : ['pysar.load', 'pysar.subset']},
+    'modify_network'       : {'func'   : 'run_network_modification',
+                              'depend' : ['load_data'],
+                              'config' : ['pysar.network'],
+                              'plot'   : True},
+    'reference_point'      : {'func'   : 'run_reference_point',
+                              'depend' : ['modify_network'],
+                              'config' : ['pysar.reference.yx', 'pysar.reference.lalo',
+                                          'pysar.reference.maskFile', 'pysar.reference.coherenceFile',
+                                          'pysar.reference.minCoherence']},
+    'correct_unwrap_error' : {'func'   : 'run_unwrap_error_correction',
+                              'depend' : ['reference_point'],
+                              'config' : ['pysar.unwrapError']},
+    'stack_interferograms' : {'func'   : 'run_ifgram_stacking',
+                              'depend' : ['correct_unwrap_error'],
+                              'config' : []},
+    'invert_network'       : {'func'   : 'run_network_inversion',
+                              'depend' : ['correct_unwrap_error'],
+                              'config' : ['pysar.networkInversion']},
+    'correct_LOD'          : {'func'   : 'run_local_oscillator_drift_correction',
+                              'depend' : ['invert_network'],
+                              'config' : []},
+    'correct_troposphere'  : {'func'   : 'run_tropospheric_delay_correction',
+                              'depend' : ['correct_LOD'],
+                              'config' : ['pysar.troposphericDelay']},
+    'deramp'               : {'func'   : 'run_phase_deramping',
+                              'depend' : ['correct_troposphere'],
+                              'config' : ['pysar.deramp']},
+    'correct_topography'   : {'func'   : 'run_topographic_residual_correction',
+                              'depend' : ['deramp'],
+                              'config' : ['pysar.topographicResidual']},
+    'residual_RMS'         : {'func'   : 'run_residual_phase_rms',
+                              'depend' : ['correct_topography'],
+                              'config' : ['pysar.residualRms'],
+                              'plot'   : True},
+    'reference_date'       : {'func'   : 'run_reference_date',
+                              'depend' : ['residual_RMS'],
+                              'config' : ['pysar.reference.date']},
+    'velocity'             : {'func'   : 'run_timeseries2velocity',
+                              'depend' : ['reference_date'],
+                              'config' : ['pysar.velocity', 'pysar.troposphericDelay.weatherModel']},
+    'geocode'              : {'func'   : 'run_geocode',
+                              'depend' : ['velocity'],
+                              'config' : ['pysar.geocode', 'pysar.networkInversion.minTempCoh']},
+    'google_earth'         : {'func'   : 'run_save2google_earth',
+                              'depend' : ['geocode'],
+                              'config' : ['pysar.save.kmz'],
+                              'plot'   : True},
+    'hdfeos5'              : {'func'   : 'run_save2hdfeos5',
+                              'depend' : ['geocode'],
+                              'config' : ['pysar.save.hdfEos5']},
+}
+
+# file to save the content hash of steps and files in the work directory
+STEP_HASH_FILE = 'pysarApp_hash.json'
+
 STEP_HELP = """Command line options for steps processing with names are chosen from the following list:
 
 {}
@@ -53,7 +126,11 @@ STEP_HELP = """Command line options for steps processing with names are chosen f
 In order to use either --start or --dostep, it is necessary that a
 previous run was done using one of the steps options to process at least
 through the step immediately preceding the starting step of the current run.
-""".format(STEP_LIST[0:5], STEP_LIST[5:10], STEP_LIST[10:])
+
+Steps with all dependencies finished run concurrently with pysar.workflow.numWorker > 1,
+and are skipped if the content hash of their input files and template options is the same
+as the last run with pysar.workflow.updateMode = yes (saved in {}).
+""".format(STEP_LIST[0:5], STEP_LIST[5:10], STEP_LIST[10:], STEP_HASH_FILE)
 
 EXAMPLE = """example:
   pysarApp.py                         #run with default template 'pysarApp_template.txt'
@@ -410,17 +487,17 @@ class TimeSeriesAnalysis:
         # 2) plot network
         scp_args = '{} -t {} --nodisplay'.format(stack_file, self.templateFile)
         print('\nplot_network.py', scp_args)
-        if ut.run_or_skip(out_file=net_fig,
-                          in_file=[stack_file, coh_txt, self.templateFile],
-                          check_readable=False) == 'run':
+        if self.run_or_skip(step_name, out_file=net_fig,
+                            in_file=[stack_file, coh_txt, self.templateFile],
+                            check_readable=False) == 'run':
             pysar.plot_network.main(scp_args.split())
 
         # 3) aux files: maskConnComp and avgSpatialCoh
-        self.generate_ifgram_aux_file()
+        self.generate_ifgram_aux_file(step_name)
         return
 
 
-    def generate_ifgram_aux_file(self):
+    def generate_ifgram_aux_file(self, step_name):
         """Generate auxiliary files from ifgramStack file, including:
         
         """
@@ -429,12 +506,12 @@ class TimeSeriesAnalysis:
         coh_file = 'avgSpatialCoh.h5'
 
         # 1) generate mask file from the common connected components
-        scp_args = '{} --nonzero -o {} --update'.format(stack_file, cc_mask_file)
+        scp_args = '{} --nonzero -o {} {}'.format(stack_file, cc_mask_file, self.update_option(step_name))
         print('\ngenerate_mask.py', scp_args)
         pysar.generate_mask.main(scp_args.split())
 
         # 2) generate average spatial coherence
-        scp_args = '{} --dataset coherence -o {} --update'.format(stack_file, coh_file)
+        scp_args = '{} --dataset coherence -o {} {}'.format(stack_file, coh_file, self.update_option(step_name))
         print('\ntemporal_average.py', scp_args)
         pysar.temporal_average.main(scp_args.split())
         return
@@ -465,8 +542,9 @@ class TimeSeriesAnalysis:
         stack_file = ut.check_loaded_dataset(self.workDir, print_msg=False)[1]
         mask_file = 'maskConnComp.h5'
 
-        scp_args_bridge = '{} -t {} --update'.format(stack_file, self.templateFile)
-        scp_args_closure = '{} {} -t {} --update'.format(stack_file, mask_file, self.templateFile)
+        update_opt = self.update_option(step_name)
+        scp_args_bridge = '{} -t {} {}'.format(stack_file, self.templateFile, update_opt)
+        scp_args_closure = '{} {} -t {} {}'.format(stack_file, mask_file, self.templateFile, update_opt)
 
         from pysar import unwrap_error_bridging, unwrap_error_phase_closure
         if method == 'bridging':
@@ -488,7 +566,8 @@ class TimeSeriesAnalysis:
         # check the existence of ifgramStack.h5
         stack_file = ut.check_loaded_dataset(self.workDir, print_msg=False)[1]
         pha_vel_file = 'avgPhaseVelocity.h5'
-        scp_args = '{} --dataset unwrapPhase -o {} --update'.format(stack_file, pha_vel_file)
+        scp_args = '{} --dataset unwrapPhase -o {} {}'.format(stack_file, pha_vel_file,
+                                                           self.update_option(step_name))
         print('temporal_average.py', scp_args)
         pysar.temporal_average.main(scp_args.split())
         return
@@ -503,16 +582,16 @@ class TimeSeriesAnalysis:
         stack_file = ut.check_loaded_dataset(self.workDir, print_msg=False)[1]
 
         # 1) invert ifgramStack for time-series
-        scp_args = '{} -t {} --update '.format(stack_file, self.templateFile)
+        scp_args = '{} -t {} {} '.format(stack_file, self.templateFile, self.update_option(step_name))
         print('ifgram_inversion.py', scp_args)
         pysar.ifgram_inversion.main(scp_args.split())
 
         # 2) get reliable pixel mask: maskTempCoh.h5
-        self.generate_temporal_coherence_mask()
+        self.generate_temporal_coherence_mask(step_name)
         return
 
 
-    def generate_temporal_coherence_mask(self):
+    def generate_temporal_coherence_mask(self, step_name):
         """Generate reliable pixel mask from temporal coherence"""
         geom_file = ut.check_loaded_dataset(self.workDir, print_msg=False)[2]
         tcoh_file = 'temporalCoherence.h5'
@@ -528,7 +607,7 @@ class TimeSeriesAnalysis:
         config_keys = ['pysar.networkInversion.minTempCoh']
         print('update mode: ON')
         flag = 'skip'
-        if ut.run_or_skip(out_file=mask_file, in_file=tcoh_file, print_msg=False) == 'run':
+        if self.run_or_skip(step_name, out_file=mask_file, in_file=tcoh_file, print_msg=False) == 'run':
             flag = 'run'
         else:
             print('1) output file: {} already exists and newer than input file: {}'.format(mask_file, tcoh_file))
@@ -638,6 +717,128 @@ class TimeSeriesAnalysis:
         return steps
 
 
+    def get_step_io(self, step_name):
+        """Get input/output files of each step, for the content hash based run/skip check.
+        ifgramStack.h5 is updated in place by multiple steps, thus only the datasets / attributes
+        read / written by the step are listed, instead of the whole file.
+        Input files from template options, e.g. pysar.network.maskFile, are added in get_step_hash().
+
+        Parameters: step_name : str, step name
+        Returns:    in_files  : dict of {str : list of str}, input  file and its dataset/attribute names,
+                                None for the whole file; or None if inputs are unknown, i.e. always run
+                    out_files : dict of {str : list of str}, output file and its dataset/attribute names
+        """
+        # raw input files of load_data are handled by its own update mode
+        if step_name == 'load_data':
+            return None, {}
+
+        in_files, out_files = {}, {}
+        stack_file, geom_file, lookup_file = ut.check_loaded_dataset(self.workDir, print_msg=False)[1:4]
+        unw_dset_list = [i for i in readfile.get_dataset_list(stack_file) if i.startswith('unwrapPhase')]
+
+        if step_name == 'modify_network':
+            in_files[stack_file] = ['date', 'bperp', 'coherence', 'connectComponent']
+            out_files[stack_file] = ['dropIfgram']
+            out_files['maskConnComp.h5'] = None
+            out_files['avgSpatialCoh.h5'] = None
+
+        elif step_name == 'reference_point':
+            in_files[stack_file] = ['unwrapPhase', 'dropIfgram']
+            in_files['maskConnComp.h5'] = None
+            in_files['avgSpatialCoh.h5'] = None
+            out_files[stack_file] = ['REF_Y', 'REF_X']
+
+        elif step_name == 'correct_unwrap_error':
+            method = self.template['pysar.unwrapError.method']
+            if method:
+                in_files[stack_file] = ['unwrapPhase', 'coherence', 'connectComponent', 'dropIfgram',
+                                        'REF_Y', 'REF_X']
+                in_files['maskConnComp.h5'] = None
+                out_files[stack_file] = {'bridging'               : ['unwrapPhase_bridging'],
+                                         'phase_closure'          : ['unwrapPhase_phaseClosure'],
+                                         'bridging+phase_closure' : ['unwrapPhase_bridging',
+                                                                     'unwrapPhase_bridging_phaseClosure'],
+                                        }.get(method, None)
+
+        elif step_name == 'stack_interferograms':
+            in_files[stack_file] = ['unwrapPhase', 'dropIfgram']
+            out_files['avgPhaseVelocity.h5'] = None
+
+        elif step_name == 'invert_network':
+            in_files[stack_file] = ['date', 'bperp', 'coherence', 'connectComponent', 'dropIfgram',
+                                    'REF_Y', 'REF_X'] + unw_dset_list
+            in_files[geom_file] = None
+            for fname in ['timeseries.h5', 'temporalCoherence.h5', 'numInvIfgram.h5', 'maskTempCoh.h5']:
+                out_files[fname] = None
+
+        elif step_name in ['correct_LOD', 'correct_troposphere', 'deramp', 'correct_topography']:
+            fnames = self.get_timeseries_filename(self.template)[step_name]
+            if fnames['input'] != fnames['output']:
+                in_files[fnames['input']] = None
+                in_files[geom_file] = None
+                out_files[fnames['output']] = None
+                if step_name == 'correct_troposphere':
+                    in_files['maskTempCoh.h5'] = None
+                    tropo_file = './INPUTS/{}.h5'.format(self.template['pysar.troposphericDelay.weatherModel'])
+                    if os.path.isfile(tropo_file):
+                        in_files[tropo_file] = None
+
+        elif step_name == 'residual_RMS':
+            if os.path.isfile('timeseriesResidual.h5'):
+                in_files['timeseriesResidual.h5'] = None
+                out_files['reference_date.txt'] = None
+
+        elif step_name == 'reference_date':
+            if self.template['pysar.reference.date']:
+                for fname in self.get_timeseries_filename(self.template)[step_name]['input']:
+                    in_files[fname] = None
+                    out_files[fname] = None
+
+        elif step_name == 'velocity':
+            ts_file = self.get_timeseries_filename(self.template)[step_name]['input']
+            in_files[ts_file] = None
+            tropo_file = './INPUTS/{}.h5'.format(self.template['pysar.troposphericDelay.weatherModel'])
+            if os.path.isfile(tropo_file):
+                in_files[tropo_file] = None
+            out_files['velocity.h5'] = None
+
+        elif step_name == 'geocode':
+            ts_file = self.get_timeseries_filename(self.template)[step_name]['input']
+            if self.template['pysar.geocode'] and 'Y_FIRST' not in readfile.read_attribute(ts_file).keys():
+                for fname in [geom_file, 'temporalCoherence.h5', ts_file, 'velocity.h5']:
+                    in_files[fname] = None
+                    out_files['./GEOCODE/geo_{}'.format(os.path.basename(fname))] = None
+                in_files[lookup_file] = None
+                out_files['./GEOCODE/geo_maskTempCoh.h5'] = None
+
+        elif step_name == 'google_earth':
+            if self.template['pysar.save.kmz'] is True:
+                vel_file = 'velocity.h5'
+                if 'Y_FIRST' not in readfile.read_attribute(vel_file).keys():
+                    vel_file = './GEOCODE/geo_velocity.h5'
+                in_files[vel_file] = None
+                # plot_result() moves KMZ file into PIC folder
+                fbase = '{}.kmz'.format(os.path.splitext(os.path.basename(vel_file))[0])
+                kmz_files = [i for i in [fbase, './GEOCODE/{}'.format(fbase), './PIC/{}'.format(fbase)]
+                             if os.path.isfile(i)]
+                out_files[kmz_files[0] if kmz_files else fbase] = None
+
+        elif step_name == 'hdfeos5':
+            if self.template['pysar.save.hdfEos5'] is True:
+                ts_file = self.get_timeseries_filename(self.template)[step_name]['input']
+                in_files[ts_file] = None
+                if 'GEOCODE' in ts_file:
+                    in_files['./GEOCODE/geo_temporalCoherence.h5'] = None
+                    in_files['./GEOCODE/geo_maskTempCoh.h5'] = None
+                    in_files['./GEOCODE/geo_{}'.format(os.path.basename(geom_file))] = None
+                else:
+                    in_files['temporalCoherence.h5'] = None
+                    in_files[geom_file] = None
+                SAT = sensor.get_unavco_mission_name(readfile.read_attribute(ts_file))
+                out_files['{}_*.he5'.format(SAT)] = None
+        return in_files, out_files
+
+
     def run_local_oscillator_drift_correction(self, step_name):
         """Correct local oscillator drift (LOD).
         Automatically applied for Envisat data.
@@ -650,7 +851,7 @@ class TimeSeriesAnalysis:
         if in_file != out_file:
             scp_args = '{} {} -o {}'.format(in_file, geom_file, out_file)
             print('local_oscilator_drift.py', scp_args)
-            if ut.run_or_skip(out_file=out_file, in_file=in_file) == 'run':
+            if self.run_or_skip(step_name, out_file=out_file, in_file=in_file) == 'run':
                 pysar.local_oscilator_drift.main(scp_args.split())
         else:
             atr = readfile.read_attribute(in_file)
@@ -691,7 +892,7 @@ class TimeSeriesAnalysis:
                                                                                   t=tropo_min_cor)
                 print('tropospheric delay correction with height-correlation approach')
                 print('tropo_phase_elevation.py', scp_args)
-                if ut.run_or_skip(out_file=out_file, in_file=in_file) == 'run':
+                if self.run_or_skip(step_name, out_file=out_file, in_file=in_file) == 'run':
                     pysar.tropo_phase_elevation.main(scp_args.split())
 
             # Weather Re-analysis Data (Jolivet et al., 2011;2014)
@@ -703,7 +904,7 @@ class TimeSeriesAnalysis:
                 print('Atmospheric correction using Weather Re-analysis dataset (PyAPS, Jolivet et al., 2011)')
                 print('Weather Re-analysis dataset:', tropo_model)
                 tropo_file = './INPUTS/{}.h5'.format(tropo_model)
-                if ut.run_or_skip(out_file=out_file, in_file=[in_file, tropo_file]) == 'run':
+                if self.run_or_skip(step_name, out_file=out_file, in_file=[in_file, tropo_file]) == 'run':
                     if os.path.isfile(tropo_file) and get_dataset_size(tropo_file) == get_dataset_size(in_file):
                         scp_args = '{f} {t} -o {o} --force'.format(f=in_file, t=tropo_file, o=out_file)
                         print('--------------------------------------------')
@@ -737,7 +938,8 @@ class TimeSeriesAnalysis:
         out_file = fnames['output']
         if in_file != out_file:
             print('Remove for each acquisition a phase ramp: {}'.format(method))
-            scp_args = '{f} -s {s} -m {m} -o {o} --update '.format(f=in_file, s=method, m=mask_file, o=out_file)
+            scp_args = '{f} -s {s} -m {m} -o {o} {u} '.format(f=in_file, s=method, m=mask_file, o=out_file,
+                                                           u=self.update_option(step_name))
             print('remove_ramp.py', scp_args)
             pysar.remove_ramp.main(scp_args.split())
         else:
@@ -754,10 +956,11 @@ class TimeSeriesAnalysis:
         in_file = fnames['input']
         out_file = fnames['output']
         if in_file != out_file:
-            scp_args = '{f} -g {g} -t {t} -o {o} --update '.format(f=in_file,
-                                                                   g=geom_file,
-                                                                   t=self.templateFile,
-                                                                   o=out_file)
+            scp_args = '{f} -g {g} -t {t} -o {o} {u} '.format(f=in_file,
+                                                              g=geom_file,
+                                                              t=self.templateFile,
+                                                              o=out_file,
+                                                              u=self.update_option(step_name))
             print('dem_error.py', scp_args)
             pysar.dem_error.main(scp_args.split())
         else:
@@ -795,9 +998,10 @@ class TimeSeriesAnalysis:
         """Estimate average velocity from displacement time-series"""
         ts_file = self.get_timeseries_filename(self.template)[step_name]['input']
         vel_file = 'velocity.h5'
-        scp_args = '{f} -t {t} -o {o} --update'.format(f=ts_file,
-                                                       t=self.templateFile,
-                                                       o=vel_file)
+        scp_args = '{f} -t {t} -o {o} {u}'.format(f=ts_file,
+                                                  t=self.templateFile,
+                                                  o=vel_file,
+                                                  u=self.update_option(step_name))
         print('timeseries2velocity.py', scp_args)
         pysar.timeseries2velocity.main(scp_args.split())
 
@@ -807,9 +1011,10 @@ class TimeSeriesAnalysis:
         if os.path.isfile(tropo_file):
             suffix = os.path.splitext(os.path.basename(tropo_file))[0]  #.title()
             tropo_vel_file = '{}{}.h5'.format(os.path.splitext(vel_file)[0], suffix)
-            scp_args= '{f} -t {t} -o {o} --update'.format(f=tropo_file,
-                                                          t=self.templateFile,
-                                                          o=tropo_vel_file)
+            scp_args= '{f} -t {t} -o {o} {u}'.format(f=tropo_file,
+                                                     t=self.templateFile,
+                                                     o=tropo_vel_file,
+                                                     u=self.update_option(step_name))
             print('timeseries2velocity.py', scp_args)
             pysar.timeseries2velocity.main(scp_args.split())
         return
@@ -829,9 +1034,10 @@ class TimeSeriesAnalysis:
 
                 geom_file, lookup_file = ut.check_loaded_dataset(self.workDir, print_msg=False)[2:4]
                 in_files = [geom_file, 'temporalCoherence.h5', ts_file, 'velocity.h5']
-                scp_args = '-l {l} -t {t} --outdir {o} --update '.format(l=lookup_file,
-                                                                         t=self.templateFile,
-                                                                         o=out_dir)
+                scp_args = '-l {l} -t {t} --outdir {o} {u} '.format(l=lookup_file,
+                                                                    t=self.templateFile,
+                                                                    o=out_dir,
+                                                                    u=self.update_option(step_name))
                 for in_file in in_files:
                     scp_args += ' {}'.format(in_file)
                 print('geocode.py', scp_args)
@@ -844,7 +1050,7 @@ class TimeSeriesAnalysis:
                 tcoh_min = self.template['pysar.networkInversion.minTempCoh']
                 scp_args = '{} -m {} -o {} --shadow {}'.format(tcoh_file, tcoh_min, mask_file, geom_file)
                 print('generate_mask.py', scp_args)
-                if ut.run_or_skip(out_file=mask_file, in_file=tcoh_file) == 'run':
+                if self.run_or_skip(step_name, out_file=mask_file, in_file=tcoh_file) == 'run':
                     pysar.generate_mask.main(scp_args.split())
         else:
             print('geocoding is OFF')
@@ -873,7 +1079,7 @@ class TimeSeriesAnalysis:
                             if os.path.isfile(i)][0]
             except:
                 kmz_file = None
-            if ut.run_or_skip(out_file=kmz_file, in_file=vel_file, check_readable=False) == 'run':
+            if self.run_or_skip(step_name, out_file=kmz_file, in_file=vel_file, check_readable=False) == 'run':
                 pysar.save_kmz.main(scp_args.split())
         else:
             print('save velocity to Google Earth format is OFF.')
@@ -913,7 +1119,7 @@ class TimeSeriesAnalysis:
                 hdfeos5_file = get_file_list('{}_*.he5'.format(SAT))[0]
             except:
                 hdfeos5_file = None
-            if ut.run_or_skip(out_file=hdfeos5_file, in_file=[ts_file, tcoh_file, mask_file, geom_file]) == 'run':
+            if self.run_or_skip(step_name, out_file=hdfeos5_file, in_file=[ts_file, tcoh_file, mask_file, geom_file]) == 'run':
                 pysar.save_hdfeos5.main(scp_args.split())
         else:
             print('save time-series to HDF-EOS5 format is OFF.')
@@ -921,7 +1127,10 @@ class TimeSeriesAnalysis:
 
 
     def plot_result(self, print_aux=True, plot=True):
-        """Plot data files and save to figures in PIC folder"""
+        """Plot data files and save to figures in PIC folder.
+        Run ./plot_pysarApp.sh if it is modified by the user from $PYSAR_HOME/sh/plot_pysarApp.sh,
+        otherwise plot the same figures in parallel with view_batch.py.
+        """
         if not self.template['pysar.plot'] or not plot:
             return
 
@@ -937,23 +1146,38 @@ class TimeSeriesAnalysis:
 
         print('\n******************** plot & save to PIC ********************')
         sh_file = os.path.join(os.path.dirname(__file__), '../sh/plot_pysarApp.sh')
+        run_sh_file = False
 
-        # 1) copy to work directory (if not existed yet).
+        # 1) copy to work directory (if not existed yet), for the user to modify
         if not os.path.isfile(os.path.basename(sh_file)):
             print('copy {} to work directory: {}'.format(sh_file, self.workDir))
             shutil.copy2(sh_file, self.workDir)
 
-        # 2) copy to work directory (if obsolete file detected) and rename the existing one
-        elif grab_latest_update_date(os.path.basename(sh_file)) < grab_latest_update_date(sh_file):
-            os.system('mv {f} {f}_obsolete'.format(f=os.path.basename(sh_file)))
-            print('obsolete shell file detected, renamed it to: {}_obsolete'.format(os.path.basename(sh_file)))
-            print('copy {} to work directory: {}'.format(sh_file, self.workDir))
-            shutil.copy2(sh_file, self.workDir)
+        elif not filecmp.cmp(os.path.basename(sh_file), sh_file, shallow=False):
+            # 2) copy to work directory (if obsolete file detected) and rename the existing one
+            if grab_latest_update_date(os.path.basename(sh_file)) < grab_latest_update_date(sh_file):
+                os.system('mv {f} {f}_obsolete'.format(f=os.path.basename(sh_file)))
+                print('obsolete shell file detected, renamed it to: {}_obsolete'.format(os.path.basename(sh_file)))
+                print('copy {} to work directory: {}'.format(sh_file, self.workDir))
+                shutil.copy2(sh_file, self.workDir)
 
-        # cmd
-        cmd = './'+os.path.basename(sh_file)
-        print(cmd)
-        subprocess.Popen(cmd, shell=True).wait()
+            # 3) run the shell file modified by the user
+            else:
+                run_sh_file = True
+
+        if run_sh_file:
+            cmd = './'+os.path.basename(sh_file)
+            print('user modified shell file detected, run:', cmd)
+            subprocess.Popen(cmd, shell=True).wait()
+        else:
+            # plot figures as $PYSAR_HOME/sh/plot_pysarApp.sh, in parallel
+            fig_list = pysar.view_batch.get_pysarApp_figure_list()
+            num_worker = min(int(self.template['pysar.plot.numWorker']), os.cpu_count())
+            print('view_batch.py --num-worker {}'.format(num_worker))
+            pysar.view_batch.plot_figures(fig_list,
+                                          num_worker=num_worker,
+                                          log_file='plot_pysarApp.log')
+            pysar.view_batch.move_figures('PIC')
 
         # message for more visualization scripts
         msg = """Explore more info & visualization options with the following scripts:
@@ -971,63 +1195,236 @@ class TimeSeriesAnalysis:
         return
 
 
-    def run(self, steps=STEP_LIST, plot=True):
-        # run the chosen steps
-        for sname in steps:
-            print('\n\n******************** step - {} ********************'.format(sname))
-
-            if sname == 'load_data':
-                self.run_load_data(sname)
-
-            elif sname == 'modify_network':
-                self.run_network_modification(sname)
-
-            elif sname == 'reference_point':
-                self.run_reference_point(sname)
-
-            elif sname == 'correct_unwrap_error':
-                self.run_unwrap_error_correction(sname)
+    def get_file_hash(self, fname, datasetName=None):
+        """Get the content hash of file / dataset, re-use the saved one if the file size and
+        modification time are the same, i.e. touching a file triggers re-hashing, not re-running.
+        """
+        if not os.path.isfile(fname):
+            return None
+        key = os.path.relpath(fname, self.workDir)
+        if datasetName:
+            key += '::{}'.format(datasetName)
+
+        stat = os.stat(fname)
+        file_id = [stat.st_size, stat.st_mtime_ns]
+        file_dict = self.stepHash['file']
+        if key not in file_dict.keys() or file_dict[key][:2] != file_id:
+            file_dict[key] = file_id + [ut.get_content_hash(fname, datasetName=datasetName)]
+        return file_dict[key][2]
+
+
+    def get_step_hash(self, step_name, in_files):
+        """Get the content hash of the step, from its input files and template options.
+        Parameters: step_name : str, step name
+                    in_files  : dict, input files, from get_step_io()
+        Returns:    hash_str  : str, hex digest, None if the inputs are unknown
+        """
+        if in_files is None:
+            return None
+        in_files = dict((os.path.relpath(k, self.workDir), v) for k, v in in_files.items())
+
+        # template options of the step, except for the ones on the computing resource only
+        key_prefix = STEP_GRAPH[step_name]['config']
+        key_list = [key for key in sorted(self.template.keys())
+                    if any(key == i or key.startswith(i+'.') for i in key_prefix)
+                    and not key.endswith(('.numWorker', '.parallel'))]
+
+        hash_obj = hashlib.blake2b(digest_size=16)
+        hash_obj.update(step_name.encode())
+        for key in key_list:
+            value = self.template[key]
+            hash_obj.update('{} = {}\n'.format(key, value).encode())
+            # input file from template option, e.g. pysar.network.maskFile, pysar.velocity.excludeDate
+            if isinstance(value, str) and os.path.isfile(value):
+                in_files.setdefault(os.path.relpath(value, self.workDir), None)
+
+        for fname in sorted(in_files.keys()):
+            for dsName in (in_files[fname] or [None]):
+                file_hash = self.get_file_hash(fname, datasetName=dsName)
+                hash_obj.update('{}::{} = {}\n'.format(fname, dsName, file_hash).encode())
+        return hash_obj.hexdigest()
+
+
+    def find_missing_output(self, step_name):
+        """Find the missing output file / dataset of the step.
+        Returns:    msg : str, message on the missing output, None if all outputs exist
+        """
+        out_files = self.get_step_io(step_name)[1]
+        if not out_files:
+            return 'no output file of step: {}, e.g. step is off'.format(step_name)
+        for fname, dsNames in out_files.items():
+            fnames = ut.get_file_list(fname)
+            if not fnames:
+                return 'output file: {} NOT found'.format(fname)
+            if dsNames:
+                with h5py.File(fnames[0], 'r') as f:
+                    ds_list = list(f.keys()) + list(f.attrs.keys())
+                if any(i not in ds_list for i in dsNames):
+                    return 'output dataset: {} NOT all found in file: {}'.format(dsNames, fname)
+        return None
+
+
+    def run_or_skip_step(self, step_name):
+        """Check whether to run the step or not. Return run if any of the following meets:
+            1. the inputs of the step are unknown, i.e. load_data
+            2. any output file / dataset does not exist, or the outputs are unknown, e.g. step is off
+            3. the content hash of input files and template options is different from the last run
+        Otherwise, return skip.
+        For 3, the step is also marked as forced, so that the file modification time based update
+        mode within the step, i.e. run_or_skip() and --update, is turned off.
+        """
+        if not self.template['pysar.workflow.updateMode']:
+            return 'run'
+
+        in_files = self.get_step_io(step_name)[0]
+        if in_files is None:
+            return 'run'
+
+        # check existence of output files / datasets
+        msg = self.find_missing_output(step_name)
+        if msg:
+            print('{} --> run.'.format(msg))
+            return 'run'
+
+        # check content hash of inputs
+        step_hash = self.get_step_hash(step_name, in_files)
+        last_hash = self.stepHash['step'].get(step_name, {}).get('hash', None)
+        if step_hash != last_hash:
+            print('content hash of input files / template options changed --> run.')
+            if last_hash:
+                self.forceSteps.add(step_name)
+            return 'run'
+        print('content hash of input files / template options is the same as the last run --> skip.')
+        return 'skip'
+
+
+    def run_or_skip(self, step_name, out_file, in_file=None, check_readable=True, print_msg=True):
+        """Check whether to run or skip the operation within the step, same as ut.run_or_skip(),
+        except that it always returns run for the forced step, as the modification time of the
+        existing output file does not reflect the changed template options.
+        """
+        if step_name in self.forceSteps:
+            if print_msg:
+                print('step {} is forced to run by the content hash --> run.'.format(step_name))
+            return 'run'
+        return ut.run_or_skip(out_file=out_file, in_file=in_file,
+                              check_readable=check_readable, print_msg=print_msg)
 
-            elif sname == 'stack_interferograms':
-                self.run_ifgram_stacking(sname)
 
-            elif sname == 'invert_network':
-                self.run_network_inversion(sname)
+    def update_option(self, step_name):
+        """Get the --update option for scripts called by the step, off for the forced step"""
+        if step_name in self.forceSteps:
+            return ''
+        return '--update'
 
-            elif sname == 'correct_LOD':
-                self.run_local_oscillator_drift_correction(sname)
 
-            elif sname == 'correct_troposphere':
-                self.run_tropospheric_delay_correction(sname)
+    def run_step(self, step_name):
+        """Run the step if needed.
+        Returns:    flag     : str, run / skip
+                    time_sec : float, time used in seconds
+        """
+        start_time = time.time()
+        print('\n\n******************** step - {} ********************'.format(step_name))
+        flag = self.run_or_skip_step(step_name)
+        if flag == 'run':
+            step_func = getattr(self, STEP_GRAPH[step_name]['func'])
+            if STEP_GRAPH[step_name].get('plot', False):
+                with self._plotLock:
+                    step_func(step_name)
+            else:
+                step_func(step_name)
+        return flag, time.time() - start_time
 
-            elif sname == 'deramp':
-                self.run_phase_deramping(sname)
 
-            elif sname == 'correct_topography':
-                self.run_topographic_residual_correction(sname)
+    def run_steps(self, steps):
+        """Run steps following the dependency graph in STEP_GRAPH.
+        Steps with all dependencies (within the input steps) finished are submitted in the order
+        of STEP_LIST, and run concurrently in threads if pysar.workflow.numWorker > 1.
 
-            elif sname == 'residual_RMS':
-                self.run_residual_phase_rms(sname)
+        Parameters: steps     : list of str, steps to run
+        Returns:    step_info : dict of (str, float), run/skip flag and time used for each step
+        """
+        num_worker = max(1, int(self.template['pysar.workflow.numWorker']))
+        steps = [i for i in STEP_LIST if i in steps]
+        depends = dict((i, [j for j in STEP_GRAPH[i]['depend'] if j in steps]) for i in steps)
+        print('run {} steps with {} worker(s)'.format(len(steps), num_worker))
+
+        step_info = dict()
+        pending = list(steps)
+        futures = dict()
+        with ThreadPoolExecutor(max_workers=num_worker) as executor:
+            while pending or futures:
+                # submit steps with all dependencies finished
+                for step_name in [i for i in pending if all(j in step_info.keys() for j in depends[i])]:
+                    if len(futures) >= num_worker:
+                        break
+                    pending.remove(step_name)
+                    futures[executor.submit(self.run_step, step_name)] = step_name
+
+                done = wait(list(futures.keys()), return_when=FIRST_COMPLETED)[0]
+                for future in done:
+                    step_name = futures.pop(future)
+                    # raise the exception of the step, after the running steps are finished
+                    step_info[step_name] = future.result()
+        return step_info
+
+
+    def update_step_hash(self, steps):
+        """Save the content hash of the finished steps into STEP_HASH_FILE.
+        It is calculated at the end of the run, after the files updated in place by later steps,
+        e.g. timeseries.h5 by reference_date, thus not triggering re-runs next time.
+        Steps with missing output, e.g. turned off by the template, are not saved, thus re-run
+        next time when they are turned on.
+        """
+        for step_name in steps:
+            step_hash = self.get_step_hash(step_name, self.get_step_io(step_name)[0])
+            if step_hash and not self.find_missing_output(step_name):
+                self.stepHash['step'][step_name] = {'hash' : step_hash,
+                                                    'time' : str(datetime.datetime.now())}
+            else:
+                self.stepHash['step'].pop(step_name, None)
+        with open(STEP_HASH_FILE, 'w') as f:
+            json.dump(self.stepHash, f, indent=2, sort_keys=True)
+        print('save content hash of steps to file: {}'.format(STEP_HASH_FILE))
+        return
 
-            elif sname == 'reference_date':
-                self.run_reference_date(sname)
 
-            elif sname == 'velocity':
-                self.run_timeseries2velocity(sname)
+    @staticmethod
+    def print_step_timing(step_info, total_time):
+        """Print the time used for each step"""
+        print('\n******************** time used for each step ********************')
+        print('{:<24} {:<6} {:>12}'.format('step', 'status', 'time [sec]'))
+        for step_name in [i for i in STEP_LIST if i in step_info.keys()]:
+            flag, time_sec = step_info[step_name]
+            print('{:<24} {:<6} {:>12.1f}'.format(step_name, flag, time_sec))
+        print('-'*44)
+        print('{:<31} {:>12.1f}'.format('sum of all steps', sum(i[1] for i in step_info.values())))
+        print('{:<31} {:>12.1f}'.format('wall clock', total_time))
+        return
 
-            elif sname == 'geocode':
-                self.run_geocode(sname)
 
-            elif sname == 'google_earth':
-                self.run_save2google_earth(sname)
+    def run(self, steps=STEP_LIST, plot=True):
+        # read the content hash of the last run
+        self.stepHash = {'step' : {}, 'file' : {}}
+        if os.path.isfile(STEP_HASH_FILE):
+            with open(STEP_HASH_FILE, 'r') as f:
+                self.stepHash.update(json.load(f))
+        self._plotLock = threading.Lock()
+        self.forceSteps = set()
 
-            elif sname == 'hdfeos5':
-                self.run_save2hdfeos5(sname)
+        # run the chosen steps
+        start_time = time.time()
+        step_info = self.run_steps(steps)
+        if self.template['pysar.workflow.updateMode']:
+            self.update_step_hash(steps)
 
         # plot result (show aux visualization message more multiple steps processing)
         print_aux = len(steps) > 1
         self.plot_result(print_aux=print_aux, plot=plot)
 
+        # timing report
+        self.print_step_timing(step_info, time.time() - start_time)
+
         # go back to original directory
         print('Go back to directory:', self.cwd)
         os.chdir(self.cwd)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2018, Zhang Yunjun                          #
+# Author:  Zhang Yunjun                                    #
+############################################################
+
+
+import os
+import time
+import argparse
+import h5py
+import numpy as np
+from pysar.objects import (chunkLayoutNames,
+                           compressionNames,
+                           get_chunk_shape,
+                           get_dataset_compression,
+                           hdf5plugin)
+
+
+###########################################################################################
+EXAMPLE = """Example:
+  rechunk_hdf5.py  ifgramStack.h5  --layout pixel
+  rechunk_hdf5.py  timeseries.h5   --layout image  -o timeseries_image.h5
+  rechunk_hdf5.py  ifgramStack.h5  --layout 100,64,64
+  rechunk_hdf5.py  ifgramStack.h5  --layout pixel  --compression lz4,coherence:zstd
+  rechunk_hdf5.py  ifgramStack.h5  --benchmark
+  rechunk_hdf5.py  timeseries.h5   --benchmark  --box-size 32  --num-box 50
+  rechunk_hdf5.py  ifgramStack.h5  --benchmark compression  --layout auto
+"""
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Re-write HDF5 file with a new chunk layout / compression,\n'
+                                                 'similar to h5repack -l / -f, or benchmark all layouts / codecs.',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=EXAMPLE)
+
+    parser.add_argument('file', type=str, help='HDF5 file to be rechunked, e.g. ifgramStack.h5, timeseries.h5')
+    parser.add_argument('-l', '--layout', dest='layout', default='pixel',
+                        help='chunk layout of 3D datasets, default: pixel.\n'
+                             'auto  - h5py heuristic\n'
+                             'image - image-major, (1, nrow, width), for fast reading of whole images\n'
+                             'pixel - pixel-major, (num_date, 64, 64), for fast reading of time columns\n'
+                             '        of small boxes, e.g. network inversion, tsview.py\n'
+                             '100,64,64 - explicit chunk shape, 0 for the full axis')
+    parser.add_argument('-c', '--compression', dest='compression', default='input',
+                        help='compression policy, default: input, to keep the compression of input file.\n'
+                             'e.g. no, lzf, gzip, lz4, zstd or lz4,coherence:zstd\n'
+                             'check pysar.objects.get_dataset_compression() for details.')
+    parser.add_argument('-o', '--output', dest='outfile',
+                        help='output file name, default: add _{layout} suffix to the input file name')
+    parser.add_argument('--memory-size', dest='memory_size', type=float, default=100e6,
+                        help='max number of data to read per loop while copying\n'
+                             'default: 100e6; adjust it according to your computer memory.')
+
+    bench = parser.add_argument_group('benchmark', 'time reading/writing under each chunk layout / codec')
+    bench.add_argument('--benchmark', nargs='?', const='chunk', choices={'chunk', 'compression'},
+                       help='chunk       - rechunk into temporary files with auto/image/pixel layout, and time\n'
+                            '              reading the full time column of random boxes and whole images.\n'
+                            'compression - repack into temporary files with each codec in --layout, and time\n'
+                            '              writing and reading of the whole dataset in MB/s.')
+    bench.add_argument('-d', '--dset', dest='dset',
+                       help='3D dataset to benchmark, default: the first 3D dataset, e.g. unwrapPhase')
+    bench.add_argument('--box-size', dest='box_size', type=int, default=64,
+                       help='box size in pixel for reading time columns, default: 64.')
+    bench.add_argument('--num-box', dest='num_box', type=int, default=20,
+                       help='number of random boxes to read, default: 20.')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    if not inps.benchmark and not inps.outfile:
+        fbase, fext = os.path.splitext(inps.file)
+        inps.outfile = '{}_{}{}'.format(fbase, inps.layout.replace(',', 'x'), fext)
+    if inps.outfile and os.path.abspath(inps.outfile) == os.path.abspath(inps.file):
+        raise ValueError('output file can not be the same as the input file: {}'.format(inps.file))
+    return inps
+
+
+###########################################################################################
+def get_input_compression(ds):
+    """Compression codec and h5py.create_dataset() keyword arguments of the input h5py.Dataset,
+    copied from its filter pipeline, thus, it works for the dynamically loaded filters too,
+    e.g. Blosc lz4/zstd, which h5py reports as "unknown" in ds.compression.
+    """
+    codec = ds.attrs.get('COMPRESSION', ds.compression)
+    comp_kwargs = dict(shuffle=ds.shuffle, fletcher32=ds.fletcher32)
+    if ds.scaleoffset is not None:
+        comp_kwargs['scaleoffset'] = ds.scaleoffset
+
+    if ds.compression in ['gzip', 'lzf', 'szip']:
+        comp_kwargs.update(compression=ds.compression, compression_opts=ds.compression_opts)
+    elif ds.compression:
+        builtin_filters = [h5py.h5z.FILTER_SHUFFLE, h5py.h5z.FILTER_FLETCHER32, h5py.h5z.FILTER_SCALEOFFSET]
+        plist = ds.id.get_create_plist()
+        for i in range(plist.get_nfilters()):
+            filter_id, flags, cd_values = plist.get_filter(i)[0:3]
+            if filter_id not in builtin_filters:
+                comp_kwargs.update(compression=filter_id, compression_opts=tuple(cd_values))
+                break
+    return codec, comp_kwargs
+
+
+def rechunk_dataset(ds, fo, layout='pixel', compression='input', memory_size=100e6, print_msg=True):
+    """Copy 3D h5py.Dataset into the opened output HDF5 file with a new chunk layout / compression,
+    block by block in the 2nd last (row) dimension to limit the memory usage.
+    Returns:    t_write : float, time used in writing (compressing and flushing) the output dataset
+                          in seconds, excluding the reading of the input dataset
+    """
+    chunks = get_chunk_shape(ds.shape, layout=layout, dtype=ds.dtype)
+
+    if compression == 'input':
+        codec, comp_kwargs = get_input_compression(ds)
+    else:
+        codec, comp_kwargs = get_dataset_compression(compression,
+                                                     dsName=os.path.basename(ds.name),
+                                                     dtype=ds.dtype)
+    if print_msg:
+        print('create dataset {d} of {t:<10} in size of {s:<20} with chunks={c} and compression={p}'.format(
+            d=ds.name, t=str(ds.dtype), s=str(ds.shape), c=chunks, p=codec))
+
+    # datasets with resizable dimension, e.g. ifgramStack.h5 written by load_data.py
+    kwargs = {}
+    if ds.maxshape != ds.shape:
+        kwargs['maxshape'] = ds.maxshape
+        chunks = chunks or True
+    if comp_kwargs.get('compression', None):
+        chunks = chunks or True
+    dso = fo.create_dataset(ds.name,
+                            shape=ds.shape,
+                            dtype=ds.dtype,
+                            chunks=chunks,
+                            **comp_kwargs,
+                            **kwargs)
+
+    t_write = 0.
+    if ds.size == 0:
+        dso[()] = ds[()]
+    else:
+        # number of rows per block, in multiple of the output chunk rows
+        num_row_chunk = dso.chunks[-2]
+        num_row = int(memory_size / max(1, ds.size // ds.shape[-2]))
+        num_row = max(num_row_chunk, num_row // num_row_chunk * num_row_chunk)
+        for y0 in range(0, ds.shape[-2], num_row):
+            y1 = min(y0 + num_row, ds.shape[-2])
+            data = ds[..., y0:y1, :]
+            start_time = time.time()
+            dso[..., y0:y1, :] = data
+            t_write += time.time() - start_time
+
+    # chunks in the cache are compressed and written at flush
+    start_time = time.time()
+    fo.flush()
+    t_write += time.time() - start_time
+
+    for key, value in ds.attrs.items():
+        dso.attrs[key] = value
+    if compression != 'input':
+        if codec:
+            dso.attrs['COMPRESSION'] = codec
+        elif 'COMPRESSION' in dso.attrs.keys():
+            del dso.attrs['COMPRESSION']
+    return t_write
+
+
+def rechunk_hdf5(fname, out_file, layout='pixel', compression='input', memory_size=100e6, print_msg=True):
+    """Re-write HDF5 file with a new chunk layout / compression for all 3D datasets;
+    the other datasets, e.g. date, bperp, height, are copied unchanged,
+    with groups, attributes, compression and resizable dimensions kept.
+    Parameters: fname    : str, input HDF5 file
+                out_file : str, output HDF5 file
+                layout   : str or tuple of int, chunk layout, check pysar.objects.get_chunk_shape()
+                compression : str, compression policy, check pysar.objects.get_dataset_compression()
+                              input to keep the compression of the input file
+                memory_size : float, max number of data to read per loop
+    Returns:    out_file : str
+    Example:    rechunk_hdf5('ifgramStack.h5', 'ifgramStack_pixel.h5', layout='pixel')
+    """
+    if print_msg:
+        print('rechunk file {} into {} with {} layout and {} compression'.format(fname, out_file, layout, compression))
+    with h5py.File(fname, 'r') as fi, h5py.File(out_file, 'w') as fo:
+        def copy_item(name, obj):
+            if isinstance(obj, h5py.Group):
+                grp = fo.require_group(name)
+                for key, value in obj.attrs.items():
+                    grp.attrs[key] = value
+            elif isinstance(obj, h5py.Dataset) and obj.ndim != 3:
+                if print_msg:
+                    print('copy dataset {} of {:<10} in size of {}'.format(obj.name, str(obj.dtype), obj.shape))
+                fi.copy(obj, fo, name=name)
+            elif isinstance(obj, h5py.Dataset):
+                rechunk_dataset(obj, fo,
+                                layout=layout,
+                                compression=compression,
+                                memory_size=memory_size,
+                                print_msg=print_msg)
+        fi.visititems(copy_item)
+
+        for key, value in fi.attrs.items():
+            fo.attrs[key] = value
+    if print_msg:
+        print('finished writing to {}'.format(out_file))
+    return out_file
+
+
+###########################################################################################
+def get_3d_dataset_name(fname):
+    """Name of the first 3D dataset in the HDF5 file"""
+    dsNames = []
+    with h5py.File(fname, 'r') as f:
+        f.visititems(lambda name, obj: dsNames.append(name)
+                     if isinstance(obj, h5py.Dataset) and obj.ndim == 3 else None)
+    if not dsNames:
+        raise ValueError('No 3D dataset found in file: {}'.format(fname))
+    return dsNames[0]
+
+
+def benchmark_box_read(fname, dsName, box_size=64, num_box=20, num_image=5):
+    """Time reading the full time column of random boxes and whole images from 3D dataset.
+    Returns:    t_box, t_image : float, average time in seconds per box / image
+    """
+    with h5py.File(fname, 'r') as f:
+        ds = f[dsName]
+        num_img, length, width = ds.shape
+        box_size = min(box_size, length, width)
+
+        # same random boxes for all files
+        rng = np.random.RandomState(0)
+        y0s = rng.randint(0, length - box_size + 1, size=num_box)
+        x0s = rng.randint(0, width - box_size + 1, size=num_box)
+        start_time = time.time()
+        for y0, x0 in zip(y0s, x0s):
+            ds[:, y0:y0+box_size, x0:x0+box_size]
+        t_box = (time.time() - start_time) / num_box
+
+        idxs = np.linspace(0, num_img - 1, min(num_image, num_img), dtype=int)
+        start_time = time.time()
+        for i in idxs:
+            ds[i, :, :]
+        t_image = (time.time() - start_time) / len(idxs)
+    return t_box, t_image
+
+
+def benchmark_layouts(fname, dsName=None, box_size=64, num_box=20, memory_size=100e6):
+    """Rechunk input file into temporary files with each layout and benchmark box/image reading.
+    The input file itself is benchmarked as "input". Results include the OS file cache.
+    """
+    if not dsName:
+        dsName = get_3d_dataset_name(fname)
+    with h5py.File(fname, 'r') as f:
+        ds_shape, ds_dtype, ds_chunks = f[dsName].shape, f[dsName].dtype, f[dsName].chunks
+    print('benchmark reading /{} of {} in size of {} from file: {}'.format(dsName, ds_dtype, ds_shape, fname))
+    print('box size: {} pixels, number of boxes: {}'.format(box_size, num_box))
+
+    fdir, fbase = os.path.split(os.path.abspath(fname))
+    results = [['input', str(ds_chunks), 0.] + list(benchmark_box_read(fname, dsName, box_size, num_box))]
+    for layout in chunkLayoutNames:
+        tmp_file = os.path.join(fdir, 'tmp_{}_{}'.format(layout, fbase))
+        start_time = time.time()
+        rechunk_hdf5(fname, tmp_file, layout=layout, memory_size=memory_size, print_msg=False)
+        t_write = time.time() - start_time
+        try:
+            with h5py.File(tmp_file, 'r') as f:
+                chunks = f[dsName].chunks
+            t_box, t_image = benchmark_box_read(tmp_file, dsName, box_size, num_box)
+        finally:
+            os.remove(tmp_file)
+        results.append([layout, str(chunks), t_write, t_box, t_image])
+
+    msg = '{:<8}{:<20}{:>12}{:>16}{:>16}'
+    print(msg.format('layout', 'chunks', 'rechunk [s]', 'box read [ms]', 'image read [ms]'))
+    for layout, chunks, t_write, t_box, t_image in results:
+        print(msg.format(layout, chunks, '{:.2f}'.format(t_write) if t_write else '-',
+                         '{:.2f}'.format(t_box * 1e3), '{:.2f}'.format(t_image * 1e3)))
+    return results
+
+
+def benchmark_compression(fname, dsName=None, layout='pixel', memory_size=100e6):
+    """Repack the 3D dataset into temporary files with each codec and benchmark writing/reading.
+    Speed is in MB/s of the uncompressed 3D dataset, with the time of writing the dataset only.
+    Results include the OS file cache.
+    """
+    if not dsName:
+        dsName = get_3d_dataset_name(fname)
+    with h5py.File(fname, 'r') as f:
+        ds_shape, ds_dtype = f[dsName].shape, f[dsName].dtype
+    data_mb = np.prod(ds_shape) * np.dtype(ds_dtype).itemsize / 1024**2
+    print('benchmark writing/reading /{} of {} in size of {} ({:.1f} MB) from file: {}'.format(
+        dsName, ds_dtype, ds_shape, data_mb, fname))
+
+    codecs = list(compressionNames)
+    if hdf5plugin is None:
+        print('hdf5plugin is not installed, skip lz4 and zstd.')
+        codecs = [i for i in codecs if i not in ['lz4', 'zstd']]
+
+    fdir, fbase = os.path.split(os.path.abspath(fname))
+    results = []
+    for codec in codecs:
+        # write the benchmarked dataset only
+        tmp_file = os.path.join(fdir, 'tmp_{}_{}'.format(codec, fbase))
+        with h5py.File(fname, 'r') as fi, h5py.File(tmp_file, 'w') as fo:
+            t_write = rechunk_dataset(fi[dsName], fo,
+                                      layout=layout,
+                                      compression=codec,
+                                      memory_size=memory_size,
+                                      print_msg=False)
+        try:
+            with h5py.File(tmp_file, 'r') as f:
+                ds = f[dsName]
+                size_mb = ds.id.get_storage_size() / 1024**2
+                start_time = time.time()
+                ds[:]
+                t_read = time.time() - start_time
+        finally:
+            os.remove(tmp_file)
+        results.append([str(codec), size_mb / data_mb, data_mb / t_write, data_mb / t_read])
+
+    msg = '{:<8}{:>14}{:>18}{:>18}'
+    print(msg.format('codec', 'size ratio', 'write [MB/s]', 'read [MB/s]'))
+    for codec, ratio, v_write, v_read in results:
+        print(msg.format(codec, '{:.3f}'.format(ratio), '{:.1f}'.format(v_write), '{:.1f}'.format(v_read)))
+    return results
+
+
+###########################################################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    if inps.benchmark == 'chunk':
+        benchmark_layouts(inps.file,
+                          dsName=inps.dset,
+                          box_size=inps.box_size,
+                          num_box=inps.num_box,
+                          memory_size=inps.memory_size)
+        return
+    elif inps.benchmark == 'compression':
+        benchmark_compression(inps.file,
+                              dsName=inps.dset,
+                              layout=inps.layout,
+                              memory_size=inps.memory_size)
+        return
+
+    start_time = time.time()
+    rechunk_hdf5(inps.file, inps.outfile,
+                 layout=inps.layout,
+                 compression=inps.compression,
+                 memory_size=inps.memory_size)
+    print('time used: {:.1f} secs'.format(time.time() - start_time))
+    return inps.outfile
+
+
+###########################################################################################
+if __name__ == '__main__':
+    main()
@@ -129,6 +129,7 @@ def ref_date_file(ts_file, ref_date, outfile=None):
             with h5py.File(ts_file, 'r+') as f:
                 print("update /timeseries dataset and 'REF_DATE' attribute value")
                 f['timeseries'][:] = ts_data
+                f['timeseries'].attrs['MODIFICATION_TIME'] = str(time.time())
                 f.attrs['REF_DATE'] = ref_date
             print('close {}'.format(ts_file))
         else:
@@ -8,6 +8,7 @@
 
 import os
 import sys
+import time
 import argparse
 import h5py
 import numpy as np
@@ -215,6 +216,7 @@ def reference_file(inps):
             ds = f[k].get('unwrapPhase')
             for i in range(ds.shape[0]):
                 ds[i, :, :] -= ds[i, inps.ref_y, inps.ref_x]
+            ds.attrs['MODIFICATION_TIME'] = str(time.time())
             f[k].attrs.update(atrNew)
             f.close()
             inps.outfile = inps.file
@@ -10,7 +10,7 @@
 import argparse
 import numpy as np
 import scipy.io.netcdf as netcdf
-from pysar.utils import readfile, plot as pp
+from pysar.utils import readfile
 
 
 ####################################################################################
@@ -146,6 +146,7 @@ def write_grd_file(data, atr, fname_out=None):
         fname_out - string, output file name
     """
     if not fname_out:
+        from pysar.utils import plot as pp
         fname_out = '{}.grd'.format(pp.auto_figure_title(inps.file,
                                                          datasetNames=inps.dset,
                                                          inps_dict=vars(inps)))
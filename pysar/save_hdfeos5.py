@@ -12,7 +12,7 @@ import argparse
 import datetime as dt
 import h5py
 import numpy as np
-from pysar.objects import timeseries, geometry, sensor
+from pysar.objects import timeseries, geometry, sensor, get_dataset_compression
 from pysar.utils import readfile
 from pysar import info
 
@@ -54,6 +54,10 @@ def create_parser():
                         help='Enable update mode, a.k.a. put XXXXXXXX as endDate in filename if endDate < 1 year')
     parser.add_argument('--subset', action='store_true',
                         help='Enable subset mode, a.k.a. put suffix _N31700_N32100_E130500_E131100')
+    parser.add_argument('--compression', default=compression,
+                        help='compression policy, default: {}. Use lz4/zstd through hdf5plugin for\n'
+                             'faster writing/reading, or per-dataset policy, e.g. gzip,displacement:zstd.\n'
+                             'Readers need hdf5plugin for lz4/zstd.'.format(compression))
     return parser
 
 
@@ -286,7 +290,7 @@ def read_template2inps(template_file, inps=None):
     return inps
 
 
-def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
+def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata, compression=compression):
     """Write HDF5 file in HDF-EOS5 format"""
     ts_obj = timeseries(ts_file)
     ts_obj.open(print_msg=False)
@@ -304,18 +308,19 @@ def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
 
     dsName = 'displacement'
     data = ts_obj.read(print_msg=False)
+    codec, comp_kwargs = get_dataset_compression(compression, dsName, data.dtype)
     print(('create dataset /{g}/{d:<{w}} of {t:<10} in size of {s}'
            ' with compression={c}').format(g=gName,
                                            d=dsName,
                                            w=maxDigit,
                                            t=str(data.dtype),
                                            s=data.shape,
-                                           c=compression))
+                                           c=codec))
     dset = group.create_dataset(dsName,
                                 data=data,
                                 dtype=np.float32,
                                 chunks=True,
-                                compression=compression)
+                                **comp_kwargs)
     dset.attrs['Title'] = dsName
     dset.attrs['MissingValue'] = FLOAT_ZERO
     dset.attrs['_FillValue'] = FLOAT_ZERO
@@ -347,17 +352,18 @@ def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
     ## 1 - temporalCoherence
     dsName = 'temporalCoherence'
     data = readfile.read(coh_file)[0]
+    codec, comp_kwargs = get_dataset_compression(compression, dsName, data.dtype)
     print(('create dataset /{g}/{d:<{w}} of {t:<10} in size of {s}'
            ' with compression={c}').format(g=gName,
                                            d=dsName,
                                            w=maxDigit,
                                            t=str(data.dtype),
                                            s=data.shape,
-                                           c=compression))
+                                           c=codec))
     dset = group.create_dataset(dsName,
                                 data=data,
                                 chunks=True,
-                                compression=compression)
+                                **comp_kwargs)
     dset.attrs['Title'] = dsName
     dset.attrs['MissingValue'] = FLOAT_ZERO
     dset.attrs['_FillValue'] = FLOAT_ZERO
@@ -366,17 +372,18 @@ def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
     ## 2 - mask
     dsName = 'mask'
     data = readfile.read(mask_file, datasetName='mask')[0]
+    codec, comp_kwargs = get_dataset_compression(compression, dsName, data.dtype)
     print(('create dataset /{g}/{d:<{w}} of {t:<10} in size of {s}'
            ' with compression={c}').format(g=gName,
                                            d=dsName,
                                            w=maxDigit,
                                            t=str(data.dtype),
                                            s=data.shape,
-                                           c=compression))
+                                           c=codec))
     dset = group.create_dataset(dsName,
                                 data=data,
                                 chunks=True,
-                                compression=compression)
+                                **comp_kwargs)
     dset.attrs['Title'] = dsName
     dset.attrs['MissingValue'] = BOOL_ZERO
     dset.attrs['_FillValue'] = BOOL_ZERO
@@ -393,17 +400,18 @@ def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
     geom_obj.open(print_msg=False)
     for dsName in geom_obj.datasetNames:
         data = geom_obj.read(datasetName=dsName, print_msg=False)
+        codec, comp_kwargs = get_dataset_compression(compression, dsName, data.dtype)
         print(('create dataset /{g}/{d:<{w}} of {t:<10} in size of {s}'
                ' with compression={c}').format(g=gName,
                                                d=dsName,
                                                w=maxDigit,
                                                t=str(data.dtype),
                                                s=data.shape,
-                                               c=compression))
+                                               c=codec))
         dset = group.create_dataset(dsName,
                                     data=data,
                                     chunks=True,
-                                    compression=compression)
+                                    **comp_kwargs)
 
         dset.attrs['Title'] = dsName
         if dsName in ['height',
@@ -460,7 +468,8 @@ def main(iargs=None):
                coh_file=inps.coherence_file,
                mask_file=inps.mask_file,
                geom_file=inps.geom_file,
-               metadata=meta_dict)
+               metadata=meta_dict,
+               compression=inps.compression)
     return outName
 
 
@@ -20,6 +20,7 @@ import matplotlib.pyplot as plt
 
 from pysar.objects import timeseriesKeyNames
 from pysar.utils import readfile, utils as ut, plot as pp
+from pysar.multilook import multilook_data, multilook_attribute
 
 
 ############################################################
@@ -142,6 +143,28 @@ def generate_cbar_element(cbar_png_file, inps):
 
 
 ############################################################
+def get_figure_size(metadata, fig_size=None):
+    """Get figure size in inches based on the lat/lon coverage, if not specified"""
+    if not fig_size:
+        west, east, south, north = ut.four_corners(metadata)
+        plot_shape = [east-west, north-south]
+        fig_scale = min(pp.min_figsize_single / min(plot_shape),
+                        pp.max_figsize_single / max(plot_shape),
+                        pp.max_figsize_height / plot_shape[1])
+        fig_size = [2.*i*fig_scale for i in plot_shape]
+    return fig_size
+
+
+def get_multilook_num(metadata, fig_size, fig_dpi):
+    """Get the max number of looks in power of 2, to have the image no smaller than the figure,
+    in order to read the coarsest level from the overview pyramid if available, check add_overview.py
+    """
+    ratio = min(int(metadata['WIDTH']) / (fig_size[0] * fig_dpi),
+                int(metadata['LENGTH']) / (fig_size[1] * fig_dpi))
+    multilook_num = int(2**np.floor(np.log2(ratio))) if ratio >= 2 else 1
+    return multilook_num
+
+
 def write_kmz_file(data, metadata, out_file, inps=None):
     """ Generate Google Earth KMZ file for input data matrix.
     Inputs:
@@ -175,12 +198,7 @@ def write_kmz_file(data, metadata, out_file, inps=None):
     print('plotting data ...')
 
     # Figure size
-    if not inps.fig_size:
-        plot_shape = [east-west, north-south]
-        fig_scale = min(pp.min_figsize_single / min(plot_shape),
-                        pp.max_figsize_single / max(plot_shape),
-                        pp.max_figsize_height / plot_shape[1])
-        inps.fig_size = [2.*i*fig_scale for i in plot_shape]
+    inps.fig_size = get_figure_size(metadata, inps.fig_size)
     print('create figure in size: '+str(inps.fig_size))
     fig = plt.figure(figsize=inps.fig_size, frameon=False)
     ax = fig.add_axes([0., 0., 1., 1.])
@@ -265,12 +283,20 @@ def main(iargs=None):
     inps = cmd_line_parse(iargs)
     plt.switch_backend('Agg')  # Backend setting
 
-    # Read data
-    data, atr = readfile.read(inps.file, datasetName=inps.dset)
+    # Read data, multilooked to the figure size
+    atr = readfile.read_attribute(inps.file)
+    inps.fig_size = get_figure_size(atr, inps.fig_size)
+    lks = get_multilook_num(atr, inps.fig_size, inps.fig_dpi)
+    data, atr = readfile.read(inps.file, datasetName=inps.dset, multilook_num=lks)
+    if lks > 1:
+        print('multilook with a factor of {} for the figure size'.format(lks))
+        atr = multilook_attribute(atr, lks, lks, print_msg=False)
 
     # mask
     mask = pp.read_mask(inps.file, mask_file=inps.mask_file, datasetName=inps.dset, print_msg=True)[0]
     if mask is not None:
+        if lks > 1:
+            mask = multilook_data(np.array(mask, np.float32), lks, lks) >= 0.5
         data = np.ma.masked_where(mask == 0., data)
 
     # Data Operation - Display Unit & Rewrapping
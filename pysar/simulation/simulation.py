@@ -18,6 +18,14 @@ from pysar.simulation.plot import *
 from pysar import ifgram_inversion as ifginv
 
 
+# inverse CDF of decorrelation phase noise, cached by (L, quantized coherence),
+# for fast sampling in Monte Carlo simulations with many interferograms and samples
+DECOR_PHASE_ICDF = {}
+COH_STEP = 1e-3         # coherence quantization step
+PHI_NUM = 1000          # number of phase bins in the PDF
+PROB_NUM = 4000         # number of probability samples in the inverse CDF
+
+
 def velocity2timeseries(date_list, vel=0.03, display=False):
     '''Simulate displacement time-series from linear velocity
     Inputs:
@@ -72,13 +80,11 @@ def sim_variable_timeseries(tbase, scale=3., display=False):
 
 def timeseries2ifgram(ts_sim, date_list, date12_list, wvl=0.055, display=False):
     range2phase = -4.0 * np.pi / wvl
-    num_ifgram = len(date12_list)
-    ifgram_sim = np.zeros((num_ifgram,1), np.float32)
-    for i in range(num_ifgram):
-        m_date, s_date = date12_list[i].split('_')
-        m_idx = date_list.index(m_date)
-        s_idx = date_list.index(s_date)
-        ifgram_sim[i] = ts_sim[s_idx] - ts_sim[m_idx]
+    date_idx = dict((d, i) for i, d in enumerate(date_list))
+    m_idx = [date_idx[i.split('_')[0]] for i in date12_list]
+    s_idx = [date_idx[i.split('_')[1]] for i in date12_list]
+    ts_sim = np.array(ts_sim).reshape(len(date_list), -1)
+    ifgram_sim = np.array(ts_sim[s_idx, :] - ts_sim[m_idx, :], np.float32)
     ifgram_sim *= range2phase
 
     if display:
@@ -132,6 +138,79 @@ def sample_decorrelation_phase(L, coherence, size=1, display=False, scale=1.0, f
     return sample
 
 
+def get_decorrelation_phase_icdf(L, coh_idx):
+    """Get the inverse CDF of decorrelation phase noise from cache for a list of quantized coherence
+    Parameters: L       : int, multilook number
+                coh_idx : 1D np.array of int, quantized coherence, i.e. coherence / COH_STEP
+    Returns:    icdf    : 2D np.array in size of (len(coh_idx), PROB_NUM),
+                          phase in radian at cumulative probability of (np.arange(PROB_NUM) + 0.5) / PROB_NUM
+    Example:    icdf = get_decorrelation_phase_icdf(20, np.array([500, 700]))
+    """
+    L = int(L)
+    coh_idx = [int(i) for i in coh_idx]
+
+    # calculate inverse CDF for un-cached coherence in one pass
+    coh_idx2calc = sorted(set(i for i in coh_idx if (L, i) not in DECOR_PHASE_ICDF))
+    if coh_idx2calc:
+        coh = np.array(coh_idx2calc, np.float64) * COH_STEP
+        pdf = ifginv.phase_pdf_ds(L, coh, phi_num=PHI_NUM)[0]
+        # remove numerical noise to ensure a monotonic CDF
+        pdf[~np.isfinite(pdf)] = 0.
+        pdf[pdf < 0.] = 0.
+        # piece-wise constant PDF within phase bins, same as scipy.stats.rv_histogram
+        phi = np.linspace(-np.pi, np.pi, PHI_NUM+1, endpoint=True)
+        cdf = np.vstack((np.zeros((1, coh.size)), np.cumsum(pdf, axis=0)))
+        cdf /= cdf[-1, :]
+        # sample at the bin center of probability to avoid the long flat tails at 0 and 1
+        prob = (np.arange(PROB_NUM) + 0.5) / PROB_NUM
+        for i, idx in enumerate(coh_idx2calc):
+            DECOR_PHASE_ICDF[(L, idx)] = np.interp(prob, cdf[:, i], phi).astype(np.float32)
+
+    icdf = np.vstack([DECOR_PHASE_ICDF[(L, i)] for i in coh_idx])
+    return icdf
+
+
+def sample_decorrelation_phases(L, cohs, size=1, scale=1.0, chunk_size=int(5e6)):
+    """Sample decorrelation phase noise for multiple coherence values with cached inverse CDF
+    Parameters: L     : int, multilook number
+                cohs  : 1D / 2D np.array in size of (num,) or (num, 1) or (num, size), spatial coherence
+                size  : int, sample number for each coherence in rows
+                scale : float, scale factor of the phase noise
+                chunk_size : int, max number of samples to generate at once, to limit memory usage
+    Returns:    sample : 2D np.array in size of (num, size) in float32, sampled phase
+    Example:    unw_n = sample_decorrelation_phases(L=20, cohs=np.array([0.3, 0.7]), size=100000)
+    """
+    cohs = np.array(cohs, np.float64)
+    num = cohs.shape[0]
+    cohs = cohs.reshape(num, -1)
+    if cohs.shape[1] not in [1, size]:
+        raise ValueError('input coherence in size of {} is not compatible with sample size of {}'.format(cohs.shape, size))
+
+    # quantize coherence
+    coh_max = 1. - COH_STEP
+    coh_idx = np.rint(np.clip(cohs, 0., coh_max) / COH_STEP).astype(np.int64)
+    coh_idx_uniq, coh_idx_inv = np.unique(coh_idx, return_inverse=True)
+    coh_idx_inv = coh_idx_inv.reshape(coh_idx.shape)
+    icdf = get_decorrelation_phase_icdf(L, coh_idx_uniq)
+
+    # sample with inverse transform sampling and linear interpolation, in chunks of rows
+    icdf = icdf.flatten()
+    sample = np.zeros((num, size), np.float32)
+    step = max(1, int(chunk_size / size))
+    for i0 in range(0, num, step):
+        i1 = min(i0 + step, num)
+        pos = np.random.random_sample((i1 - i0, size)) * PROB_NUM - 0.5
+        np.clip(pos, 0., PROB_NUM - 1, out=pos)
+        j = np.minimum(pos.astype(np.int32), PROB_NUM - 2)
+        frac = (pos - j).astype(np.float32)
+        j += (coh_idx_inv[i0:i1, :] * PROB_NUM).astype(np.int32)
+        phi0 = np.take(icdf, j)
+        sample[i0:i1, :] = phi0 + (np.take(icdf, j + 1) - phi0) * frac
+    if scale != 1.:
+        sample *= scale
+    return sample
+
+
 def simulate_decorrelation_noises(date12_list, cohs, L=20, size:int=1, display=False, scale=1.0):
     '''Simuate decorrelation phase noise for input interferometric pairs
     Inputs:
@@ -146,10 +225,7 @@ def simulate_decorrelation_noises(date12_list, cohs, L=20, size:int=1, display=F
         cohs = pnet.simulate_coherence(date12_list_all, decor_time=1000, coh_resid=0.2, display=True, inc_angle=22.8)
         decorNoises = simulate_decorrelation_noises(date12_list_all, cohs, L=20, display=True)
     '''
-    ifgram_num = len(cohs)
-    decorNoises = np.zeros((ifgram_num, size), np.float32)
-    for i in range(ifgram_num):
-        decorNoises[i, :] = sample_decorrelation_phase(int(L), cohs[i], size=size, scale=scale)
+    decorNoises = sample_decorrelation_phases(int(L), cohs, size=size, scale=scale)
 
     if display:
         decorNoisesMat = pnet.coherence_matrix(date12_list, decorNoises)
@@ -169,7 +245,7 @@ def simulate_network(ts_sim, date12_list, decor_day, coh_resid, L=75, num_sample
                      baseline_file='bl_list.txt', sensor_name='Sen', inc_angle=33.4):
     """Simulate coherence --> decorrelation noise --> ifgram phase and estimated coherence"""
     coh_sim = pnet.simulate_coherence(date12_list,
-                                      baseline_file='bl_list.txt',
+                                      baseline_file=baseline_file,
                                       sensor_name=sensor_name,
                                       inc_angle=inc_angle,
                                       decor_time=decor_day,
@@ -308,6 +384,7 @@ def add_unw_err2ifgram(ifgram, percentage=0.1, Nmax=2, print_msg=True):
         print('unwrap error jump in 2*pi*(-{n}, {n}): '.format(n=Nmax))
         print('number of ifgrams with unwrap error: {}'.format(num_ifg_err))
     ifgram_err = np.array(ifgram, dtype=np.float32)
-    ifgram_err[idx_ifg_err] += 2.*np.pi*np.random.choice(Nlist, size=num_ifg_err)
+    unw_err = 2.*np.pi*np.random.choice(Nlist, size=num_ifg_err)
+    ifgram_err[idx_ifg_err] += unw_err.reshape((-1,) + (1,)*(ifgram_err.ndim-1))
     return ifgram_err, idx_ifg_err
 
@@ -7,16 +7,22 @@
 
 
 import os
+import time
 import argparse
 import numpy as np
 from pysar.objects import timeseries
-from pysar.utils import ptime
+from pysar.utils import writefile
+from pysar.ifgram_inversion import split2boxes
 
 
+KERNEL_NAMES = ['gaussian', 'causal', 'median']
+
 ############################################################
 EXAMPLE = """example:
  temporal_filter.py timeseries_ECMWF_demErr.h5
  temporal_filter.py timeseries_ECMWF_demErr.h5 -t 0.1
+ temporal_filter.py timeseries_ECMWF_demErr.h5 -t 0.1 -k causal
+ temporal_filter.py timeseries_ECMWF_demErr.h5 -t 0.2 -k median
 """
 
 REFERENCE="""reference:
@@ -31,8 +37,18 @@ def create_parser():
     parser.add_argument('timeseries_file',
                         help='timeseries file to be smoothed.')
     parser.add_argument('-t', '--time-win', dest='time_win', type=float, default=0.1,
-                        help='time window in years, default: 0.1 (Sigma of the assmued Gaussian distribution.)')
+                        help='time window in years, default: 0.1\n'+
+                             'Sigma of the assmued Gaussian distribution for gaussian/causal kernel;\n'+
+                             'half width of the moving window for median kernel.')
+    parser.add_argument('-k', '--kernel', dest='kernel', default='gaussian', choices=KERNEL_NAMES,
+                        help='filter kernel in time, default: gaussian\n'+
+                             'gaussian - symmetric Gaussian window\n'+
+                             'causal   - one-sided Gaussian window, using the current and previous acquisitions only\n'+
+                             'median   - moving median window, robust to outliers')
     parser.add_argument('-o', '--outfile', help='Output file name.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data (= num_date * num_row * num_col) to read per loop\n' +
+                             'default: 100e6; adjust it according to your computer memory.')
     return parser
 
 
@@ -42,42 +58,97 @@ def cmd_line_parse(iargs=None):
     return inps
 
 
+############################################################
+def get_kernel_matrix(tbase, time_win=0.1, kernel='gaussian'):
+    """Weight matrix of the linear filter kernel in time
+    Parameters: tbase    : 1D np.array in size of (num_date,), time in years
+                time_win : float, sigma of the Gaussian distribution in years
+                kernel   : str, gaussian or causal
+    Returns:    weight   : 2D np.array in size of (num_date, num_date), with each row summed to one,
+                           so that ts_filt = np.dot(weight, ts_data)
+    Example:    weight = get_kernel_matrix(np.array(obj.yearList), time_win=0.1)
+    """
+    tbase = np.array(tbase, np.float64).reshape(-1, 1)
+    # tbase_diff[i, j] = t_i - t_j
+    tbase_diff = tbase - tbase.T
+    weight = np.exp(-0.5 * (tbase_diff**2) / (time_win**2))
+    if kernel == 'causal':
+        weight[tbase_diff < 0.] = 0.
+    elif kernel != 'gaussian':
+        raise ValueError('un-supported linear filter kernel: {}'.format(kernel))
+    weight /= np.sum(weight, axis=1, keepdims=True)
+    return weight
+
+
+def filter_timeseries(ts_data, tbase, time_win=0.1, kernel='gaussian', weight=None):
+    """Filter time-series in time with the given kernel
+    Parameters: ts_data  : 2D np.array in size of (num_date, num_pixel)
+                tbase    : 1D np.array in size of (num_date,), time in years
+                time_win : float, time window in years
+                kernel   : str, gaussian, causal or median
+                weight   : 2D np.array in size of (num_date, num_date), kernel matrix for linear filter,
+                           to avoid re-calculation for each block
+    Returns:    ts_data_filt : 2D np.array in size of (num_date, num_pixel) in float32
+    """
+    # moving median window: one median per acquisition
+    if kernel == 'median':
+        tbase = np.array(tbase, np.float64).flatten()
+        ts_data_filt = np.zeros(ts_data.shape, np.float32)
+        for i in range(tbase.size):
+            flag = np.abs(tbase - tbase[i]) <= time_win
+            ts_data_filt[i, :] = np.median(ts_data[flag, :], axis=0)
+
+    # linear filter: one matrix product for all acquisitions
+    else:
+        if weight is None:
+            weight = get_kernel_matrix(tbase, time_win=time_win, kernel=kernel)
+        ts_data_filt = np.dot(weight.astype(np.float32), ts_data)
+    return ts_data_filt
+
+
 ############################################################
 def main(iargs=None):
     inps = cmd_line_parse(iargs)
+    start_time = time.time()
 
-    # read timeseries info / data
+    # read timeseries info
     obj = timeseries(inps.timeseries_file)
     obj.open()
-
-    tbase = np.array(obj.yearList, np.float32).reshape(-1, 1)
+    tbase = np.array(obj.yearList, np.float32)
     tbase -= tbase[obj.refIndex]
 
-    ts_data = obj.read().reshape(obj.numDate, -1)
-
-    # Smooth acquisitions / moving window in time one by one
-    print('-'*50)
-    print('filtering in time Gaussian window with size of {:.1f} years'.format(inps.time_win))
-    ts_data_filt = np.zeros(ts_data.shape, np.float32)
-    prog_bar = ptime.progressBar(maxValue=obj.numDate)
-    for i in range(obj.numDate):
-        # Weight from Gaussian (normal) distribution in time
-        tbase_diff = tbase[i] - tbase
-        weight = np.exp(-0.5 * (tbase_diff**2) / (inps.time_win**2))
-        weight /= np.sum(weight)
-        # Smooth the current acquisition
-        ts_data_filt[i, :] = np.sum(ts_data * weight, axis=0)
-        prog_bar.update(i+1, suffix=obj.dateList[i])
-    prog_bar.close()
-    del ts_data
-    ts_data_filt -= ts_data_filt[obj.refIndex, :]
-    ts_data_filt = np.reshape(ts_data_filt, (obj.numDate, obj.length, obj.width))
-
-    # write filtered timeseries file
+    # prepare output file
     if not inps.outfile:
-        inps.outfile = '{}_tempGaussian.h5'.format(os.path.splitext(inps.timeseries_file)[0])
-    obj_out = timeseries(inps.outfile)
-    obj_out.write2hdf5(ts_data_filt, refFile=inps.timeseries_file)
+        suffix = 'temp{}'.format(inps.kernel.capitalize())
+        inps.outfile = '{}_{}.h5'.format(os.path.splitext(inps.timeseries_file)[0], suffix)
+    dsNameDict = {'date'      : [np.string_, (obj.numDate,), np.array(obj.dateList, np.string_)],
+                  'bperp'     : [np.float32, (obj.numDate,), obj.pbase],
+                  'timeseries': [np.float32, (obj.numDate, obj.length, obj.width)]}
+    writefile.layout_hdf5(inps.outfile, dsNameDict, metadata=dict(obj.metadata))
+
+    # Smooth acquisitions / moving window in time block by block
+    print('-'*50)
+    print('filtering in time {} window with size of {:.1f} years'.format(inps.kernel, inps.time_win))
+    weight = None
+    if inps.kernel != 'median':
+        weight = get_kernel_matrix(tbase, time_win=inps.time_win, kernel=inps.kernel)
+
+    box_list = split2boxes(dataset_shape=(obj.numDate, obj.length, obj.width), chunk_size=inps.chunk_size)
+    for box in box_list:
+        ts_data = obj.read(box=box, print_msg=False).reshape(obj.numDate, -1)
+        ts_data_filt = filter_timeseries(ts_data, tbase,
+                                         time_win=inps.time_win,
+                                         kernel=inps.kernel,
+                                         weight=weight)
+        del ts_data
+        ts_data_filt -= ts_data_filt[obj.refIndex, :]
+
+        block = [0, obj.numDate, box[1], box[3], box[0], box[2]]
+        writefile.write_hdf5_block(inps.outfile, ts_data_filt, 'timeseries', block=block)
+        del ts_data_filt
+
+    m, s = divmod(time.time()-start_time, 60)
+    print('time used: {:02.0f} mins {:02.1f} secs.'.format(m, s))
     return inps.outfile
 
 
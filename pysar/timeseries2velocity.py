@@ -11,6 +11,7 @@ import argparse
 import numpy as np
 from pysar.objects import timeseries, giantTimeseries, HDFEOS
 from pysar.utils import readfile, writefile, ptime, utils as ut
+from pysar.ifgram_inversion import split2boxes
 
 dataType = np.float32
 # key configuration parameter name
@@ -65,6 +66,9 @@ def create_parser():
                         help='template file with the following items:'+TEMPLATE)
     parser.add_argument('-o', '--output', dest='outfile',
                         help='output file name')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data (= num_date * num_row * num_col) to read per loop\n' +
+                             'default: 100e6; adjust it according to your computer memory.')
     parser.add_argument('--update', dest='update_mode', action='store_true',
                         help='Enable update mode, and skip estimation if:\n'+
                              '1) output velocity file already exists, readable '+
@@ -218,26 +222,20 @@ def read_date_info(inps):
 
 
 def estimate_linear_velocity(inps):
-    # read time-series data
-    print('reading data from file {} ...'.format(inps.timeseries_file))
-    ts_data, atr = readfile.read(inps.timeseries_file)
-    ts_data = ts_data[inps.dropDate, :, :].reshape(inps.numDate, -1)
-    if atr['UNIT'] == 'mm':
-        ts_data *= 1./1000.
+    """Estimate linear velocity and its std from time-series, block by block in rows
+    to keep memory usage under inps.chunk_size, with results written into the output file per block.
+    """
+    atr = readfile.read_attribute(inps.timeseries_file)
     length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+    num_date_all = inps.dropDate.size
+    scale = 1./1000. if atr['UNIT'] == 'mm' else 1.
 
     # The following is equivalent
     # X = scipy.linalg.lstsq(A, ts_data, cond=1e-15)[0]
     # It is not used because it can not handle NaN value in ts_data
     A = timeseries.get_design_matrix4average_velocity(inps.dateList)
-    X = np.dot(np.linalg.pinv(A), ts_data)
-    vel = np.array(X[0, :].reshape(length, width), dtype=dataType)
-
-    # velocity STD (Eq. (10), Fattahi and Amelung, 2015)
-    ts_diff = ts_data - np.dot(A, X)
+    A_inv = np.linalg.pinv(A)
     t_diff = A[:, 0] - np.mean(A[:, 0])
-    vel_std = np.sqrt(np.sum(ts_diff ** 2, axis=0) / np.sum(t_diff ** 2)  / (inps.numDate - 2))
-    vel_std = np.array(vel_std.reshape(length, width), dtype=dataType)
 
     # prepare attributes
     atr['FILE_TYPE'] = 'velocity'
@@ -250,11 +248,38 @@ def estimate_linear_velocity(inps):
     for key in configKeys:
         atr[key_prefix+key] = str(vars(inps)[key])
 
-    # write to HDF5 file
-    dsDict = dict()
-    dsDict['velocity'] = vel
-    dsDict['velocityStd'] = vel_std
-    writefile.write(dsDict, out_file=inps.outfile, metadata=atr)
+    # prepare output file
+    dsNameDict = {'velocity'    : [dataType, (length, width)],
+                  'velocityStd' : [dataType, (length, width)]}
+    writefile.layout_hdf5(inps.outfile, dsNameDict, metadata=atr)
+
+    box_list = split2boxes(dataset_shape=(num_date_all, length, width), chunk_size=inps.chunk_size)
+    num_box = len(box_list)
+    for i, box in enumerate(box_list):
+        if num_box > 1:
+            print('\n------- Processing Patch {} out of {} --------------'.format(i+1, num_box))
+
+        # read time-series data
+        print('reading data from file {} in {} ...'.format(inps.timeseries_file, box))
+        ts_data = readfile.read(inps.timeseries_file, box=box, print_msg=False)[0]
+        ts_data = ts_data.reshape(num_date_all, -1)[inps.dropDate, :]
+        if scale != 1.:
+            ts_data *= scale
+
+        X = np.dot(A_inv, ts_data)
+        vel = np.array(X[0, :], dtype=dataType)
+
+        # velocity STD (Eq. (10), Fattahi and Amelung, 2015)
+        ts_diff = ts_data - np.dot(A, X)
+        vel_std = np.sqrt(np.sum(ts_diff ** 2, axis=0) / np.sum(t_diff ** 2)  / (inps.numDate - 2))
+        vel_std = np.array(vel_std, dtype=dataType)
+        del ts_data, ts_diff, X
+
+        # write the block into output file
+        block = [box[1], box[3], box[0], box[2]]
+        writefile.write_hdf5_block(inps.outfile, vel, 'velocity', block=block)
+        writefile.write_hdf5_block(inps.outfile, vel_std, 'velocityStd', block=block)
+    print('finished writing to file: {}'.format(inps.outfile))
     return inps.outfile
 
 
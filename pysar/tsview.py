@@ -8,6 +8,7 @@
 
 import os
 import argparse
+from contextlib import ExitStack
 import numpy as np
 import scipy.stats as stats
 import matplotlib.pyplot as plt
@@ -19,6 +20,12 @@ from pysar.multilook import multilook_data
 from pysar import subset, view
 
 
+# turn on lazy mode for time-series larger than this number of values, i.e. 1.6 GB in float32
+LAZY_MIN_DATA_SIZE = 4e8
+# max number of rows/columns of the multilooked image displayed in lazy mode
+LAZY_MAX_IMAGE_SIZE = 1500
+
+
 ###########################################################################################
 EXAMPLE = """example:
   tsview.py timeseries.h5
@@ -30,6 +37,9 @@ EXAMPLE = """example:
   # multiple time-series files
   tsview.py timeseries_ECMWF_ramp_demErr.h5 timeseries_ECMWF_ramp.h5 timeseries_ECMWF.h5 timeseries.h5 --off 5
   tsview.py timeseries_ECMWF_ramp_demErr.h5 ../GIANT/Stack/LS-PARAMS.h5 --off 5 --label pysar giant
+
+  # lazy mode for large time-series: read one multilooked image and the clicked pixel only
+  tsview.py timeseries_ECMWF_ramp_demErr.h5 --lazy
 """
 
 
@@ -76,6 +86,11 @@ def create_parser():
     parser.add_argument('--off','--offset', dest='offset', type=float,
                         help='Offset for each timeseries file.')
 
+    parser.add_argument('--lazy', dest='lazy', action='store_true',
+                        help='Lazy mode for large time-series: read one multilooked image for the map\n'
+                             'and the time-series of the clicked pixel only, with flat memory usage.\n'
+                             'Turned on automatically for data larger than {:.0e} values.'.format(LAZY_MIN_DATA_SIZE))
+
     parser.add_argument('--noverbose', dest='print_msg', action='store_false',
                         help='Disable the verbose message printing.')
 
@@ -215,6 +230,19 @@ def read_init_info(inps):
     vprint('subset coverage in lat/lon: '+str(inps.geo_box))
     vprint('------------------------------------------------------------------------')
 
+    # lazy mode for large time-series
+    box_len = inps.pix_box[3] - inps.pix_box[1]
+    box_wid = inps.pix_box[2] - inps.pix_box[0]
+    if not inps.lazy and inps.num_date * box_len * box_wid > LAZY_MIN_DATA_SIZE:
+        inps.lazy = True
+        vprint('turn ON lazy mode for time-series with {} values'.format(inps.num_date * box_len * box_wid))
+    if inps.lazy and inps.multilook and inps.multilook_num == 1:
+        # in power of 2, to read from the overview pyramid if available, check add_overview.py
+        ratio = max(box_len, box_wid) / LAZY_MAX_IMAGE_SIZE
+        inps.multilook_num = int(2**np.ceil(np.log2(ratio))) if ratio > 1 else 1
+    if inps.lazy:
+        vprint('lazy mode: display image multilooked by {}'.format(inps.multilook_num))
+
     # reference pixel
     if not inps.ref_lalo and 'REF_LAT' in atr.keys():
         inps.ref_lalo = (float(atr['REF_LAT']), float(atr['REF_LON']))
@@ -358,6 +386,112 @@ def read_timeseries_data(inps):
     return ts_data, mask, inps
 
 
+def read_timeseries_lazy(inps):
+    """Prepare lazy reading of time-series files, without reading the 3D data
+    Parameters: inps : Namespace of input arguments
+    Returns:    mask : 2D np.array in size of (length, width)
+                inps : Namespace of input arguments, with the following info for reading:
+                       ref_ts_list   : list of 1D np.array, time-series on the reference pixel
+                       unit_fac_list : list of float, scale factor to the display unit
+                       ref_img       : 2D np.array, multilooked image on the reference date
+                       ts_obj_list   : list of timeseries objects in reader mode, or None
+                       ts_file_stack : ExitStack of the opened timeseries files, to close them
+    """
+    inps.ref_ts_list = []
+    inps.unit_fac_list = []
+    inps.ts_obj_list = []
+    with ExitStack() as stack:
+        for fname in inps.timeseries_file:
+            atr = readfile.read_attribute(fname)
+            # keep timeseries files open in reader mode for the repeated point reads
+            if atr['FILE_TYPE'] == 'timeseries':
+                inps.ts_obj_list.append(stack.enter_context(timeseries(fname)))
+            else:
+                inps.ts_obj_list.append(None)
+            inps.unit_fac_list.append(pp.scale_data2disp_unit(metadata=atr, disp_unit=inps.disp_unit)[2])
+            try:
+                ref_box = (inps.ref_yx[1], inps.ref_yx[0], inps.ref_yx[1]+1, inps.ref_yx[0]+1)
+                ref_ts = readfile.read(fname, datasetName=inps.date_list, box=ref_box, print_msg=False)[0]
+                inps.ref_ts_list.append(np.array(ref_ts, np.float32).reshape(-1))
+            except:
+                inps.ref_ts_list.append(None)
+        vprint('reference to pixel: {}'.format(inps.ref_yx))
+        vprint('reference to date: {}'.format(inps.date_list[inps.ref_idx]))
+
+        # Mask file: input mask file - ref_point
+        mask = np.ones((inps.pix_box[3] - inps.pix_box[1],
+                        inps.pix_box[2] - inps.pix_box[0]), np.bool_)
+        msk = pp.read_mask(inps.timeseries_file[0],
+                           mask_file=inps.mask_file,
+                           datasetName='displacement',
+                           box=inps.pix_box,
+                           print_msg=inps.print_msg)[0]
+        if msk is not None:
+            mask[msk == 0.] = False
+        del msk
+        try:
+            mask[inps.ref_yx[0]-inps.pix_box[1],
+                 inps.ref_yx[1]-inps.pix_box[0]] = True
+        except:
+            pass
+
+        # image on the reference date, read once
+        inps.ref_img = None
+        inps.ref_img = read_timeseries_image(inps, inps.ref_idx)
+
+        # default d/vlim from the initial image; ylim is auto-scaled for each pixel
+        img = read_timeseries_image(inps, inps.init_idx)
+        inps.dlim = [np.nanmin(img), np.nanmax(img)]
+        if not inps.vlim:
+            inps.vlim = list(inps.dlim)
+        vprint('display range: {} {}'.format(inps.vlim, inps.disp_unit))
+
+        # all reads succeeded, keep the files open after this function
+        inps.ts_file_stack = stack.pop_all()
+    return mask, inps
+
+
+def read_timeseries_image(inps, idx):
+    """Read one image of the 1st time-series file for the map in lazy mode,
+    referenced in space and time, scaled to display unit and multilooked,
+    from the overview pyramid if available.
+    """
+    data = readfile.read(inps.timeseries_file[0],
+                         datasetName=inps.date_list[idx],
+                         box=inps.pix_box,
+                         print_msg=False,
+                         multilook_num=inps.multilook_num)[0]
+    data = np.array(data, np.float32)
+
+    ref_ts = inps.ref_ts_list[0]
+    if ref_ts is not None:
+        data -= ref_ts[idx]
+    data *= inps.unit_fac_list[0]
+    if inps.ref_img is not None:
+        data -= inps.ref_img
+    return data
+
+
+def read_point_timeseries_lazy(inps, yx):
+    """Read time-series on pixel [y, x] from all files in lazy mode, referenced and scaled.
+    Returns:    ts_list : list of 1D np.array in size of (num_date,)
+    """
+    box = (yx[1], yx[0], yx[1]+1, yx[0]+1)
+    ts_list = []
+    for i, fname in enumerate(inps.timeseries_file):
+        if inps.ts_obj_list[i] is not None:
+            d_ts = inps.ts_obj_list[i].read(datasetName=inps.date_list, box=box, print_msg=False)
+        else:
+            d_ts = readfile.read(fname, datasetName=inps.date_list, box=box, print_msg=False)[0]
+        d_ts = np.array(d_ts, np.float32).reshape(-1)
+        if inps.ref_ts_list[i] is not None:
+            d_ts -= inps.ref_ts_list[i]
+        d_ts -= d_ts[inps.ref_idx]
+        d_ts *= inps.unit_fac_list[i]
+        ts_list.append(d_ts)
+    return ts_list
+
+
 def plot_ts_errorbar(ax, dis_ts, inps, ppar):
     dates = np.array(inps.dates)
     d_ts = dis_ts[:]
@@ -532,40 +666,79 @@ class timeseriesViewer():
 
 
     def plot(self):
-        # read 3D time-series
-        self.ts_data, self.mask = read_timeseries_data(self)[0:2]
-
-        # Figure 1 - Cumulative Displacement Map
-        self.fig_img = plt.figure(self.figname_img, figsize=self.figsize_img)
-
-        # Figure 1 - Axes 1 - Displacement Map
-        self.ax_img = self.fig_img.add_axes([0.125, 0.25, 0.75, 0.65])
-        img_data = np.array(self.ts_data[0][self.init_idx, :, :])
-        img_data[self.mask == 0] = np.nan
-        self.plot_init_image(img_data)
-
-        # Figure 1 - Axes 2 - Time Slider
-        self.ax_tslider = self.fig_img.add_axes([0.2, 0.1, 0.6, 0.07])
-        self.plot_init_time_slider(init_idx=self.init_idx, ref_idx=self.ref_idx)
-        self.tslider.on_changed(self.update_time_slider)
-
-        # Figure 2 - Time Series Displacement - Point
-        self.fig_pts, self.ax_pts = plt.subplots(num=self.figname_pts, figsize=self.figsize_pts)
-        if self.yx:
-            d_ts = self.plot_point_timeseries(self.yx)
-
-        # Output
-        if self.save_fig:
-            save_ts_plot(self.yx, self.fig_img, self.fig_pts, d_ts, self)
-
-        # Final linking of the canvas to the plots.
-        self.cid = self.fig_img.canvas.mpl_connect('button_press_event', self.update_plot_timeseries)
+        # read 3D time-series, or prepare reading on demand in lazy mode
+        if self.lazy:
+            self.ts_data = None
+            self.mask = read_timeseries_lazy(self)[0]
+            if self.multilook_num > 1:
+                self.mask_img = multilook_data(self.mask.astype(np.float32),
+                                               self.multilook_num,
+                                               self.multilook_num) >= 0.5
+            else:
+                self.mask_img = self.mask
+        else:
+            self.ts_data, self.mask = read_timeseries_data(self)[0:2]
+            self.mask_img = self.mask
+
+        try:
+            # Figure 1 - Cumulative Displacement Map
+            self.fig_img = plt.figure(self.figname_img, figsize=self.figsize_img)
+
+            # Figure 1 - Axes 1 - Displacement Map
+            self.ax_img = self.fig_img.add_axes([0.125, 0.25, 0.75, 0.65])
+            img_data = self.read_image(self.init_idx)
+            self.plot_init_image(img_data)
+
+            # Figure 1 - Axes 2 - Time Slider
+            self.ax_tslider = self.fig_img.add_axes([0.2, 0.1, 0.6, 0.07])
+            self.plot_init_time_slider(init_idx=self.init_idx, ref_idx=self.ref_idx)
+            self.tslider.on_changed(self.update_time_slider)
+
+            # Figure 2 - Time Series Displacement - Point
+            self.fig_pts, self.ax_pts = plt.subplots(num=self.figname_pts, figsize=self.figsize_pts)
+            if self.yx:
+                d_ts = self.plot_point_timeseries(self.yx)
+
+            # Output
+            if self.save_fig:
+                save_ts_plot(self.yx, self.fig_img, self.fig_pts, d_ts, self)
+
+            # Final linking of the canvas to the plots.
+            self.cid = self.fig_img.canvas.mpl_connect('button_press_event', self.update_plot_timeseries)
+        except BaseException:
+            # close the files opened for lazy reading, as close_event will not come
+            self.close_files()
+            raise
+
+        if self.lazy:
+            self.fig_img.canvas.mpl_connect('close_event', self.close_files)
         if self.disp_fig:
             vprint('showing ...')
             plt.show()
+        elif self.lazy:
+            self.close_files()
+        return
+
+
+    def close_files(self, event=None):
+        """Close the timeseries files opened in reader mode for lazy reading"""
+        if getattr(self, 'ts_file_stack', None) is not None:
+            self.ts_file_stack.close()
+            self.ts_file_stack = None
+        self.ts_obj_list = [None] * len(getattr(self, 'ts_obj_list', []))
         return
 
 
+    def read_image(self, idx):
+        """Read the displacement map of the idx-th date, masked"""
+        if self.lazy:
+            img_data = read_timeseries_image(self, idx)
+        else:
+            img_data = np.array(self.ts_data[0][idx, :, :])
+        img_data[self.mask_img == 0] = np.nan
+        return img_data
+
+
     def plot_init_image(self, img_data):
         # prepare data
         if self.wrap:
@@ -634,8 +807,7 @@ class timeseriesViewer():
         disp_date = self.dates[idx].strftime('%Y-%m-%d')
         self.ax_img.set_title('N = {n}, Time = {t}'.format(n=idx, t=disp_date), fontsize=self.font_size)
         # read data
-        data_img = np.array(self.ts_data[0][idx, :, :])
-        data_img[self.mask == 0] = np.nan
+        data_img = self.read_image(idx)
         if self.wrap:
             if self.disp_unit_img == 'radian':
                 data_img *= self.range2phase
@@ -654,7 +826,7 @@ class timeseriesViewer():
         self.ax_pts.cla()
 
         # plot scatter in different size for different files
-        num_file = len(self.ts_data)
+        num_file = len(self.timeseries_file)
         if   num_file <= 2: ms_step = 4
         elif num_file == 3: ms_step = 3
         elif num_file == 4: ms_step = 2
@@ -663,9 +835,14 @@ class timeseriesViewer():
         d_ts = []
         y = yx[0] - self.pix_box[1]
         x = yx[1] - self.pix_box[0]
+        if self.lazy:
+            ts_list = read_point_timeseries_lazy(self, yx)
         for i in range(num_file-1, -1, -1):
             # get displacement data
-            d_tsi = self.ts_data[i][:, y, x]
+            if self.lazy:
+                d_tsi = ts_list[i]
+            else:
+                d_tsi = self.ts_data[i][:, y, x]
             if self.zero_first:
                 d_tsi -= d_tsi[self.zero_idx]
             d_ts.append(d_tsi)
@@ -698,7 +875,7 @@ class timeseriesViewer():
             self.ax_pts.yaxis.set_label_position("right")
 
         # legend
-        if len(self.ts_data) > 1:
+        if num_file > 1:
             self.ax_pts.legend()
 
         self.fig_pts.canvas.draw()
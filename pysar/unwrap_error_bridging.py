@@ -9,6 +9,8 @@
 import os
 import time
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import h5py
 import numpy as np
 from pysar.objects import ifgramStack
@@ -31,6 +33,7 @@ EXAMPLE = """Example:
   unwrap_error_bridging.py  ./INPUTS/ifgramStack.h5  -t GalapagosSenDT128.template --update
   unwrap_error_bridging.py  ./INPUTS/ifgramStack.h5  --water-mask waterMask.h5
   unwrap_error_bridging.py  20180502_20180619.unw    --water-mask waterMask.h5
+  unwrap_error_bridging.py  ./INPUTS/ifgramStack.h5  --water-mask waterMask.h5 --num-worker 8
 """
 
 REFERENCE = """Reference:
@@ -51,6 +54,7 @@ pysar.unwrapError.method          = auto  #[bridging / phase_closure / no], auto
 pysar.unwrapError.ramp            = auto  #[linear / quadratic], auto for linear
 pysar.unwrapError.waterMaskFile   = auto  #[waterMask.h5 / no], auto for no
 pysar.unwrapError.bridgePtsRadius = auto  #[1-inf], auto for 150, radius in pixel of circular area around bridge ends
+pysar.unwrapError.numWorker       = auto  #[int > 0], auto for 1, number of processes to correct interferograms
 """
 
 def create_parser():
@@ -73,6 +77,9 @@ def create_parser():
                         help='name of dataset to be corrected, default: unwrapPhase')
     parser.add_argument('-o','--out-dataset', dest='datasetNameOut',
                         help='name of dataset to be written after correction, default: {}_bridging')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of processes to correct interferograms in parallel, default: 1.\n'
+                             'Interferograms are read and written by the main process only.')
     parser.add_argument('--update', dest='update_mode', action='store_true',
                         help='Enable update mode: if unwrapPhase_unwCor dataset exists, skip the correction.')
     return parser
@@ -98,6 +105,8 @@ def cmd_line_parse(iargs=None):
     if inps.waterMaskFile and not os.path.isfile(inps.waterMaskFile):
         inps.waterMaskFile = None
 
+    inps.numWorker = max(1, min(inps.numWorker, multiprocessing.cpu_count()))
+
     return inps
 
 
@@ -118,7 +127,7 @@ def read_template2inps(template_file, inps=None):
         elif value:
             if key in ['waterMaskFile', 'ramp']:
                 inpsDict[key] = value
-            elif key in ['bridgePtsRadius']:
+            elif key in ['bridgePtsRadius', 'numWorker']:
                 inpsDict[key] = int(value)
     return inps
 
@@ -172,9 +181,28 @@ def run_or_skip(inps):
 
 
 ##########################################################################################
+def bridge_unwrap_error(unw, cc, metadata, water_mask=None, ramp_type=None):
+    """Correct unwrapping error of one interferogram by bridging its connected components
+    Parameters: unw        : 2D np.ndarray in float32, unwrap phase
+                cc         : 2D np.ndarray, connected components
+                metadata   : dict, attributes
+                water_mask : 2D np.ndarray in bool, water mask
+                ramp_type  : str, name of phase ramp to be removed during the phase jump estimation
+    Returns:    unw_cor    : 2D np.ndarray in float32, unwrap phase after correction
+    """
+    if water_mask is not None:
+        cc[water_mask == 0] = 0
+
+    cc_obj = connectComponent(conncomp=cc, metadata=metadata)
+    cc_obj.label()
+    cc_obj.find_mst_bridge()
+    unw_cor = cc_obj.unwrap_conn_comp(unw, ramp_type=ramp_type)
+    return unw_cor
+
+
 def run_unwrap_error_bridge(ifgram_file, water_mask_file, ramp_type=None, radius=50, 
                             ccName='connectComponent', dsNameIn='unwrapPhase',
-                            dsNameOut='unwrapPhase_bridging'):
+                            dsNameOut='unwrapPhase_bridging', num_worker=1):
     """Run unwrapping error correction with bridging
     Parameters: ifgram_file     : str, path of ifgram stack file
                 water_mask_file : str, path of water mask file
@@ -182,6 +210,8 @@ def run_unwrap_error_bridge(ifgram_file, water_mask_file, ramp_type=None, radius
                 ccName          : str, dataset name of connected components
                 dsNameIn        : str, dataset name of unwrap phase to be corrected
                 dsNameOut       : str, dataset name of unwrap phase to be saved after correction
+                num_worker      : int, number of processes to correct interferograms in parallel,
+                                  while reading/writing stays in the main process with the r+ file handle
     Returns:    ifgram_file     : str, path of ifgram stack file
     """
     print('-'*50)
@@ -219,29 +249,52 @@ def run_unwrap_error_bridge(ifgram_file, water_mask_file, ramp_type=None, radius
             ds = f.create_dataset(dsNameOut,
                                   shape_out,
                                   maxshape=(None, None, None),
-                                  chunks=True,
+                                  chunks=f[dsNameIn].chunks or True,
                                   compression=None)
             print('create /{d} of np.float32 in size of {s}'.format(d=dsNameOut, s=shape_out))
 
+        executor = None
+        futures = []
+        if num_worker > 1:
+            print('correct interferograms with {} processes in parallel'.format(num_worker))
+            # spawn instead of fork, which is not safe while other threads are doing HDF5 I/O
+            executor = ProcessPoolExecutor(max_workers=num_worker,
+                                           mp_context=multiprocessing.get_context('spawn'))
+
+        def write_ifgram(i, unw_cor):
+            ds[i, :, :] = unw_cor
+            prog_bar.update(i+1, suffix=date12_list[i])
+
         # correct unwrap error ifgram by ifgram
         prog_bar = ptime.progressBar(maxValue=num_ifgram)
-        for i in range(num_ifgram):
-            # read unwrapPhase and connectComponent
-            date12 = date12_list[i]
-            unw = np.squeeze(f[dsNameIn][i, :, :])
-            cc = np.squeeze(f[ccName][i, :, :])
-            if water_mask is not None:
-                cc[water_mask == 0] = 0
-
-            # bridging
-            cc_obj = connectComponent(conncomp=cc, metadata=atr)
-            cc_obj.label()
-            cc_obj.find_mst_bridge()
-            unw_cor = cc_obj.unwrap_conn_comp(unw, ramp_type=ramp_type)
-
-            # write to hdf5 file
-            ds[i, :, :] = unw_cor
-            prog_bar.update(i+1, suffix=date12)
+        try:
+            for i in range(num_ifgram):
+                # read unwrapPhase and connectComponent
+                unw = np.squeeze(f[dsNameIn][i, :, :])
+                cc = np.squeeze(f[ccName][i, :, :])
+
+                # bridging
+                args = (unw, cc, atr, water_mask, ramp_type)
+                if executor is None:
+                    write_ifgram(i, bridge_unwrap_error(*args))
+                else:
+                    # limit the number of interferograms in memory, write in order
+                    if len(futures) >= 2 * num_worker:
+                        j, future = futures.pop(0)
+                        write_ifgram(j, future.result())
+                    futures.append((i, executor.submit(bridge_unwrap_error, *args)))
+
+            for j, future in futures:
+                write_ifgram(j, future.result())
+        except Exception:
+            f.close()
+            raise
+        finally:
+            # stop the worker processes on error too
+            if executor is not None:
+                for j, future in futures:
+                    future.cancel()
+                executor.shutdown()
         prog_bar.close()
         ds.attrs['MODIFICATION_TIME'] = str(time.time())
         f.close()
@@ -257,14 +310,9 @@ def run_unwrap_error_bridge(ifgram_file, water_mask_file, ramp_type=None, radius
         if len(cc_files) == 0:
             raise FileNotFoundError(cc_files0)
         cc = readfile.read(cc_files[0])[0]
-        if water_mask is not None:
-            cc[water_mask == 0] = 0
 
         # bridging
-        cc_obj = connectComponent(conncomp=cc, metadata=atr)
-        cc_obj.label()
-        cc_obj.find_mst_bridge()
-        unw_cor = cc_obj.unwrap_conn_comp(unw, ramp_type=ramp_type)
+        unw_cor = bridge_unwrap_error(unw, cc, atr, water_mask=water_mask, ramp_type=ramp_type)
 
         # write to hdf5 file
         out_file = '{}_unwCor{}'.format(os.path.splitext(ifgram_file)[0],
@@ -291,7 +339,8 @@ def main(iargs=None):
                             ramp_type=inps.ramp,
                             radius=inps.bridgePtsRadius,
                             dsNameIn=inps.datasetNameIn,
-                            dsNameOut=inps.datasetNameOut)
+                            dsNameOut=inps.datasetNameOut,
+                            num_worker=inps.numWorker)
 
     # config parameter
     if os.path.splitext(inps.ifgram_file)[1] in ['.h5', '.he5']:
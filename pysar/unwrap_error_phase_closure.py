@@ -9,6 +9,8 @@
 import os
 import argparse
 import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import h5py
 import numpy as np
 import matplotlib.pyplot as plt
@@ -25,7 +27,6 @@ from pysar.objects import ifgramStack
 from pysar.objects.conncomp import connectComponent
 from pysar.utils import ptime, readfile, utils as ut, plot as pp
 from pysar.utils.solvers import l1regls
-from pysar import ifgram_inversion as ifginv
 
 
 key_prefix = 'pysar.unwrapError.'
@@ -34,11 +35,14 @@ key_prefix = 'pysar.unwrapError.'
 EXAMPLE = """Example:
   unwrap_error_phase_closure.py  ./INPUTS/ifgramStack.h5  maskConnComp.h5  -t pysarApp_template.txt  --update
   unwrap_error_phase_closure.py  ./INPUTS/ifgramStack.h5  maskConnComp.h5  --water-mask waterMask.h5 --update
+  unwrap_error_phase_closure.py  ./INPUTS/ifgramStack.h5  maskConnComp.h5  --num-worker 8
 """
 
 TEMPLATE = """
 ## Unwrapping Error Correction based on Phase Closure (Yunjun et al., 2019)
 pysar.unwrapError.waterMaskFile   = auto  #[waterMask.h5 / no], auto for no
+pysar.unwrapError.numWorker       = auto  #[int > 0], auto for 1, number of processes to solve the integer ambiguity
+                                          #and to correct interferograms
 """
 
 REFERENCE = """Reference:
@@ -73,6 +77,10 @@ def create_parser():
     parser.add_argument('--water-mask','--wm', dest='waterMaskFile', type=str, help='path of water mask file.')
     parser.add_argument('-t', '--template', dest='template_file',
                         help='template file with options for setting.')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of processes to solve the integer ambiguity of sample pixels\n'
+                             'and to correct interferograms in parallel, default: 1.\n'
+                             'Interferograms are read and written by the main process only.')
     parser.add_argument('--update', dest='update_mode', action='store_true',
                         help='Enable update mode: if unwrapPhase_phaseClosure dataset exists, skip the correction.')
     return parser
@@ -101,6 +109,8 @@ def cmd_line_parse(iargs=None):
     if inps.waterMaskFile and not os.path.isfile(inps.waterMaskFile):
         inps.waterMaskFile = None
 
+    inps.numWorker = max(1, min(inps.numWorker, multiprocessing.cpu_count()))
+
     return inps
 
 
@@ -119,6 +129,8 @@ def read_template2inps(template_file, inps=None):
         if value:
             if key in ['waterMaskFile']:
                 inpsDict[key] = value
+            elif key in ['numWorker']:
+                inpsDict[key] = int(value)
     return inps
 
 
@@ -176,7 +188,8 @@ def write_hdf5_file_patch(ifgram_file, data, box=None, dsName='unwrapPhase_phase
         print('create '+msg)
         ds = f.create_dataset(dsName, (num_ifgram, num_row, num_col),
                               maxshape=(None, None, None),
-                              chunks=True, compression=None)
+                              chunks=f['unwrapPhase'].chunks or True,
+                              compression=None)
 
     # resize h5py.Dataset if current size is not enough
     if ds.shape != (num_ifgram, length, width):
@@ -191,14 +204,128 @@ def write_hdf5_file_patch(ifgram_file, data, box=None, dsName='unwrapPhase_phase
     return ifgram_file
 
 
+def read_unwrap_phase4samples(stack_obj, sample_coords, ref_phase, dsNameIn='unwrapPhase', dropIfgram=True,
+                              memory_size=200e6):
+    """Read the unwrap phase of sample pixels in one pass, block by block, with each block
+    in the size of the HDF5 chunk (capped by memory_size) read once for all samples within,
+    instead of one strided read across all interferograms per pixel.
+    Parameters: stack_obj     : ifgramStack object
+                sample_coords : 2D np.ndarray in size of (num_pixel, 2) for row/column number
+                ref_phase     : 1D np.ndarray in size of (num_ifgram,), reference phase
+                dsNameIn      : str, dataset name of the unwrap phase
+                dropIfgram    : bool, read kept interferograms only
+                memory_size   : float, max number of bytes to read per block
+    Returns:    unw           : 2D np.ndarray in size of (num_ifgram, num_pixel) in float32
+    """
+    ys = np.asarray(sample_coords[:, 0], dtype=int)
+    xs = np.asarray(sample_coords[:, 1], dtype=int)
+    flag = np.array(stack_obj.dropIfgram, np.bool_)
+    if not dropIfgram:
+        flag[:] = True
+    unw = np.zeros((np.sum(flag), ys.size), dtype=np.float32)
+
+    with h5py.File(stack_obj.file, 'r') as f:
+        ds = f[dsNameIn]
+        num_ifgram_all, length, width = ds.shape
+        block_y, block_x = ds.chunks[-2:] if ds.chunks else (128, 128)
+        while num_ifgram_all * block_y * block_x * 4 > memory_size and max(block_y, block_x) > 16:
+            if block_y >= block_x:
+                block_y = int(np.ceil(block_y / 2))
+            else:
+                block_x = int(np.ceil(block_x / 2))
+
+        # read blocks with sample pixels only
+        num_block_x = int(np.ceil(width / block_x))
+        block_ind = (ys // block_y) * num_block_x + xs // block_x
+        block_list = np.unique(block_ind)
+        print('reading {} of {} sample pixels in {} blocks of {}x{} ...'.format(dsNameIn, ys.size,
+                                                                                block_list.size,
+                                                                                block_y, block_x))
+        prog_bar = ptime.progressBar(maxValue=block_list.size)
+        for i, b in enumerate(block_list):
+            y0 = (b // num_block_x) * block_y
+            x0 = (b % num_block_x) * block_x
+            data = ds[:, y0:y0+block_y, x0:x0+block_x][flag]
+            idx = np.where(block_ind == b)[0]
+            unw[:, idx] = data[:, ys[idx]-y0, xs[idx]-x0]
+            prog_bar.update(i+1, every=10)
+        prog_bar.close()
+
+    # reference unwrapPhase, as ifgram_inversion.read_unwrap_phase()
+    for i in range(unw.shape[0]):
+        mask = unw[i, :] != 0.
+        unw[i, :][mask] -= ref_phase[i]
+    return unw
+
+
+def init_int_ambiguity_solver(C):
+    """Initialize worker process with the triplet design matrix, to avoid pickling it per sample."""
+    global triplet_design_matrix
+    triplet_design_matrix = matrix(C)
+
+
+def estimate_int_ambiguity(unw, C=None):
+    """Estimate the integer ambiguity of one pixel, based on the closure phase of interferogram triplets,
+    using the L1-norm regularized least squares approximation (LASSO).
+    Parameters: unw : 1D np.ndarray in size of (num_ifgram,), unwrap phase
+                C   : cvxopt.matrix in size of (num_triplet, num_ifgram), triplet design matrix,
+                      the one initialized by init_int_ambiguity_solver() if None
+    Returns:    U   : 1D np.ndarray in size of (num_ifgram,), integer ambiguity
+    """
+    if C is None:
+        C = triplet_design_matrix
+    # calculate closure_int
+    closure_pha = np.array(C * matrix(unw.reshape(-1, 1).astype(np.float64)))
+    closure_int = matrix(np.round((closure_pha - ut.wrap(closure_pha)) / (2.*np.pi)))
+
+    # solve for U
+    U = np.round(l1regls(-C, closure_int, alpha=1e-2, show_progress=0)).flatten()
+    return U
+
+
+def estimate_int_ambiguity4samples(unw, C, num_worker=1):
+    """Estimate the integer ambiguity of multiple pixels, in parallel with num_worker processes.
+    Parameters: unw : 2D np.ndarray in size of (num_ifgram, num_pixel), unwrap phase
+                C   : 2D np.ndarray in size of (num_triplet, num_ifgram), triplet design matrix
+                num_worker : int, number of processes
+    Returns:    U   : 2D np.ndarray in size of (num_ifgram, num_pixel), integer ambiguity
+    """
+    num_pixel = unw.shape[1]
+    U = np.zeros(unw.shape, dtype=np.float32)
+    if num_pixel == 0:
+        return U
+
+    if num_worker > 1:
+        print('solving with {} processes in parallel ...'.format(num_worker))
+        chunksize = max(1, num_pixel // (num_worker * 4))
+        # spawn instead of fork, which is not safe while other threads are doing HDF5 I/O
+        with ProcessPoolExecutor(max_workers=num_worker,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_int_ambiguity_solver,
+                                 initargs=(C,)) as executor:
+            for j, Uj in enumerate(executor.map(estimate_int_ambiguity,
+                                                [unw[:, j] for j in range(num_pixel)],
+                                                chunksize=chunksize)):
+                U[:, j] = Uj
+    else:
+        C = matrix(C)
+        prog_bar = ptime.progressBar(maxValue=num_pixel)
+        for j in range(num_pixel):
+            U[:, j] = estimate_int_ambiguity(unw[:, j], C)
+            prog_bar.update(j+1, every=5)
+        prog_bar.close()
+    return U
+
+
 def get_common_region_int_ambiguity(ifgram_file, cc_mask_file, water_mask_file=None, num_sample=100,
-                                    dsNameIn='unwrapPhase'):
+                                    dsNameIn='unwrapPhase', num_worker=1):
     """Solve the phase unwrapping integer ambiguity for the common regions among all interferograms
     Parameters: ifgram_file     : str, path of interferogram stack file
                 cc_mask_file    : str, path of common connected components file
                 water_mask_file : str, path of water mask file
                 num_sample      : int, number of pixel sampled for each region
                 dsNameIn        : str, dataset name of the unwrap phase to be corrected
+                num_worker      : int, number of processes to solve the integer ambiguity
     Returns:    common_regions  : list of skimage.measure._regionprops._RegionProperties object
                     modified by adding two more variables:
                     sample_coords : 2D np.ndarray in size of (num_sample, 2) in int64 format
@@ -211,7 +338,7 @@ def get_common_region_int_ambiguity(ifgram_file, cc_mask_file, water_mask_file=N
     stack_obj.open()
     date12_list = stack_obj.get_date12_list(dropIfgram=True)
     num_ifgram = len(date12_list)
-    C = matrix(ifgramStack.get_design_matrix4triplet(date12_list).astype(float))
+    C = ifgramStack.get_design_matrix4triplet(date12_list).astype(float)
     ref_phase = stack_obj.get_reference_phase(unwDatasetName=dsNameIn, dropIfgram=True).reshape(num_ifgram, -1)
 
     # prepare common label
@@ -226,42 +353,38 @@ def get_common_region_int_ambiguity(ifgram_file, cc_mask_file, water_mask_file=N
     common_regions = measure.regionprops(label_img)
     print('number of common regions:', num_label)
 
-    # add sample_coords / int_ambiguity
+    # add sample_coords
     print('number of samples per region:', num_sample)
+    ref_label = label_img[stack_obj.refY, stack_obj.refX]
+    for common_reg in common_regions:
+        idx = sorted(np.random.choice(common_reg.area, num_sample, replace=False))
+        common_reg.sample_coords = common_reg.coords[idx, :].astype(int)
+        if common_reg.label == ref_label:
+            print('skip calculation for the reference region: {}'.format(common_reg.label))
+
+    # read unwrap phase of samples in all non-reference regions
+    regions2solve = [i for i in common_regions if i.label != ref_label]
+    if regions2solve:
+        sample_coords = np.vstack([i.sample_coords for i in regions2solve])
+        unw = read_unwrap_phase4samples(stack_obj, sample_coords,
+                                        ref_phase=ref_phase.flatten(),
+                                        dsNameIn=dsNameIn,
+                                        dropIfgram=True)
+    else:
+        unw = np.zeros((num_ifgram, 0), dtype=np.float32)
+
+    # solve for int_ambiguity
     print('solving the phase-unwrapping integer ambiguity for {}'.format(dsNameIn))
     print('\tbased on the closure phase of interferograms triplets (Yunjun et al., 2019)')
     print('\tusing the L1-norm regularzed least squares approximation (LASSO) ...')
-    for i in range(num_label):
-        common_reg = common_regions[i]
-        # sample_coords
-        idx = sorted(np.random.choice(common_reg.area, num_sample, replace=False))
-        common_reg.sample_coords = common_reg.coords[idx, :].astype(int)
+    U_all = estimate_int_ambiguity4samples(unw, C, num_worker=num_worker)
 
-        # solve for int_ambiguity
+    # add int_ambiguity
+    for common_reg in common_regions:
         U = np.zeros((num_ifgram, num_sample))
-        if common_reg.label == label_img[stack_obj.refY, stack_obj.refX]:
-            print('{}/{} skip calculation for the reference region'.format(i+1, num_label))
-        else:
-            prog_bar = ptime.progressBar(maxValue=num_sample, prefix='{}/{}'.format(i+1, num_label))
-            for j in range(num_sample):
-                # read unwrap phase
-                y, x = common_reg.sample_coords[j, :]
-                unw = ifginv.read_unwrap_phase(stack_obj,
-                                               box=(x, y, x+1, y+1),
-                                               ref_phase=ref_phase,
-                                               unwDatasetName=dsNameIn,
-                                               dropIfgram=True,
-                                               print_msg=False).reshape(num_ifgram, -1)
-
-                # calculate closure_int
-                closure_pha = np.dot(C, unw)
-                closure_int = matrix(np.round((closure_pha - ut.wrap(closure_pha)) / (2.*np.pi)))
-
-                # solve for U
-                U[:,j] = np.round(l1regls(-C, closure_int, alpha=1e-2, show_progress=0)).flatten()
-                prog_bar.update(j+1, every=5)
-            prog_bar.close()
-        # add int_ambiguity
+        if common_reg.label != ref_label:
+            i = [j.label for j in regions2solve].index(common_reg.label)
+            U = U_all[:, i*num_sample:(i+1)*num_sample]
         common_reg.int_ambiguity = np.median(U, axis=1)
         common_reg.date12_list = date12_list
 
@@ -283,8 +406,54 @@ def get_common_region_int_ambiguity(ifgram_file, cc_mask_file, water_mask_file=N
     return common_regions
 
 
+def correct_unwrap_error_phase_closure(unw, cc, sample_coords_list, int_ambiguity, metadata, water_mask=None):
+    """Correct unwrapping error of one interferogram, by matching its local regions with the common regions
+    Parameters: unw                : 2D np.ndarray in float32, unwrap phase, referenced in space
+                cc                 : 2D np.ndarray, connected components
+                sample_coords_list : list of 2D np.ndarray in size of (num_sample, 2), sample pixels of common regions
+                int_ambiguity      : 1D np.ndarray in size of (num_common_region,),
+                                     integer ambiguity of common regions for this interferogram
+                metadata           : dict, attributes
+                water_mask         : 2D np.ndarray in bool, water mask
+    Returns:    unw_cor            : 2D np.ndarray in float32, unwrap phase after correction
+    """
+    unw_cor = np.array(unw, dtype=np.float32)
+
+    # get local region info from connectComponent
+    if water_mask is not None:
+        cc[water_mask == 0] = 0
+    cc_obj = connectComponent(conncomp=cc, metadata=metadata)
+    cc_obj.label()
+    local_regions = measure.regionprops(cc_obj.labelImg)
+
+    # matching regions and correct unwrap error
+    for local_reg in local_regions:
+        local_mask = cc_obj.labelImg == local_reg.label
+        U = 0
+        for sample_coords, Ui in zip(sample_coords_list, int_ambiguity):
+            y = sample_coords[:,0]
+            x = sample_coords[:,1]
+            if all(local_mask[y, x]):
+                U = Ui
+                break
+        unw_cor[local_mask] += 2. * np.pi * U
+    return unw_cor
+
+
+def init_phase_closure_corrector(sample_coords_list, metadata, water_mask=None):
+    """Initialize worker process with the common regions info, to avoid pickling it per interferogram."""
+    global common_region_info
+    common_region_info = (sample_coords_list, metadata, water_mask)
+
+
+def correct_unwrap_error_phase_closure4worker(unw, cc, int_ambiguity):
+    """correct_unwrap_error_phase_closure() with the info initialized by init_phase_closure_corrector()"""
+    sample_coords_list, metadata, water_mask = common_region_info
+    return correct_unwrap_error_phase_closure(unw, cc, sample_coords_list, int_ambiguity, metadata, water_mask)
+
+
 def run_unwrap_error_phase_closure(ifgram_file, common_regions, water_mask_file=None, ccName='connectComponent',
-                                   dsNameIn='unwrapPhase', dsNameOut='unwrapPhase_phaseClosure'):
+                                   dsNameIn='unwrapPhase', dsNameOut='unwrapPhase_phaseClosure', num_worker=1):
     print('-'*50)
     print('correct unwrapping error in {} with phase closure ...'.format(ifgram_file))
     stack_obj = ifgramStack(ifgram_file)
@@ -302,6 +471,11 @@ def run_unwrap_error_phase_closure(ifgram_file, common_regions, water_mask_file=
     else:
         water_mask = None
 
+    # common regions info to send to the workers
+    sample_coords_list = [i.sample_coords for i in common_regions]
+    int_ambiguity = np.vstack([i.int_ambiguity for i in common_regions]).T
+    common_date12_list = common_regions[0].date12_list
+
     # prepare output data writing
     print('open {} with r+ mode'.format(ifgram_file))
     f = h5py.File(ifgram_file, 'r+')
@@ -314,45 +488,64 @@ def run_unwrap_error_phase_closure(ifgram_file, common_regions, water_mask_file=
         ds = f.create_dataset(dsNameOut,
                               shape_out,
                               maxshape=(None, None, None),
-                              chunks=True,
+                              chunks=f[dsNameIn].chunks or True,
                               compression=None)
         print('create /{d} of np.float32 in size of {s}'.format(d=dsNameOut, s=shape_out))
 
+    executor = None
+    futures = []
+    if num_worker > 1:
+        print('correct interferograms with {} processes in parallel'.format(num_worker))
+        # spawn instead of fork, which is not safe while other threads are doing HDF5 I/O
+        executor = ProcessPoolExecutor(max_workers=num_worker,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=init_phase_closure_corrector,
+                                       initargs=(sample_coords_list, stack_obj.metadata, water_mask))
+
+    def write_ifgram(i, unw_cor):
+        ds[i, :, :] = unw_cor
+        prog_bar.update(i+1, suffix=date12_list[i])
+
     # correct unwrap error ifgram by ifgram
     prog_bar = ptime.progressBar(maxValue=num_ifgram)
-    for i in range(num_ifgram):
-        date12 = date12_list[i]
+    try:
+        for i in range(num_ifgram):
+            date12 = date12_list[i]
+
+            # read unwrap phase to be updated
+            unw_cor = np.squeeze(f[dsNameIn][i, :, :]).astype(np.float32)
+            unw_cor -= unw_cor[ref_y, ref_x]
 
-        # read unwrap phase to be updated
-        unw_cor = np.squeeze(f[dsNameIn][i, :, :]).astype(np.float32)
-        unw_cor -= unw_cor[ref_y, ref_x]
+            # update kept interferograms only
+            if not stack_obj.dropIfgram[i]:
+                write_ifgram(i, unw_cor)
+                continue
 
-        # update kept interferograms only
-        if stack_obj.dropIfgram[i]:
-            # get local region info from connectComponent
             cc = np.squeeze(f[ccName][i, :, :])
-            if water_mask is not None:
-                cc[water_mask == 0] = 0
-            cc_obj = connectComponent(conncomp=cc, metadata=stack_obj.metadata)
-            cc_obj.label()
-            local_regions = measure.regionprops(cc_obj.labelImg)
-
-            # matching regions and correct unwrap error
-            idx_common = common_regions[0].date12_list.index(date12)
-            for local_reg in local_regions:
-                local_mask = cc_obj.labelImg == local_reg.label
-                U = 0
-                for common_reg in common_regions:
-                    y = common_reg.sample_coords[:,0]
-                    x = common_reg.sample_coords[:,1]
-                    if all(local_mask[y, x]):
-                        U = common_reg.int_ambiguity[idx_common]
-                        break
-                unw_cor[local_mask] += 2. * np.pi * U
-
-        # write to hdf5 file
-        ds[i, :, :] = unw_cor
-        prog_bar.update(i+1, suffix=date12)
+            idx_common = common_date12_list.index(date12)
+            if executor is None:
+                write_ifgram(i, correct_unwrap_error_phase_closure(unw_cor, cc, sample_coords_list,
+                                                                   int_ambiguity[idx_common],
+                                                                   stack_obj.metadata, water_mask))
+            else:
+                # limit the number of interferograms in memory
+                if len(futures) >= 2 * num_worker:
+                    j, future = futures.pop(0)
+                    write_ifgram(j, future.result())
+                futures.append((i, executor.submit(correct_unwrap_error_phase_closure4worker,
+                                                   unw_cor, cc, int_ambiguity[idx_common])))
+
+        for j, future in futures:
+            write_ifgram(j, future.result())
+    except Exception:
+        f.close()
+        raise
+    finally:
+        # stop the worker processes on error too
+        if executor is not None:
+            for j, future in futures:
+                future.cancel()
+            executor.shutdown()
     prog_bar.close()
     ds.attrs['MODIFICATION_TIME'] = str(time.time())
     f.close()
@@ -373,12 +566,14 @@ def main(iargs=None):
                                                      cc_mask_file=inps.cc_mask_file,
                                                      water_mask_file=inps.waterMaskFile,
                                                      num_sample=100,
-                                                     dsNameIn=inps.datasetNameIn)
+                                                     dsNameIn=inps.datasetNameIn,
+                                                     num_worker=inps.numWorker)
 
     run_unwrap_error_phase_closure(inps.ifgram_file, common_regions,
                                    water_mask_file=inps.waterMaskFile,
                                    dsNameIn=inps.datasetNameIn,
-                                   dsNameOut=inps.datasetNameOut)
+                                   dsNameOut=inps.datasetNameOut,
+                                   num_worker=inps.numWorker)
 
     m, s = divmod(time.time()-start_time, 60)
     print('\ntime used: {:02.0f} mins {:02.1f} secs\nDone.'.format(m, s))
@@ -8,16 +8,9 @@
 
 
 import os
-import sys
 import itertools
 import h5py
 import numpy as np
-from scipy import sparse
-from matplotlib import (colors,
-                        dates as mdates,
-                        pyplot as plt)
-from matplotlib.tri import Triangulation
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 from pysar.objects import ifgramStack, sensor
 from pysar.utils import ptime, readfile
 
@@ -219,19 +212,19 @@ def calculate_doppler_overlap(dop_a, dop_b, bandwidth_az):
     """Calculate Overlap Percentage of Doppler frequency in azimuth direction
     Inputs:
         dop_a/b      : np.array of 3 floats, doppler frequency
+                       or 2D np.array in size of (num, 3) for multiple pairs
         bandwidth_az : float, azimuth bandwidth
     Output:
         dop_overlap  : float, doppler frequency overlap between a & b.
+                       or 1D np.array in size of (num,) for multiple pairs
     """
     # Calculate mean Doppler difference between a and b
     no_of_rangepix = 5000
-    ddiff = np.zeros(10)
-    for i in range(10):
-        rangepix = (i-1)*no_of_rangepix/10 + 1
-        da = dop_a[0]+(rangepix-1)*dop_a[1]+(rangepix-1)**2*dop_a[2]
-        db = dop_b[0]+(rangepix-1)*dop_b[1]+(rangepix-1)**2*dop_b[2]
-        ddiff[i] = abs(da - db)
-    ddiff_mean = np.mean(ddiff)
+    rangepix = (np.arange(10) - 1) * no_of_rangepix / 10 + 1
+    rangepix = np.vstack((np.ones(10), rangepix - 1, (rangepix - 1)**2))
+    da = np.dot(np.array(dop_a, np.float64), rangepix)
+    db = np.dot(np.array(dop_b, np.float64), rangepix)
+    ddiff_mean = np.mean(np.abs(da - db), axis=-1)
 
     #dopOverlap_prf = bandwidth_az - ddiff
     #dopOverlap_percent = np.mean(dopOverlap_prf / bandwidth_az * 100)
@@ -285,53 +278,41 @@ def simulate_coherence(date12_list, baseline_file='bl_list.txt', sensor_name='En
     bandwidth_az = sensor.azimuth_bandwidth(sensor_name)
 
     date12_list = ptime.yyyymmdd_date12(date12_list)
-    ifgram_num = len(date12_list)
 
-    if isinstance(decor_time, (int, float)):
-        pixel_num = 1
-        decor_time = float(decor_time)
+    # index of master/slave date for all pairs
+    date_idx = dict((d, i) for i, d in enumerate(date_list))
+    m_idx = np.array([date_idx[i.split('_')[0]] for i in date12_list], np.int64)
+    s_idx = np.array([date_idx[i.split('_')[1]] for i in date12_list], np.int64)
+    pbase = (np.array(pbase_list, np.float64)[s_idx] - np.array(pbase_list, np.float64)[m_idx]).reshape(-1, 1)
+    tbase = (np.array(tbase_list, np.float64)[s_idx] - np.array(tbase_list, np.float64)[m_idx]).reshape(-1, 1)
+
+    decor_time = np.array(decor_time, np.float64).reshape(1, -1)
+    decor_time[decor_time == 0.] = 0.01
+    coh_resid = np.array(coh_resid, np.float64).reshape(1, -1)
+
+    # Geometric decorrelation (Hanssen, 2001, Eq. 4.4.12)
+    coh_geom = np.maximum((pbase_c - np.abs(pbase)) / pbase_c, 0.)
+
+    # Doppler centroid decorrelation (Hanssen, 2001, Eq. 4.4.13)
+    if not dop_list:
+        coh_dc = 1.
     else:
-        pixel_num = decor_time.shape[1]
-    if decor_time == 0.:
-        decor_time = 0.01
-    cohs = np.zeros((ifgram_num, pixel_num), np.float32)
-    for i in range(ifgram_num):
-        if display:
-            sys.stdout.write('\rinterferogram = %4d/%4d' % (i, ifgram_num))
-            sys.stdout.flush()
-        m_date, s_date = date12_list[i].split('_')
-        m_idx = date_list.index(m_date)
-        s_idx = date_list.index(s_date)
-
-        pbase = pbase_list[s_idx] - pbase_list[m_idx]
-        tbase = tbase_list[s_idx] - tbase_list[m_idx]
-
-        # Geometric decorrelation (Hanssen, 2001, Eq. 4.4.12)
-        coh_geom = (pbase_c - abs(pbase)) / pbase_c
-        if coh_geom < 0.:
-            coh_geom = 0.
-
-        # Doppler centroid decorrelation (Hanssen, 2001, Eq. 4.4.13)
-        if not dop_list:
-            coh_dc = 1.
-        else:
-            coh_dc = calculate_doppler_overlap(dop_list[m_idx],
-                                               dop_list[s_idx],
-                                               bandwidth_az)
-            if coh_dc < 0.:
-                coh_dc = 0.
+        dop_list = np.array(dop_list, np.float64)
+        coh_dc = calculate_doppler_overlap(dop_list[m_idx, :],
+                                           dop_list[s_idx, :],
+                                           bandwidth_az)
+        coh_dc = np.maximum(coh_dc, 0.).reshape(-1, 1)
 
-        # Option 1: Temporal decorrelation - exponential delay model (Parizzi et al., 2009; Morishita and Hanssen, 2015)
-        coh_temp = np.multiply((coh_thermal - coh_resid), np.exp(-1*abs(tbase)/decor_time)) + coh_resid
+    # Option 1: Temporal decorrelation - exponential delay model (Parizzi et al., 2009; Morishita and Hanssen, 2015)
+    coh_temp = np.multiply((coh_thermal - coh_resid), np.exp(-1*np.abs(tbase)/decor_time)) + coh_resid
 
-        coh = coh_geom * coh_dc * coh_temp
-        cohs[i, :] = coh
+    # all pairs in one pass, in size of (ifgram_num, pixel_num)
+    cohs = np.array(coh_geom * coh_dc * coh_temp, np.float32)
     #epsilon = 1e-3
     #cohs[cohs < epsilon] = epsilon
-    if display:
-        print('')
 
     if display:
+        import matplotlib.pyplot as plt
         print(('critical perp baseline: %.f m' % pbase_c))
         cohs_mat = coherence_matrix(date12_list, cohs)
         plt.figure()
@@ -515,6 +496,7 @@ def threshold_coherence_based_mst(date12_list, coh_list):
     wei_mat[mask] = 1/coh_mat[mask]
 
     # MST path based on weight matrix
+    from scipy import sparse
     wei_mat_csr = sparse.csr_matrix(wei_mat)
     mst_mat_csr = sparse.csgraph.minimum_spanning_tree(wei_mat_csr)
 
@@ -666,6 +648,7 @@ def select_pairs_delaunay(date_list, pbase_list, norm=True, date12_format='YYMMD
         tbase_list = [tbase*temp2perp_scale for tbase in tbase_list]
 
     # Generate Delaunay Triangulation
+    from matplotlib.tri import Triangulation
     date12_idx_list = Triangulation(tbase_list, pbase_list).edges.tolist()
     date12_idx_list = [sorted(idx) for idx in sorted(date12_idx_list)]
 
@@ -705,6 +688,7 @@ def select_pairs_mst(date_list, pbase_list, date12_format='YYMMDD-YYMMDD'):
 
     # 2D distance matrix in temp/perp domain
     weightMat = np.sqrt(np.square(ttMat) + np.square(ppMat))
+    from scipy import sparse
     weightMat = sparse.csr_matrix(weightMat)  # compress sparse row matrix
 
     # MST path based on weight matrix
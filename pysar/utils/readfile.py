@@ -154,11 +154,13 @@ ENVI_BAND_INTERLEAVE = {
 
 
 #########################################################################
-def read(fname, box=None, datasetName=None, print_msg=True):
+def read(fname, box=None, datasetName=None, print_msg=True, multilook_num=1):
     """Read one dataset and its attributes from input file.
     Parameters: fname : str, path of file to read
                 datasetName : str or list of str, slice names
                 box : 4-tuple of int area to read, defined in (x0, y0, x1, y1) in pixel coordinate
+                multilook_num : int, number of looks in y/x direction to nanmean the data for display,
+                    read from the overview pyramid of HDF5 file if available, check add_overview.py
     Returns:    data : 2/3-D matrix in numpy.array format, return None if failed
                 atr : dictionary, attributes of data, return None if failed
     Examples:
@@ -172,6 +174,7 @@ def read(fname, box=None, datasetName=None, print_msg=True):
         data, atr = readfile.read('geometryRadar.h5', datasetName='height')
         data, atr = readfile.read('geometryRadar.h5', datasetName='bperp')
         data, atr = readfile.read('100120-110214.unw', box=(100,1100, 500, 2500))
+        data, atr = readfile.read('timeseries.h5', datasetName='20161020', multilook_num=8)
     """
     # metadata
     dsname4atr = None   #used to determine UNIT
@@ -189,14 +192,17 @@ def read(fname, box=None, datasetName=None, print_msg=True):
     # Read Data
     fext = os.path.splitext(os.path.basename(fname))[1].lower()
     if fext in ['.h5', '.he5']:
-        data = read_hdf5_file(fname, datasetName=datasetName, box=box)
+        data = read_hdf5_file(fname, datasetName=datasetName, box=box, multilook_num=multilook_num)
     else:
         data, atr = read_binary_file(fname, datasetName=datasetName, box=box)
+        if multilook_num > 1:
+            from pysar.multilook import multilook_data
+            data = multilook_data(data, multilook_num, multilook_num)
     return data, atr
 
 
 #########################################################################
-def read_hdf5_file(fname, datasetName=None, box=None):
+def read_hdf5_file(fname, datasetName=None, box=None, multilook_num=1):
     """
     Parameters: fname : str, name of HDF5 file to read
                 datasetName : str or list of str, dataset name in root level with/without date info
@@ -213,6 +219,8 @@ def read_hdf5_file(fname, datasetName=None, box=None):
                     'igram-20150215_20150227'
                     ...
                 box : 4-tuple of int area to read, defined in (x0, y0, x1, y1) in pixel coordinate
+                multilook_num : int, number of looks in y/x direction to nanmean the data,
+                    read from the overview pyramid if available
     Returns:    data : 2D/3D array
                 atr : dict, metadata
     """
@@ -248,6 +256,12 @@ def read_hdf5_file(fname, datasetName=None, box=None):
         else:
             raise ValueError('input dataset {} not found in file {}'.format(datasetName, fname))
 
+        # read the coarsest overview level that satisfies multilook_num
+        factor = get_overview_factor(f, ds.name, multilook_num=multilook_num, box=box)
+        if factor > 1:
+            ds = f['overview/{}{}'.format(factor, ds.name)]
+            box = [i // factor for i in box]
+
         # 2D dataset
         if ds.ndim == 2:
             data = ds[box[1]:box[3], box[0]:box[2]]
@@ -267,9 +281,46 @@ def read_hdf5_file(fname, datasetName=None, box=None):
             # read data
             data = ds[slice_flag, box[1]:box[3], box[0]:box[2]]
             data = np.squeeze(data)
+
+    # multilook the rest
+    if multilook_num // factor > 1:
+        from pysar.multilook import multilook_data
+        data = multilook_data(data, multilook_num // factor, multilook_num // factor)
     return data
 
 
+def get_overview_factor(f, dsName, multilook_num=1, box=None):
+    """Get the factor of the coarsest overview level, written by add_overview.py,
+    to read dsName multilooked by multilook_num.
+    Only levels dividing multilook_num and the box origin are used, so that data read from them,
+    after the rest multilooking, has the same size as the full resolution data multilooked.
+    Stale levels, i.e. with SOURCE_MODIFICATION_TIME different from the MODIFICATION_TIME of
+    the source dataset re-written in place after add_overview.py, are not used.
+    Parameters: f      : h5py.File object
+                dsName : str, full path of dataset, e.g. /timeseries
+                multilook_num : int, number of looks in y/x direction
+                box    : 4-tuple of int, area to read in (x0, y0, x1, y1)
+    Returns:    factor : int, 1 if no overview level is available
+    """
+    factor = 1
+    if multilook_num <= 1 or 'overview' not in f.keys():
+        return factor
+
+    ds = f[dsName]
+    src_time = str(ds.attrs.get('MODIFICATION_TIME', None))
+    for key in f['overview'].keys():
+        level = int(key)
+        name = 'overview/{}{}'.format(level, dsName)
+        if (level > factor
+                and multilook_num % level == 0
+                and (not box or (box[0] % level == 0 and box[1] % level == 0))
+                and name in f
+                and f[name].shape[:-2] == ds.shape[:-2]
+                and str(f[name].attrs.get('SOURCE_MODIFICATION_TIME', None)) == src_time):
+            factor = level
+    return factor
+
+
 def read_binary_file(fname, datasetName=None, box=None):
     """Read data from binary file, such as .unw, .cor, etc.
     Parameters: fname : str, path/name of binary file
@@ -422,7 +473,6 @@ def get_slice_list(fname):
     atr = read_attribute(fname)
     k = atr['FILE_TYPE']
 
-    global slice_list
     # HDF5 Files
     if fext in ['.h5', '.he5']:
         with h5py.File(fname, 'r') as f:
@@ -460,14 +510,13 @@ def get_slice_list(fname):
         else:
             ## Find slice by walking through the file structure
             length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+            slice_list = []
             def get_hdf5_2d_dataset(name, obj):
-                global slice_list
                 if isinstance(obj, h5py.Dataset) and obj.shape[-2:] == (length, width):
                     if obj.ndim == 2:
                         slice_list.append(name)
                     else:
                         warnings.warn('file has un-defined {}D dataset: {}'.format(obj.ndim, name))
-            slice_list = []
             with h5py.File(fname, 'r') as f:
                 f.visititems(get_hdf5_2d_dataset)
 
@@ -492,15 +541,13 @@ def get_dataset_list(fname, datasetName=None):
     fbase, fext = os.path.splitext(os.path.basename(fname))
     fext = fext.lower()
 
-    global ds_list
     if fext in ['.h5', '.he5']:
         atr = read_attribute(fname)
         length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+        ds_list = []
         def get_hdf5_dataset(name, obj):
-            global ds_list
             if isinstance(obj, h5py.Dataset) and obj.shape[-2:] == (length, width):
                 ds_list.append(name)
-        ds_list = []
         with h5py.File(fname, 'r') as f:
             f.visititems(get_hdf5_dataset)
 
@@ -536,7 +583,7 @@ def read_attribute(fname, datasetName=None, standardize=True, metafile_ext=None)
     # HDF5 files
     if fext in ['.h5', '.he5']:
         f = h5py.File(fname, 'r')
-        g1_list = [i for i in f.keys() if isinstance(f[i], h5py.Group)]
+        g1_list = [i for i in f.keys() if isinstance(f[i], h5py.Group) and i != 'overview']
         d1_list = [i for i in f.keys() if isinstance(f[i], h5py.Dataset) and f[i].ndim >= 2]
 
         # FILE_TYPE - k
@@ -572,12 +619,10 @@ def read_attribute(fname, datasetName=None, standardize=True, metafile_ext=None)
                 atr = dict(f.attrs)
             else:
                 # grab the list of attrs in HDF5 file
-                global atr_list
+                atr_list = []
                 def get_hdf5_attrs(name, obj):
-                    global atr_list
                     if len(obj.attrs) > 0 and 'WIDTH' in obj.attrs.keys():
                         atr_list.append(dict(obj.attrs))
-                atr_list = []
                 f.visititems(get_hdf5_attrs)
                 # use the attrs with most items
                 if atr_list:
@@ -603,12 +648,10 @@ def read_attribute(fname, datasetName=None, standardize=True, metafile_ext=None)
             ds = f[datasetName]
         else:
             # get the 1st dataset
-            global ds_list
+            ds_list = []
             def get_hdf5_dataset(name, obj):
-                global ds_list
                 if isinstance(obj, h5py.Dataset) and obj.ndim >= 2:
                     ds_list.append(obj)
-            ds_list = []
             f.visititems(get_hdf5_dataset)
             if ds_list:
                 ds = ds_list[0]
@@ -10,9 +10,7 @@
 
 import os
 import numpy as np
-import matplotlib.pyplot as plt
 import multiprocessing
-from scipy import ndimage
 
 
 #################################### InSAR ##########################################
@@ -392,6 +390,7 @@ def get_largest_conn_component(mask_in, min_num_pixel=1e4, display=False):
                 display : bool, display the result or not.
     Returns:    mask_out : 2D np.array in np.bool_ format
     """
+    from scipy import ndimage
     mask_out = np.zeros(mask_in.shape, np.bool_)
     labels, n_features = ndimage.label(mask_in)
     num_pixel = np.max(np.bincount(labels.flatten())[1:])
@@ -401,6 +400,7 @@ def get_largest_conn_component(mask_in, min_num_pixel=1e4, display=False):
     max_label = np.argmax(np.bincount(labels.flatten())[1:]) + 1
     mask_out = labels == max_label
     if display:
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(nrows=1, ncols=3, figsize=[15, 5])
         ax[0].imshow(mask_in)
         ax[1].imshow(mask_out)
@@ -431,6 +431,7 @@ def min_region_distance(mask1, mask2, display=False):
     min_dist = dist[idx_min]
 
     if display:
+        import matplotlib.pyplot as plt
         plt.figure()
         plt.imshow(mask1 * 1 + mask2 * 2)
         plt.plot([xy1[0], xy2[0]], [xy1[1], xy2[1]], '-o')
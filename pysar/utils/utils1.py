@@ -11,6 +11,7 @@
 import os
 import time
 import glob
+import hashlib
 import h5py
 import numpy as np
 from pysar.objects import deramp, ifgramStack, timeseries, geometryDatasetNames
@@ -607,6 +608,106 @@ def run_or_skip(out_file, in_file=None, check_readable=True, print_msg=True):
     return 'skip'
 
 
+def hash_file_block(hash_obj, fname, offset, num_byte, block_size=64e6):
+    """Update hash with the bytes of file in [offset, offset+num_byte), read in blocks."""
+    with open(fname, 'rb') as f:
+        f.seek(offset)
+        while num_byte > 0:
+            block = f.read(int(min(block_size, num_byte)))
+            if not block:
+                break
+            hash_obj.update(block)
+            num_byte -= len(block)
+    return hash_obj
+
+
+def hash_h5_attrs(hash_obj, attrs):
+    """Update hash with the attributes, except for the *MODIFICATION_TIME ones,
+    so that re-writing the same content does not change the hash."""
+    for key in sorted(attrs.keys()):
+        if not key.endswith('MODIFICATION_TIME'):
+            hash_obj.update('{} = {}\n'.format(key, attrs[key]).encode())
+    return hash_obj
+
+
+def hash_h5_dataset(hash_obj, ds, block_size=64e6):
+    """Update hash with the metadata and the whole data of HDF5 dataset.
+    The raw bytes of the stored chunks / contiguous data are hashed as they are in the file,
+    i.e. without decompression and in a streaming way, to limit the time and memory usage.
+    """
+    hash_obj.update('{}{}'.format(ds.shape, ds.dtype).encode())
+    hash_h5_attrs(hash_obj, ds.attrs)
+
+    if ds.ndim == 0 or ds.size == 0:
+        hash_obj.update(np.ascontiguousarray(ds[()]).tobytes())
+
+    elif ds.chunks and hasattr(ds.id, 'get_chunk_info'):
+        # raw bytes of all the stored chunks
+        def hash_chunk(chunk_info):
+            hash_obj.update(str(chunk_info.chunk_offset).encode())
+            hash_obj.update(ds.id.read_direct_chunk(chunk_info.chunk_offset)[1])
+        if hasattr(ds.id, 'chunk_iter'):
+            ds.id.chunk_iter(hash_chunk)
+        else:
+            for i in range(ds.id.get_num_chunks()):
+                hash_chunk(ds.id.get_chunk_info(i))
+
+    elif not ds.chunks and ds.id.get_offset() is not None:
+        # raw bytes of contiguous dataset
+        hash_file_block(hash_obj, ds.file.filename, ds.id.get_offset(), ds.id.get_storage_size(),
+                        block_size=block_size)
+
+    else:
+        # read in blocks along the 1st dimension
+        step = max(1, int(block_size / max(1, ds[0:1].nbytes)))
+        for i in range(0, ds.shape[0], step):
+            hash_obj.update(np.ascontiguousarray(ds[i:i+step]).tobytes())
+    return hash_obj
+
+
+def get_content_hash(fname, datasetName=None, block_size=64e6):
+    """Get the hash of the file content, independent of its modification time.
+    For HDF5 file updated in place by multiple steps, e.g. ifgramStack.h5, hash one dataset
+    or one root level attribute only, so that updates of the others do not matter.
+    The whole data is hashed, with the raw bytes of HDF5 datasets streamed chunk by chunk.
+
+    Parameters: fname       : str, path of file
+                datasetName : str, dataset or root level attribute name of HDF5 file,
+                              None for the whole file
+                block_size  : float, max number of bytes to read per loop
+    Returns:    hash_str    : str, hex digest of the content, None if file / dataset not found
+    Example:    hash_str = ut.get_content_hash('timeseries.h5')
+                hash_str = ut.get_content_hash('INPUTS/ifgramStack.h5', datasetName='unwrapPhase')
+                hash_str = ut.get_content_hash('INPUTS/ifgramStack.h5', datasetName='REF_Y')
+    """
+    if not os.path.isfile(fname):
+        return None
+
+    hash_obj = hashlib.blake2b(digest_size=16)
+    if not datasetName and not h5py.is_hdf5(fname):
+        hash_file_block(hash_obj, fname, 0, os.path.getsize(fname), block_size=block_size)
+
+    elif not datasetName:
+        # whole HDF5 file: root level attributes and all datasets
+        with h5py.File(fname, 'r') as f:
+            hash_h5_attrs(hash_obj, f.attrs)
+            ds_names = []
+            f.visititems(lambda name, obj: ds_names.append(name) if isinstance(obj, h5py.Dataset) else None)
+            for ds_name in sorted(ds_names):
+                hash_obj.update(ds_name.encode())
+                hash_h5_dataset(hash_obj, f[ds_name], block_size=block_size)
+
+    else:
+        with h5py.File(fname, 'r') as f:
+            if datasetName in f.keys() and isinstance(f[datasetName], h5py.Dataset):
+                hash_h5_dataset(hash_obj, f[datasetName], block_size=block_size)
+            elif datasetName in f.attrs.keys():
+                hash_obj.update(str(f.attrs[datasetName]).encode())
+            else:
+                return None
+    return hash_obj.hexdigest()
+
+
 def check_template_auto_value(templateDict, auto_file='../defaults/pysarApp.cfg'):
     """Replace auto value based on $PYSAR_HOME/pysar/defaults/template.cfg file."""
     # Read default template value and turn yes/no to True/False
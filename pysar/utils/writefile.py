@@ -8,13 +8,14 @@
 
 
 import os
+import time
 import h5py
 import numpy as np
-from pysar.objects import timeseries
+from pysar.objects import timeseries, get_chunk_shape, get_dataset_compression
 from pysar.utils import readfile
 
 
-def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None):
+def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None, chunk_layout='auto'):
     """ Write one file.
     Parameters: datasetDict : dict of dataset, with key = datasetName and value = 2D/3D array, e.g.:
                     {'height'        : np.ones((   200,300), dtype=np.int16),
@@ -24,7 +25,10 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
                 out_file : str, output file name
                 metadata : dict of attributes
                 ref_file : str, reference file to get auxliary info
-                compression : str, compression while writing to HDF5 file, None, "lzf", "gzip"
+                compression : str, compression while writing to HDF5 file, None, "lzf", "gzip", "lz4", "zstd"
+                              or per-dataset policy, check pysar.objects.get_dataset_compression()
+                chunk_layout : str or tuple of int, chunk layout of 2D/3D datasets, i.e. auto, image, pixel
+                               check pysar.objects.get_chunk_shape() for details
     Returns:    out_file : str
     Examples:   dsDict = dict()
                 dsDict['velocity'] = np.ones((200,300), dtype=np.float32)
@@ -55,7 +59,8 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
             obj.write2hdf5(datasetDict[k],
                            metadata=meta,
                            refFile=ref_file,
-                           compression=compression)
+                           compression=compression,
+                           chunk_layout=chunk_layout)
 
         else:
             if os.path.isfile(out_file):
@@ -68,16 +73,19 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
                 maxDigit = max([len(i) for i in list(datasetDict.keys())])
                 for dsName in datasetDict.keys():
                     data = datasetDict[dsName]
+                    codec, comp_kwargs = get_dataset_compression(compression, dsName, data.dtype)
                     print(('create dataset /{d:<{w}} of {t:<10} in size of {s:<20} '
                            'with compression={c}').format(d=dsName,
                                                           w=maxDigit,
                                                           t=str(data.dtype),
                                                           s=str(data.shape),
-                                                          c=compression))
+                                                          c=codec))
                     ds = f.create_dataset(dsName,
                                           data=data,
-                                          chunks=True,
-                                          compression=compression)
+                                          chunks=get_chunk_shape(data.shape, chunk_layout, data.dtype),
+                                          **comp_kwargs)
+                    if codec:
+                        ds.attrs['COMPRESSION'] = codec
 
                 # 2. Write extra/auxliary datasets from ref_file
                 if ref_file and os.path.splitext(ref_file)[1] in ['.h5', '.he5']:
@@ -91,16 +99,17 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
                         maxDigit = max([len(i) for i in dsNames]+[maxDigit])
                         for dsName in dsNames:
                             ds = fr[dsName]
+                            codec, comp_kwargs = get_dataset_compression(compression, dsName, ds.dtype)
                             print(('create dataset /{d:<{w}} of {t:<10} in size of {s:<10} '
                                    'with compression={c}').format(d=dsName,
                                                                   w=maxDigit,
                                                                   t=str(ds.dtype),
                                                                   s=str(ds.shape),
-                                                                  c=compression))
+                                                                  c=codec))
                             f.create_dataset(dsName,
                                              data=ds[:],
                                              chunks=True,
-                                             compression=compression)
+                                             **comp_kwargs)
 
                 # 3. metadata
                 for key, value in meta.items():
@@ -150,6 +159,96 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
     return out_file
 
 
+def layout_hdf5(fname, dsNameDict, metadata, compression=None, chunk_layout=None, print_msg=True):
+    """Create HDF5 file with the given metadata and dataset layout, to be filled block by block later
+    with write_hdf5_block(), so that the whole 2D/3D data does not need to be in memory.
+    Parameters: fname : str, output file name
+                dsNameDict : dict of dataset layout, with key = datasetName and value = list of
+                    [data_type, data_shape]       for empty dataset, or
+                    [data_type, data_shape, data] for dataset with data, e.g.:
+                    {'date'       : [np.string_,  (80,), dateList],
+                     'bperp'      : [np.float32,  (80,), pbase],
+                     'timeseries' : [np.float32,  (80, 200, 300), None]}
+                metadata : dict of attributes
+                compression : str, compression while writing to HDF5 file, None, "lzf", "gzip", "lz4", "zstd"
+                              or per-dataset policy, check pysar.objects.get_dataset_compression()
+                chunk_layout : str or tuple of int, chunk layout of 2D/3D datasets, i.e. auto, image, pixel
+                               default: None, for (1, 128, 128) blocks in space
+    Returns:    fname : str
+    Examples:   dsNameDict = {'velocity' : [np.float32, (200, 300), None]}
+                layout_hdf5('velocity.h5', dsNameDict, metadata=atr)
+    """
+    if print_msg:
+        print('create HDF5 file: {} with w mode'.format(fname))
+    maxDigit = max([len(i) for i in dsNameDict.keys()])
+    with h5py.File(fname, 'w') as f:
+        for dsName, dsLayout in dsNameDict.items():
+            data_type, data_shape = dsLayout[0:2]
+            data = dsLayout[2] if len(dsLayout) > 2 else None
+
+            # datasets in 2D/3D share the same chunk layout in space
+            chunks = None
+            if len(data_shape) >= 2 and chunk_layout:
+                chunks = get_chunk_shape(data_shape, chunk_layout, data_type)
+            elif len(data_shape) >= 2:
+                chunks = tuple([1] * (len(data_shape) - 2)
+                               + [min(128, i) for i in data_shape[-2:]])
+
+            codec, comp_kwargs = get_dataset_compression(compression, dsName, data_type)
+            if print_msg:
+                print(('create dataset /{d:<{w}} of {t:<10} in size of {s:<20} '
+                       'with compression={c}').format(d=dsName,
+                                                      w=maxDigit,
+                                                      t=str(np.dtype(data_type)),
+                                                      s=str(data_shape),
+                                                      c=codec))
+            if data is not None:
+                ds = f.create_dataset(dsName,
+                                      data=np.array(data, dtype=data_type),
+                                      chunks=chunks,
+                                      **(comp_kwargs if chunks else {}))
+            else:
+                ds = f.create_dataset(dsName,
+                                      shape=data_shape,
+                                      dtype=data_type,
+                                      chunks=chunks,
+                                      **comp_kwargs)
+            if codec and ds.compression:
+                ds.attrs['COMPRESSION'] = codec
+
+        # metadata
+        for key, value in metadata.items():
+            f.attrs[key] = str(value)
+    return fname
+
+
+def write_hdf5_block(fname, data, datasetName, block=None, print_msg=True):
+    """Write data block into an existing dataset of HDF5 file, e.g. created by layout_hdf5()
+    Parameters: fname : str, HDF5 file name
+                data : 2D/3D np.ndarray
+                datasetName : str, dataset name
+                block : list of 4/6 int, for [y0, y1, x0, x1] / [z0, z1, y0, y1, x0, x1],
+                        or None for the whole dataset
+    Returns:    fname : str
+    Examples:   write_hdf5_block('timeseries.h5', data, 'timeseries', block=[0, 80, 100, 200, 0, 300])
+    """
+    with h5py.File(fname, 'r+') as f:
+        ds = f[datasetName]
+        if block is None:
+            block = []
+            for i in ds.shape:
+                block += [0, i]
+
+        if print_msg:
+            print('write block {} of /{} into file: {}'.format(block, datasetName, os.path.basename(fname)))
+        slices = tuple([slice(block[i], block[i+1]) for i in range(0, len(block), 2)])
+        ds[slices] = data.reshape([block[i+1] - block[i] for i in range(0, len(block), 2)])
+        # mark the overview pyramid of this dataset as stale, check add_overview.py
+        if 'overview' in f.keys():
+            ds.attrs['MODIFICATION_TIME'] = str(time.time())
+    return fname
+
+
 def remove_hdf5_dataset(fname, datasetNames, print_msg=True):
     """Remove an existing dataset from an HDF5 file.
     Parameters: fname : str, HDF5 file name/path
@@ -334,19 +334,27 @@ def update_inps_with_file_metadata(inps, metadata):
 
 
 ##################################################################################################
-def update_data_with_plot_inps(data, metadata, inps):
+def update_data_with_plot_inps(data, metadata, inps, multilook_num=1, ref_data=None):
+    """ref_data : (list of) float, value of the seed point at full resolution, e.g. from
+                 read_ref_pixel4figure(), for data multilooked while reading, to be subtracted
+                 instead of the value of the multilooked pixel covering the seed point.
+    """
     # Seed Point
     if inps.ref_yx:   # and inps.ref_yx != [int(metadata['REF_Y']), int(metadata['REF_X'])]:
-        try:
-            ref_y = inps.ref_yx[0] - inps.pix_box[1]
-            ref_x = inps.ref_yx[1] - inps.pix_box[0]
-        except:
-            pass
+        if ref_data is None:
+            try:
+                ref_y = inps.ref_yx[0] - inps.pix_box[1]
+                ref_x = inps.ref_yx[1] - inps.pix_box[0]
+                # data multilooked while reading
+                ref_y = min(ref_y // multilook_num, data.shape[-2] - 1)
+                ref_x = min(ref_x // multilook_num, data.shape[-1] - 1)
+            except:
+                pass
+            ref_data = data[..., ref_y, ref_x]
         if len(data.shape) == 2:
-            data -= data[ref_y, ref_x]
+            data -= ref_data
         elif len(data.shape) == 3:
-            data -= np.tile(data[:, ref_y, ref_x].reshape(-1, 1, 1),
-                            (1, data.shape[1], data.shape[2]))
+            data -= np.reshape(ref_data, (-1, 1, 1))
         vprint('set reference pixel to: {}'.format(inps.ref_yx))
     else:
         inps.ref_yx = None
@@ -840,17 +848,48 @@ def update_figure_setting(inps):
     return inps
 
 
+def read_ref_pixel4figure(i_start, i_end, inps):
+    """Read the seed point of multiple datasets at full resolution with a 1x1 box,
+    with the same reference as read_data4figure(), for data multilooked while reading.
+    """
+    ref_y, ref_x = inps.ref_yx
+    ref_box = (ref_x, ref_y, ref_x+1, ref_y+1)
+    dset_list = [inps.dset[i] for i in range(i_start, i_end)]
+    if (len(inps.dsetFamilyList) == 1
+            and inps.key in ['timeseries', 'giantTimeseries', 'ifgramStack', 'HDFEOS', 'geometry']):
+        ref_data = readfile.read(inps.file, datasetName=dset_list, box=ref_box, print_msg=False)[0]
+    else:
+        ref_data = [readfile.read(inps.file, datasetName=i, box=ref_box, print_msg=False)[0] for i in dset_list]
+    ref_data = np.array(ref_data, dtype=np.float32).flatten()
+
+    if (inps.key == 'ifgramStack'
+            and inps.dsetFamilyList[0] == 'unwrapPhase'
+            and inps.file_ref_yx):
+        file_ref_y, file_ref_x = inps.file_ref_yx
+        file_ref_box = (file_ref_x, file_ref_y, file_ref_x+1, file_ref_y+1)
+        file_ref_data = readfile.read(inps.file, datasetName=dset_list, box=file_ref_box, print_msg=False)[0]
+        file_ref_data = np.array(file_ref_data, dtype=np.float32).flatten()
+        mask = ref_data != 0.
+        ref_data[mask] -= file_ref_data[mask]
+
+    if inps.ref_date:
+        ref_data -= float(readfile.read(inps.file, datasetName=inps.ref_date, box=ref_box, print_msg=False)[0])
+    return ref_data
+
+
 def read_data4figure(i_start, i_end, inps, metadata):
     """Read multiple datasets for one figure into 3D matrix based on i_start/end"""
+    # multilook while reading, from the overview pyramid if available
+    lks = inps.multilook_num if inps.multilook else 1
     data = np.zeros((i_end - i_start,
-                     inps.pix_box[3] - inps.pix_box[1],
-                     inps.pix_box[2] - inps.pix_box[0]))
+                     (inps.pix_box[3] - inps.pix_box[1]) // lks,
+                     (inps.pix_box[2] - inps.pix_box[0]) // lks))
 
     # fast reading for single dataset type
     if (len(inps.dsetFamilyList) == 1
             and inps.key in ['timeseries', 'giantTimeseries', 'ifgramStack', 'HDFEOS', 'geometry']):
         dset_list = [inps.dset[i] for i in range(i_start, i_end)]
-        data = readfile.read(inps.file, datasetName=dset_list, box=inps.pix_box)[0]
+        data = readfile.read(inps.file, datasetName=dset_list, box=inps.pix_box, multilook_num=lks)[0]
 
         if inps.key == 'ifgramStack':
             # reference pixel info in unwrapPhase
@@ -870,7 +909,8 @@ def read_data4figure(i_start, i_end, inps, metadata):
             d = readfile.read(inps.file,
                               datasetName=inps.dset[i],
                               box=inps.pix_box,
-                              print_msg=False)[0]
+                              print_msg=False,
+                              multilook_num=lks)[0]
             data[i - i_start, :, :] = d
             prog_bar.update(i - i_start + 1, suffix=inps.dset[i].split('/')[-1])
         prog_bar.close()
@@ -881,24 +921,27 @@ def read_data4figure(i_start, i_end, inps, metadata):
         ref_data = readfile.read(inps.file,
                                  datasetName=inps.ref_date,
                                  box=inps.pix_box,
-                                 print_msg=False)[0]
+                                 print_msg=False,
+                                 multilook_num=lks)[0]
         data -= ref_data
 
     # v/dlim, adjust data if all subplots are 1) the same type OR 2) velocity or timeseries
     if len(inps.dsetFamilyList) == 1 or inps.key in ['velocity', 'timeseries']:
-        data, inps = update_data_with_plot_inps(data, metadata, inps)
+        # seed point at full resolution, instead of the multilooked pixel covering it
+        ref_data = None
+        if inps.ref_yx and lks > 1:
+            ref_data = read_ref_pixel4figure(i_start, i_end, inps)
+            if len(data.shape) == 2:
+                ref_data = ref_data[0]
+        data, inps = update_data_with_plot_inps(data, metadata, inps, multilook_num=lks, ref_data=ref_data)
         if (not inps.vlim 
                 and not (inps.dsetFamilyList[0].startswith('unwrap') and not inps.file_ref_yx)
                 and inps.dsetFamilyList[0] not in ['bperp']):
-            data_mli = multilook_data(data, 10, 10)
+            data_mli = multilook_data(data, max(1, 10 // lks), max(1, 10 // lks))
             inps.vlim = [np.nanmin(data_mli), np.nanmax(data_mli)]
             del data_mli
     inps.dlim = [np.nanmin(data), np.nanmax(data)]
 
-    # multilook
-    if inps.multilook:
-        data = multilook_data(data, inps.multilook_num, inps.multilook_num)
-
     # mask
     if inps.msk is not None:
         vprint('masking data')
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2019, Zhang Yunjun                          #
+# Author:  Zhang Yunjun                                    #
+############################################################
+
+
+import os
+import io
+import glob
+import time
+import argparse
+import datetime
+import traceback
+import contextlib
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# common view.py options for all figures
+viewOption = '--nodisplay --dpi 150'
+
+# max number of bytes of data cached in each worker process
+cacheSize = 2e9
+
+
+###########################################################################################
+EXAMPLE = """example:
+  view_batch.py                        #plot figures of pysarApp.py routine workflow in the current directory
+  view_batch.py --num-worker 4         #plot with 4 processes
+  view_batch.py -f figure_list.txt     #plot figures with view.py arguments in each line
+  view_batch.py --noupdate             #re-plot existing figures
+"""
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Plot figures in batch with view.py in parallel.\n'
+                                                 'Python version of $PYSAR_HOME/sh/plot_pysarApp.sh',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=EXAMPLE)
+
+    parser.add_argument('-f', '--file', dest='fig_list_file',
+                        help='text file with view.py arguments of one figure in each line.\n'
+                             'Default: figures of pysarApp.py routine workflow, as plot_pysarApp.sh')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=4,
+                        help='number of processes to plot figures (default: %(default)s).')
+    parser.add_argument('--noupdate', dest='update_mode', action='store_false',
+                        help='re-plot figures even if they exist and are newer than the input file.')
+    parser.add_argument('--log', dest='log_file', default='view_batch.log',
+                        help='log file of the view.py messages (default: %(default)s).')
+    parser.add_argument('--outdir', dest='out_dir', default='PIC',
+                        help='directory to move *.png/pdf/kmz files into (default: %(default)s).')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    inps.numWorker = max(1, min(inps.numWorker, multiprocessing.cpu_count()))
+    return inps
+
+
+###########################################################################################
+def get_pysarApp_figure_list():
+    """Get the list of figures of pysarApp.py routine workflow in the current directory,
+    as $PYSAR_HOME/sh/plot_pysarApp.sh.
+    Returns:    fig_list : list of str, view.py arguments of each figure, for existing input files only
+    """
+    mask_file = 'maskTempCoh.h5'
+    dem_file = './INPUTS/geometryRadar.h5'
+    if not os.path.isfile(dem_file):
+        dem_file = './INPUTS/geometryGeo.h5'
+
+    fig_list = []
+    # key files
+    fig_list += ['velocity.h5 --dem {} --mask {} -u cm'.format(dem_file, mask_file),
+                 'temporalCoherence.h5 -c gray --vlim 0 1',
+                 'maskTempCoh.h5 -c gray --vlim 0 1',
+                 'INPUTS/geometryRadar.h5',
+                 'INPUTS/geometryGeo.h5']
+
+    # loaded dataset
+    fig_list += ['INPUTS/ifgramStack.h5 unwrapPhase- --zero-mask --wrap',
+                 'INPUTS/ifgramStack.h5 unwrapPhase- --zero-mask',
+                 'INPUTS/ifgramStack.h5 coherence- --mask no']
+
+    # auxliary files from loaded dataset
+    fig_list += ['avgPhaseVelocity.h5',
+                 'avgSpatialCoh.h5 -c gray --vlim 0 1',
+                 'maskConnComp.h5 -c gray --vlim 0 1']
+
+    # time-series files
+    ts_list = ['timeseries.h5']
+    # LOD for Envisat
+    ts_list += ['timeseries_LODcor{}.h5'.format(i) for i in ['', '_ECMWF', '_ECMWF_demErr',
+                                                             '_ECMWF_ramp', '_ECMWF_ramp_demErr']]
+    # w trop delay corrections
+    for trop in ['_ECMWF', '_MERRA', '_NARR', '_tropHgt']:
+        ts_list += ['timeseries{}{}.h5'.format(trop, i) for i in ['', '_demErr', '_ramp', '_ramp_demErr']]
+    # w/o trop delay correction
+    ts_list += ['timeseries_ramp.h5', 'timeseries_demErr_ramp.h5']
+    fig_list += ['{} --mask {} --noaxis -u cm'.format(i, mask_file) for i in ts_list]
+
+    # geo coordinates for UNAVCO time-series InSAR archive product
+    fig_list += ['./GEOCODE/geo_maskTempCoh.h5 -c gray',
+                 './GEOCODE/geo_temporalCoherence.h5 -c gray',
+                 './GEOCODE/geo_velocity.h5 velocity']
+    fig_list += ['./GEOCODE/geo_timeseries{}.h5 --noaxis'.format(i) for i in ['_ECMWF_demErr_ramp',
+                                                                              '_ECMWF_demErr',
+                                                                              '_demErr_ramp',
+                                                                              '_demErr']]
+
+    # the rest
+    fig_list += ['velocity{}.h5 --mask no'.format(i) for i in ['ECMWF', 'MERRA', 'NARR']]
+    fig_list += ['numInvIfgram.h5 --mask no']
+
+    fig_list = [i for i in fig_list if os.path.isfile(i.split()[0])]
+    return fig_list
+
+
+def read_figure_list(fname):
+    """Read view.py arguments of figures from text file, one figure per line, # for comments."""
+    fig_list = []
+    with open(fname, 'r') as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line:
+                # support lines copied from the command line
+                if line.split()[0].endswith('view.py'):
+                    line = ' '.join(line.split()[1:])
+                fig_list.append(line)
+    return fig_list
+
+
+###########################################################################################
+class cachedReader:
+    """Wrapper of readfile.read() / read_attribute() with the results cached in memory, to share
+    the loaded data and metadata among figures in the same process, e.g. the same dataset plotted
+    with and without --wrap, the mask file and DEM file used by multiple figures.
+    Cache is keyed by file modification time and the input arguments, and a copy is returned,
+    as view.py modifies the data in place.
+    """
+    def __init__(self, func, max_size=cacheSize):
+        self.func = func
+        self.max_size = max_size
+        self.cache = collections.OrderedDict()
+        self.size = 0
+        self.__doc__ = func.__doc__
+
+    def __call__(self, fname, *args, **kwargs):
+        try:
+            key_kwargs = dict((k, v) for k, v in kwargs.items() if k != 'print_msg')
+            key = (os.path.abspath(fname), os.stat(fname).st_mtime_ns, repr(args), repr(sorted(key_kwargs.items())))
+        except (TypeError, OSError):
+            return self.func(fname, *args, **kwargs)
+
+        if key not in self.cache.keys():
+            value = self.func(fname, *args, **kwargs)
+            self.cache[key] = value
+            self.size += get_object_size(value)
+            # remove the oldest items
+            while self.size > self.max_size and len(self.cache) > 1:
+                self.size -= get_object_size(self.cache.popitem(last=False)[1])
+        return copy_object(self.cache[key])
+
+
+def get_object_size(value):
+    if isinstance(value, tuple):
+        return sum(get_object_size(i) for i in value)
+    return getattr(value, 'nbytes', 0)
+
+
+def copy_object(value):
+    if isinstance(value, tuple):
+        return tuple(copy_object(i) for i in value)
+    elif hasattr(value, 'copy'):
+        return value.copy()
+    return value
+
+
+def init_worker(cache_size=cacheSize):
+    """Initialize worker process: non-interactive backend and shared data cache."""
+    import matplotlib
+    matplotlib.use('Agg')
+    from pysar.utils import readfile
+    readfile.read = cachedReader(readfile.read, max_size=cache_size)
+    readfile.read_attribute = cachedReader(readfile.read_attribute, max_size=cache_size)
+    return
+
+
+def plot_figure(fig_args, update_mode=True):
+    """Plot one figure with view.py in the current process.
+    Parameters: fig_args    : str, view.py arguments, e.g. 'velocity.h5 --mask maskTempCoh.h5 -u cm'
+                update_mode : bool, skip if figure exists and is newer than the input file
+    Returns:    status      : str, plot / skip
+    """
+    import matplotlib.pyplot as plt
+    from pysar import view
+
+    iargs = fig_args.split() + viewOption.split()
+    if update_mode:
+        iargs += ['--update']
+    try:
+        obj = view.viewer(iargs=iargs)
+        obj.configure()
+        if obj.update_mode and view.run_or_skip(obj) == 'skip':
+            return 'skip'
+        obj.plot()
+    finally:
+        # close the figure of failed plot too, not to affect the next figures in the process
+        plt.close('all')
+    return 'plot'
+
+
+def plot_figure_group(fig_args_list, update_mode=True):
+    """Plot figures of the same input file in one process, for the loaded data to be shared.
+    Returns:    fig_info : list of (str, str, float, str) for the figure arguments, status,
+                           time used in seconds and the message printed out
+    """
+    fig_info = []
+    for fig_args in fig_args_list:
+        start_time = time.time()
+        msg = io.StringIO()
+        with contextlib.redirect_stdout(msg), contextlib.redirect_stderr(msg):
+            try:
+                status = plot_figure(fig_args, update_mode=update_mode)
+            except (Exception, SystemExit):
+                # SystemExit from argparse for invalid view.py arguments, e.g. from -f file
+                status = 'error'
+                traceback.print_exc(file=msg)
+        fig_info.append((fig_args, status, time.time()-start_time, msg.getvalue()))
+    return fig_info
+
+
+def plot_figures(fig_list, num_worker=4, update_mode=True, log_file='view_batch.log',
+                 cache_size=cacheSize):
+    """Plot figures in batch with view.py, in parallel with a process pool.
+    Figures of the same input file are plotted in the same process, sharing the loaded data.
+    Each process imports pysar.view only once, using the non-interactive Agg backend.
+
+    Parameters: fig_list    : list of str, view.py arguments of each figure
+                num_worker  : int, number of processes
+                update_mode : bool, skip figures existed and newer than the input file
+                log_file    : str, text file to append the view.py messages to
+                cache_size  : float, max number of bytes of data cached in each process
+    Returns:    fig_info    : list of (str, str, float, str), check plot_figure_group()
+    Example:    fig_list = view_batch.get_pysarApp_figure_list()
+                view_batch.plot_figures(fig_list, num_worker=4)
+    """
+    # group figures by input file
+    fig_group = collections.OrderedDict()
+    for fig_args in fig_list:
+        fig_group.setdefault(fig_args.split()[0], []).append(fig_args)
+    num_worker = max(1, min(num_worker, len(fig_group)))
+    print('plot {} figures of {} files with {} processes'.format(len(fig_list), len(fig_group), num_worker))
+
+    fig_info = []
+    if not fig_list:
+        return fig_info
+
+    # spawn new processes, as pyplot may be imported with an interactive backend in the main process
+    with ProcessPoolExecutor(max_workers=num_worker,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker,
+                             initargs=(cache_size,)) as executor:
+        futures = [executor.submit(plot_figure_group, i, update_mode) for i in fig_group.values()]
+        for future in as_completed(futures):
+            for fig_args, status, time_sec, msg in future.result():
+                fig_info.append((fig_args, status, time_sec, msg))
+                print('[{}/{}] {:<5} {:6.1f} secs  view.py {}'.format(len(fig_info), len(fig_list),
+                                                                       status, time_sec, fig_args))
+                if status == 'error':
+                    print(msg.strip().splitlines()[-1])
+
+    # write log file
+    if log_file:
+        with open(log_file, 'a') as f:
+            f.write('\n\n{} view_batch.py {}\n'.format('#'*30, datetime.datetime.now()))
+            for fig_args, status, time_sec, msg in fig_info:
+                f.write('\nview.py {} {}\n{}'.format(fig_args, viewOption, msg))
+        print('view.py messages are saved to file: {}'.format(log_file))
+    return fig_info
+
+
+def move_figures(out_dir='PIC'):
+    """Move *.png/pdf/kmz files into out_dir folder."""
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+        print('create directory:', out_dir)
+    flist = glob.glob('*.png') + glob.glob('*.pdf') + glob.glob('*.kmz') + glob.glob('./GEOCODE/*.kmz')
+    for fname in flist:
+        os.replace(fname, os.path.join(out_dir, os.path.basename(fname)))
+    print('move {} *.png/pdf/kmz files into ./{} folder.'.format(len(flist), out_dir))
+    return
+
+
+###########################################################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    start_time = time.time()
+
+    if inps.fig_list_file:
+        fig_list = read_figure_list(inps.fig_list_file)
+    else:
+        fig_list = get_pysarApp_figure_list()
+
+    plot_figures(fig_list,
+                 num_worker=inps.numWorker,
+                 update_mode=inps.update_mode,
+                 log_file=inps.log_file)
+    move_figures(inps.out_dir)
+
+    m, s = divmod(time.time()-start_time, 60)
+    print('time used: {:02.0f} mins {:02.1f} secs.'.format(m, s))
+    return
+
+
+###########################################################################################
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,9 @@
-## Dynamic import for modules used in routine workflows, i.e. pysarApp
+## Lazy import, on first access, for modules used in routine workflows, i.e. pysarApp
 ## Recommended usage:
 ##     import pysar
 ##     import pysar.workflow
 
 
-from pathlib import Path
 import importlib
 
 
@@ -29,8 +28,17 @@ __all__ = [
     'timeseries_rms',
     'tropo_phase_elevation',
     'version',
+    'view_batch',
 ]
 
-root_module = Path(__file__).parent.parent.name   #pysar
-for module in __all__:
-    importlib.import_module(root_module + '.' + module)
+root_module = __name__.split('.')[0]   #pysar
+
+def __getattr__(name):
+    """Import the module on first access (PEP 562), instead of all modules on import"""
+    if name in __all__:
+        return importlib.import_module(root_module + '.' + name)
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# Test import time of PySAR command line scripts against a budget
+# Author: Zhang Yunjun, 2019-05-02
+
+
+import os
+import sys
+import glob
+import argparse
+import subprocess
+
+
+# import time budget in seconds, measured with "python -X importtime", for scripts with
+# matplotlib / Basemap for display; all the other scripts use defaultBudget.
+defaultBudget = 0.5
+budgetDict = {
+    'benchmark_network'       : 1.5,
+    'insarmaps_query'         : 1.0,
+    'match'                   : 1.5,
+    'multi_transect'          : 1.5,
+    'plot_coherence_matrix'   : 1.5,
+    'plot_network'            : 1.5,
+    'save_kmz'                : 1.5,
+    'save_kmz_timeseries'     : 1.5,
+    'select_network'          : 1.5,
+    'spatial_average'         : 1.5,
+    'timeseries_rms'          : 1.5,
+    'transect'                : 1.5,
+    'tsview'                  : 1.5,
+    'unwrap_error_phase_closure' : 1.5,
+    'view'                    : 1.5,
+}
+
+pysar_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+#####################################################################################
+EXAMPLE = """example:
+  $PYSAR_HOME/test/test_import_time.py
+  $PYSAR_HOME/test/test_import_time.py  info view pysarApp
+  $PYSAR_HOME/test/test_import_time.py  --scale 2      #for slow file system, e.g. cluster nodes
+"""
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Test import time of command line scripts, with python -X importtime.',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=EXAMPLE)
+
+    parser.add_argument('script', nargs='*',
+                        help='name(s) of scripts to be tested, e.g. info view\n'+
+                             'Default is ALL scripts with main() in pysar/*.py')
+    parser.add_argument('--scale', dest='budget_scale', type=float, default=1.0,
+                        help='scale factor of the import time budget, default: 1.0.')
+    parser.add_argument('--num-top', dest='num_top', type=int, default=5,
+                        help='number of the slowest imported packages to show for scripts over budget, default: 5.')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    if not inps.script:
+        inps.script = get_script_list()
+    return inps
+
+
+#####################################################################################
+def get_script_list():
+    """Get the list of command line scripts, i.e. modules with main() in pysar/*.py"""
+    script_list = []
+    for fname in sorted(glob.glob(os.path.join(pysar_dir, 'pysar', '*.py'))):
+        with open(fname, 'r') as f:
+            if 'def main(' in f.read():
+                script_list.append(os.path.splitext(os.path.basename(fname))[0])
+    return script_list
+
+
+def measure_import_time(module):
+    """Measure the import time of module in a new python process
+    Returns:    time_sec : float, cumulative import time in seconds, None if failed
+                top_list : list of (float, str), the slowest imported top level packages
+                msg      : str, error message if failed
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([pysar_dir, env.get('PYTHONPATH', '')])
+    env['MPLBACKEND'] = 'Agg'
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)]
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    lines = proc.stderr.decode('utf-8', 'ignore').splitlines()
+    if proc.returncode != 0:
+        msg = [i for i in lines if not i.startswith('import time:')]
+        return None, [], msg[-1] if msg else 'import failed'
+
+    time_sec = None
+    top_dict = {}
+    for line in lines:
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        cum_time, name = line.split('|')[1:3]
+        cum_time = float(cum_time) / 1e6
+        if name.strip() == module:
+            time_sec = cum_time
+        # level 1 packages only
+        elif len(name) - len(name.lstrip()) == 3:
+            top_dict[name.strip()] = cum_time
+    top_list = sorted([(v, k) for k, v in top_dict.items()], reverse=True)
+    return time_sec, top_list, ''
+
+
+#####################################################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+
+    num_over = 0
+    print('{:<30} {:>10} {:>10}  {}'.format('script', 'time (s)', 'budget', 'status'))
+    for script in inps.script:
+        budget = budgetDict.get(script, defaultBudget) * inps.budget_scale
+        time_sec, top_list, msg = measure_import_time('pysar.{}'.format(script))
+        if time_sec is None:
+            print('{:<30} {:>10} {:>10.2f}  SKIP ({})'.format(script, '-', budget, msg))
+            continue
+
+        status = 'OK'
+        if time_sec > budget:
+            status = 'OVER BUDGET'
+            num_over += 1
+        print('{:<30} {:>10.2f} {:>10.2f}  {}'.format(script, time_sec, budget, status))
+        if time_sec > budget:
+            for t, name in top_list[:inps.num_top]:
+                print('    {:<26} {:>10.2f}'.format(name, t))
+
+    print('-'*50)
+    if num_over > 0:
+        raise RuntimeError('{} script(s) over the import time budget'.format(num_over))
+    print('Pass ALL import time budgets.')
+    return
+
+
+#####################################################################################
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# Test the COPY-based ingest of json_mbtiles2insarmaps.py against an in-process database stand-in
+
+
+import os
+import re
+import sys
+import copy
+import json
+import pickle
+import shutil
+import argparse
+import tempfile
+import threading
+
+# skip, instead of error, under pytest without the insarmaps dependencies
+if 'pytest' in sys.modules:
+    import pytest
+    for module_name in ['psycopg2', 'pycurl', 'requests']:
+        pytest.importorskip(module_name)
+
+from pysar import json_mbtiles2insarmaps as j2i
+
+
+#####################################################################################
+EXAMPLE = """example:
+  $PYSAR_HOME/test/test_json_mbtiles2insarmaps.py
+  $PYSAR_HOME/test/test_json_mbtiles2insarmaps.py  --num-chunk 20 --num-worker 8
+"""
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Test the COPY-based ingest of json_mbtiles2insarmaps.py '
+                                                 'with a fake connection pool.',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=EXAMPLE)
+    parser.add_argument('--num-chunk', dest='num_chunk', type=int, default=10,
+                        help='number of json chunks to load, default: 10.')
+    parser.add_argument('--num-worker', dest='num_worker', type=int, default=4,
+                        help='number of concurrent connections, default: 4.')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    return inps
+
+
+#####################################################################################
+class FakeDatabase:
+    """In-process stand-in of the insarmaps database, with transactions.
+    The state is a dict of table name to list of rows. Each connection queues its changes,
+    which are applied to the state on commit and discarded on rollback.
+    Parameters: fail_copy_at - int, raise error at the n-th (1-based) COPY
+                fail_sql     - str, raise error on the first statement starting with it
+    """
+    def __init__(self, fail_copy_at=None, fail_sql=None):
+        self.tables = {}
+        self.next_id = 1
+        self.num_copy = 0
+        self.fail_copy_at = fail_copy_at
+        self.fail_sql = fail_sql
+        self.lock = threading.Lock()
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.pending = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def view(self):
+        """database state as seen within the current transaction"""
+        with self.db.lock:
+            tables = copy.deepcopy(self.db.tables)
+        for func in self.pending:
+            func(tables)
+        return tables
+
+    def commit(self):
+        with self.db.lock:
+            for func in self.pending:
+                func(self.db.tables)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+
+class FakeCursor:
+    def __init__(self, con):
+        self.con = con
+        self.result = None
+
+    def execute(self, sql, params=()):
+        db = self.con.db
+        if db.fail_sql and sql.startswith(db.fail_sql):
+            db.fail_sql = None
+            raise RuntimeError('fake failure on: ' + sql)
+
+        tables = self.con.view()
+        names = re.findall(r'"([^"]+)"', sql)
+        if sql.startswith('DROP TABLE IF EXISTS'):
+            func = lambda t: t.pop(names[0], None)
+        elif sql.startswith('CREATE TABLE IF NOT EXISTS'):
+            func = lambda t: t.setdefault(sql.split()[5], [])
+        elif sql.startswith('CREATE TABLE'):
+            assert names[0] not in tables, 'table {} exists'.format(names[0])
+            func = lambda t: t.update({names[0]: []})
+        elif sql.startswith('ALTER TABLE'):
+            assert names[0] in tables and names[1] not in tables
+            func = lambda t: t.update({names[1]: t.pop(names[0])})
+        elif sql.startswith('INSERT INTO area'):
+            with db.lock:
+                area_id = db.next_id
+                db.next_id += 1
+            func = lambda t: t['area'].append((area_id,) + tuple(params))
+        elif sql.startswith('INSERT INTO'):
+            func = lambda t: t[sql.split()[2]].append(tuple(params))
+        elif sql.startswith('DELETE FROM'):
+            func = lambda t: t.update({sql.split()[2]: [i for i in t[sql.split()[2]] if i[0] != params[0]]})
+        elif sql.startswith('SELECT id FROM area'):
+            ids = [i[0] for i in tables.get('area', []) if i[1] == params[0]]
+            self.result = (ids[0],) if ids else None
+            return
+        elif sql.startswith(('CREATE INDEX', 'CLUSTER')):
+            return
+        else:
+            raise ValueError('un-supported SQL in fake cursor: ' + sql)
+        self.con.pending.append(func)
+
+    def fetchone(self):
+        return self.result
+
+    def copy_expert(self, sql, buf):
+        db = self.con.db
+        with db.lock:
+            db.num_copy += 1
+            num_copy = db.num_copy
+        if db.fail_copy_at and num_copy == db.fail_copy_at:
+            raise RuntimeError('fake failure at COPY {}'.format(num_copy))
+        table = re.findall(r'"([^"]+)"', sql)[0]
+        rows = buf.read().splitlines()
+        self.con.pending.append(lambda t: t[table].extend(rows))
+
+
+class FakePool:
+    """Stand-in of psycopg2.pool.ThreadedConnectionPool"""
+    def __init__(self, db):
+        self.db = db
+        self.num_out = 0
+
+    def getconn(self):
+        self.num_out += 1
+        return FakeConnection(self.db)
+
+    def putconn(self, con):
+        assert not con.pending, 'connection returned to pool within a transaction'
+        self.num_out -= 1
+
+
+#####################################################################################
+def write_dataset(out_dir, area, num_chunk, num_point=5):
+    """write metadata.pickle and json chunks as hdfeos5_2json_mbtiles.py does"""
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    metadata = {'area': area, 'project_name': 'test', 'mid_long': 130.0, 'mid_lat': 33.0,
+                'country': 'None', 'region': 'None', 'chunk_num': num_chunk,
+                'attribute_keys': ['mission'], 'attribute_values': ['ALOS'],
+                'string_dates_sql': ['20070101', '20070301'], 'decimal_dates_sql': [2007.0, 2007.16],
+                'attributes': {'mission': 'ALOS', 'plotAttributes': '[]'},
+                'needed_attributes': {'mission'}}
+    with open(os.path.join(out_dir, 'metadata.pickle'), 'wb') as f:
+        pickle.dump(metadata, f)
+
+    for i in range(num_chunk):
+        features = []
+        for j in range(num_point):
+            p = i * num_point + j
+            features.append({'type': 'Feature',
+                             'geometry': {'type': 'Point', 'coordinates': [130.0 + p * 1e-3, 33.0]},
+                             'properties': {'d': [0.0, p * 1e-3], 'm': p * 1e-3, 'p': p}})
+        with open(os.path.join(out_dir, 'chunk_{}.json'.format(i + 1)), 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    return metadata
+
+
+def get_dataset(db, area):
+    """return (area_id, num_point, attribute keys) of dataset in db"""
+    ids = [i[0] for i in db.tables.get('area', []) if i[1] == area]
+    assert len(ids) <= 1, 'duplicated entries of {} in area table'.format(area)
+    if not ids:
+        return None
+    area_id = ids[0]
+    keys = sorted(i[1] for i in db.tables['extra_attributes'] + db.tables['plot_attributes'] if i[0] == area_id)
+    return area_id, len(db.tables[str(area_id)]), keys
+
+
+#####################################################################################
+def check_copy_and_swap(work_dir, inps):
+    """chunks are loaded in parallel into the staging table, which then replaces the old dataset"""
+    db = FakeDatabase()
+    pool = FakePool(db)
+    area = 'ALOS_SM_424_0650_20070101_20070301'
+
+    write_dataset(work_dir, area, num_chunk=inps.num_chunk)
+    j2i.upload_json_copy(work_dir, pool=pool, num_worker=inps.num_worker)
+    area_id, num_point, keys = get_dataset(db, area)
+    assert num_point == inps.num_chunk * 5, 'loaded {} points'.format(num_point)
+    assert keys == ['mission', 'plotAttributes']
+    assert db.num_copy == inps.num_chunk
+
+    # upload again with less chunks: old dataset is replaced, not appended
+    write_dataset(work_dir, area, num_chunk=2)
+    j2i.upload_json_copy(work_dir, pool=pool, num_worker=inps.num_worker)
+    new_id, num_point, keys = get_dataset(db, area)
+    assert new_id != area_id
+    assert str(area_id) not in db.tables, 'old dataset table is not removed'
+    assert num_point == 10, 'loaded {} points'.format(num_point)
+    assert keys == ['mission', 'plotAttributes']
+    assert not any(i.startswith('staging_') for i in db.tables)
+    assert pool.num_out == 0
+    print('PASS: chunked parallel COPY and staging swap')
+
+
+def check_failure_keeps_old_dataset(work_dir, inps):
+    """a failure at COPY or at the swap leaves the old dataset in place"""
+    area = 'ALOS_SM_424_0650_20070101_20070301'
+    for fail_kwargs in [dict(fail_copy_at=inps.num_chunk + 2),
+                        dict(fail_sql='INSERT INTO area'),
+                        dict(fail_sql='ALTER TABLE')]:
+        db = FakeDatabase()
+        pool = FakePool(db)
+        write_dataset(work_dir, area, num_chunk=inps.num_chunk)
+        j2i.upload_json_copy(work_dir, pool=pool, num_worker=inps.num_worker)
+        old_dataset = get_dataset(db, area)
+
+        db.fail_copy_at = fail_kwargs.get('fail_copy_at', None)
+        db.fail_sql = fail_kwargs.get('fail_sql', None)
+        write_dataset(work_dir, area, num_chunk=inps.num_chunk * 2)
+        try:
+            j2i.upload_json_copy(work_dir, pool=pool, num_worker=1)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('failure is not raised with {}'.format(fail_kwargs))
+
+        assert get_dataset(db, area) == old_dataset, 'old dataset changed with {}'.format(fail_kwargs)
+        assert not any(i.startswith('staging_') for i in db.tables), 'staging table is left behind'
+        assert pool.num_out == 0
+        if 'fail_copy_at' in fail_kwargs:
+            # the remaining chunks are skipped after the failed one, with one worker
+            num_copy = db.num_copy - inps.num_chunk
+            assert num_copy == 2, 'COPY did not stop at the failed chunk: {} chunks'.format(num_copy)
+    print('PASS: failure at COPY / metadata insert / rename leaves the old dataset in place')
+
+
+# entry points for pytest
+def test_copy_and_swap(tmp_path):
+    check_copy_and_swap(str(tmp_path / 'JSON'), cmd_line_parse([]))
+
+
+def test_failure_keeps_old_dataset(tmp_path):
+    check_failure_keeps_old_dataset(str(tmp_path / 'JSON'), cmd_line_parse([]))
+
+
+#####################################################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    work_dir = tempfile.mkdtemp(prefix='test_insarmaps_')
+    try:
+        check_copy_and_swap(os.path.join(work_dir, 'JSON'), inps)
+        check_failure_keeps_old_dataset(os.path.join(work_dir, 'JSON'), inps)
+    finally:
+        shutil.rmtree(work_dir)
+    print('Test of json_mbtiles2insarmaps.py passed.')
+    return
+
+
+#####################################################################################
+if __name__ == '__main__':
+    main(sys.argv[1:])